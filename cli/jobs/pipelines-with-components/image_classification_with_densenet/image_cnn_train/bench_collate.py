@@ -0,0 +1,129 @@
+"""Compare fast_collate with the previous implementation, on its own and
+inside DataLoader workers where the new one writes straight into shared
+memory, and the CPU normalization of CPUPrefetchedWrapper with the
+per-batch .float().sub_(mean).div_(std) it replaces.
+
+    python bench_collate.py --batch-size 128 --workers 2
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from image_classification.dataloaders import CPUPrefetchedWrapper, fast_collate
+
+
+def legacy_fast_collate(batch):
+    imgs = [img[0] for img in batch]
+    targets = torch.tensor([target[1] for target in batch], dtype=torch.int64)
+    w = imgs[0].size[0]
+    h = imgs[0].size[1]
+    tensor = torch.zeros((len(imgs), 3, h, w), dtype=torch.uint8)
+    for i, img in enumerate(imgs):
+        nump_array = np.asarray(img, dtype=np.uint8)
+        tens = torch.from_numpy(nump_array)
+        if nump_array.ndim < 3:
+            nump_array = np.expand_dims(nump_array, axis=-1)
+        nump_array = np.rollaxis(nump_array, 2)
+
+        tensor[i] += torch.from_numpy(nump_array)
+
+    return tensor, targets
+
+
+class Images(torch.utils.data.Dataset):
+    """Already decoded and cropped images, so that only collation is
+    measured."""
+
+    def __init__(self, num_images, size, seed=0):
+        rng = np.random.default_rng(seed)
+        self.images = [
+            Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+            for _ in range(num_images)
+        ]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        return self.images[index], index % 1000
+
+
+def time_collate(collate, batch, repeat):
+    collate(batch)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        collate(batch)
+    return (time.perf_counter() - start) / repeat
+
+
+def time_loader(dataset, collate, batch_size, workers, epochs):
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, num_workers=workers, collate_fn=collate
+    )
+    for _ in loader:
+        pass
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for _ in loader:
+            pass
+    return epochs * len(dataset) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    dataset = Images(4 * args.batch_size, args.size)
+    batch = [dataset[i] for i in range(args.batch_size)]
+    assert all(
+        torch.equal(a, b)
+        for a, b in zip(fast_collate(batch), legacy_fast_collate(batch))
+    )
+
+    print("{:<40} {:>12}".format("collate, in process", "ms / batch"))
+    for name, collate in (
+        ("previous fast_collate", legacy_fast_collate),
+        ("fast_collate", fast_collate),
+    ):
+        print(
+            "{:<40} {:>12.2f}".format(
+                name, 1000 * time_collate(collate, batch, args.repeat)
+            )
+        )
+
+    print()
+    print(
+        "{:<40} {:>12}".format("DataLoader, {} workers".format(args.workers), "img/s")
+    )
+    for name, collate in (
+        ("previous fast_collate", legacy_fast_collate),
+        ("fast_collate", fast_collate),
+    ):
+        ips = time_loader(dataset, collate, args.batch_size, args.workers, 5)
+        print("{:<40} {:>12.0f}".format(name, ips))
+
+    print()
+    print("{:<40} {:>12}".format("normalization", "ms / batch"))
+    input, _ = fast_collate(batch)
+    mean = torch.tensor([0.485 * 255, 0.456 * 255, 0.406 * 255]).view(1, 3, 1, 1)
+    std = torch.tensor([0.229 * 255, 0.224 * 255, 0.225 * 255]).view(1, 3, 1, 1)
+    wrapper = CPUPrefetchedWrapper(None, 1000, False, False)
+    expected = input.float().sub_(mean).div_(std)
+    assert torch.allclose(wrapper._normalize(input, 0), expected, atol=1e-4)
+    for name, normalize in (
+        (".float().sub_(mean).div_(std)", lambda: input.float().sub_(mean).div_(std)),
+        ("CPUPrefetchedWrapper, reused buffer", lambda: wrapper._normalize(input, 0)),
+    ):
+        normalize()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            normalize()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print("{:<40} {:>12.2f}".format(name, 1000 * elapsed))
@@ -0,0 +1,106 @@
+"""Measure the cost of record() and the memory held by the latency and
+average/max meters of image_classification.logger over many samples, and
+how far the quantiles of QuantileSketch are from the exact ones.
+
+    python bench_meters.py --samples 10000000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from image_classification.logger import (
+    ArrayAverageMeter,
+    ArrayMaxMeter,
+    AverageMeter,
+    MaxMeter,
+    QuantileMeter,
+    QuantileSketch,
+)
+
+CHUNK = 100000
+
+
+def samples(num_samples, seed=0):
+    """Yields latency-like samples in chunks, so the benchmark itself does
+    not keep num_samples Python floats alive."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_samples, CHUNK):
+        yield rng.lognormal(-3, 0.5, min(CHUNK, num_samples - start))
+
+
+def fill(meter, num_samples, batched):
+    """Records num_samples values into meter, one record() call per value
+    or one per chunk, and returns the seconds spent inside record()."""
+    elapsed = 0.0
+    for chunk in samples(num_samples):
+        if batched:
+            start = time.perf_counter()
+            meter.record(chunk)
+            elapsed += time.perf_counter() - start
+        else:
+            values = chunk.tolist()
+            record = meter.record
+            start = time.perf_counter()
+            for v in values:
+                record(v)
+            elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def retained_bytes(make_meter, num_samples, batched):
+    """Returns the bytes still allocated by the meter after recording."""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    meter = make_meter()
+    fill(meter, num_samples, batched)
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, meter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--samples", type=int, default=10000000)
+    args = parser.parse_args()
+
+    meters = [
+        ("QuantileMeter(0.99)", lambda: QuantileMeter(0.99), False),
+        ("QuantileSketch(0.99)", lambda: QuantileSketch(0.99), False),
+        ("QuantileSketch(0.99), arrays", lambda: QuantileSketch(0.99), True),
+        ("AverageMeter", AverageMeter, False),
+        ("ArrayAverageMeter, arrays", ArrayAverageMeter, True),
+        ("MaxMeter", MaxMeter, False),
+        ("ArrayMaxMeter, arrays", ArrayMaxMeter, True),
+    ]
+
+    exact = np.concatenate(list(samples(args.samples)))
+    print("{} samples".format(args.samples))
+    print(
+        "{:<30} {:>12} {:>12} {:>12} {:>10}".format(
+            "meter", "ns/sample", "KiB held", "get_val ms", "rel. err"
+        )
+    )
+    for name, make_meter, batched in meters:
+        meter = make_meter()
+        elapsed = fill(meter, args.samples, batched)
+        held, _ = retained_bytes(make_meter, args.samples, batched)
+        start = time.perf_counter()
+        val, _ = meter.get_val()
+        get_val_ms = (time.perf_counter() - start) * 1000
+        if isinstance(meter, (QuantileMeter, QuantileSketch)):
+            reference = np.quantile(exact, meter.q, interpolation="nearest")
+        elif isinstance(meter, MaxMeter):
+            reference = exact.max()
+        else:
+            reference = exact.mean()
+        print(
+            "{:<30} {:>12.0f} {:>12.2f} {:>12.3f} {:>10.2e}".format(
+                name,
+                elapsed / args.samples * 1e9,
+                held / 2**10,
+                get_val_ms,
+                abs(val - reference) / reference,
+            )
+        )
@@ -0,0 +1,207 @@
+"""Measure the work lost to a preemption. A small model is trained
+until a simulated preemption at a given fraction of the epoch, the
+checkpoint is saved, and the job is restarted twice: once resuming from the
+mid-epoch checkpoint, skipping the consumed batches, and once replaying the
+epoch from its start as an epoch-level checkpoint would. Reading and
+decoding an image is simulated with --decode-ms of sleep. The batches go
+through the prefetch wrapper of the training script (PrefetchedWrapper on
+a GPU, CPUPrefetchedWrapper otherwise), and before measuring, a resumed
+epoch is checked to yield exactly the batches not consumed before.
+
+    python bench_preemption.py --images 4096 --batch-size 32 --workers 2
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from image_classification import utils
+from image_classification.dataloaders import (
+    ResumableSampler,
+    _prefetched_wrapper,
+    fast_collate,
+)
+from image_classification.training import lr_step_policy, train
+
+
+class SlowImages(torch.utils.data.Dataset):
+    def __init__(self, size, decode_ms):
+        self.size = size
+        self.decode_ms = decode_ms
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        # stands in for reading and decoding a JPEG
+        time.sleep(self.decode_ms / 1000)
+        image = np.random.default_rng(index).integers(0, 256, (32, 32, 3))
+        return image.astype(np.uint8), index % 10
+
+
+class SmallModelAndLoss(nn.Module):
+    def __init__(self):
+        super(SmallModelAndLoss, self).__init__()
+        self.arch = ("small", "cpu")
+        self.model = nn.Sequential(
+            nn.Conv2d(3, 32, 3, padding=1),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Linear(32, 10),
+        )
+        self.loss = nn.CrossEntropyLoss()
+
+    def forward(self, data, target):
+        output = self.model(data)
+        return self.loss(output, target), output
+
+
+class PreemptAfter(object):
+    """Reports preemption after the given number of training steps, and
+    records when that happened."""
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.preempted_at = None
+
+    def is_preempted(self):
+        if self.preempted_at is None:
+            self.steps -= 1
+            if self.steps <= 0:
+                self.preempted_at = time.perf_counter()
+        return self.preempted_at is not None
+
+
+def epoch_batches(loader, epoch, start_batch=0):
+    """The input batches of an epoch, from start_batch on, copied to the
+    host; the wrappers reuse their buffers."""
+    skipped = loader.set_epoch(epoch, start_batch)
+    assert skipped == start_batch, skipped
+    return [input.cpu().clone() for input, _ in loader]
+
+
+def check_resume(loader, num_batches):
+    """Checks that an epoch resumed at any point yields the batches of the
+    uninterrupted epoch that had not been consumed, once each."""
+    full = epoch_batches(loader, 1)
+    assert len(full) == num_batches, (len(full), num_batches)
+    for start_batch in [1, num_batches // 2, num_batches - 1, num_batches]:
+        resumed = epoch_batches(loader, 1, start_batch)
+        assert len(resumed) == num_batches - start_batch, (start_batch, len(resumed))
+        for expected, batch in zip(full[start_batch:], resumed):
+            assert torch.equal(expected, batch), start_batch
+
+
+def run_until(model_and_loss, optimizer, loader, steps, start_iteration=0):
+    """Trains epoch 0 from start_iteration for steps batches."""
+    detector = PreemptAfter(steps)
+    _, iteration = train(
+        loader,
+        model_and_loss,
+        optimizer,
+        lr_step_policy(0.1, [30], 0.1, 0),
+        False,
+        None,
+        0,
+        detector,
+        metrics_interval=10,
+        start_iteration=start_iteration,
+    )
+    return iteration, detector.preempted_at
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--images", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--decode-ms", type=float, default=2.0)
+    parser.add_argument("--preempt-at", type=float, nargs="+", default=[0.25, 0.5, 0.9])
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    dataset = SlowImages(args.images, args.decode_ms)
+    sampler = ResumableSampler(
+        torch.utils.data.distributed.DistributedSampler(dataset, num_replicas=1, rank=0)
+    )
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        sampler=sampler,
+        num_workers=args.workers,
+        collate_fn=fast_collate,
+        drop_last=True,
+    )
+    loader = _prefetched_wrapper()(dataloader, 10, False, False)
+    check_resume(loader, len(dataloader))
+    print(f"{type(loader).__name__} resumes each epoch where it stopped")
+
+    model_and_loss = SmallModelAndLoss()
+    if torch.cuda.is_available():
+        model_and_loss = model_and_loss.cuda()
+    optimizer = torch.optim.SGD(model_and_loss.parameters(), 0.1, momentum=0.9)
+
+    workdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for fraction in args.preempt_at:
+            steps = max(1, int(fraction * len(dataloader)))
+            iteration, _ = run_until(model_and_loss, optimizer, loader, steps)
+
+            start = time.perf_counter()
+            checkpointer = utils.AsyncCheckpointWriter(workdir)
+            checkpointer.save(
+                {
+                    "epoch": 0,
+                    "iteration": iteration,
+                    "rng_state": utils.get_rng_state(),
+                    "state_dict": model_and_loss.model.state_dict(),
+                    "optimizer": optimizer.state_dict(),
+                },
+                False,
+            )
+            blocked = time.perf_counter() - start
+            checkpointer.close()
+            saved = time.perf_counter() - start
+
+            # restart from the mid-epoch checkpoint
+            start = time.perf_counter()
+            checkpoint = utils.load_checkpoint(
+                os.path.join(workdir, "checkpoint.pth.tar")
+            )
+            model_and_loss.model.load_state_dict(checkpoint["state_dict"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            utils.set_rng_state(checkpoint["rng_state"])
+            _, done = run_until(
+                model_and_loss, optimizer, loader, 1, checkpoint["iteration"]
+            )
+            resumed = done - start
+
+            # restart from the start of the epoch
+            start = time.perf_counter()
+            _, done = run_until(model_and_loss, optimizer, loader, iteration + 1)
+            replayed = done - start
+
+            results.append((fraction, iteration, blocked, saved, resumed, replayed))
+    finally:
+        shutil.rmtree(workdir)
+
+    print("seconds from restart until the batch after the preemption is trained")
+    print(
+        "{:>10} {:>10} {:>12} {:>10} {:>12} {:>12}".format(
+            "preempted", "batch", "save blocks", "saved", "mid-epoch", "epoch start"
+        )
+    )
+    for fraction, iteration, blocked, saved, resumed, replayed in results:
+        print(
+            "{:>9.0%} {:>10} {:>12.3f} {:>10.3f} {:>12.2f} {:>12.2f}".format(
+                fraction, iteration, blocked, saved, resumed, replayed
+            )
+        )
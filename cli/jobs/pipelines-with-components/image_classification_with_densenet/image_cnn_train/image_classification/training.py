@@ -28,6 +28,7 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import os
+import itertools
 import time
 import numpy as np
 import torch
@@ -79,13 +80,34 @@ class PreemptDetector:
     def __init__(self):
         self.observer = Observer()
         self.event_handler = PreemptHandler()
+        self.preempted = False
+        self.group = None
 
     def run(self):
         self.observer.schedule(self.event_handler, DIRECTORY_TO_WATCH, recursive=False)
         self.observer.start()
+        if (
+            torch.distributed.is_initialized()
+            and torch.distributed.get_world_size() > 1
+        ):
+            # the flags are reduced on CPU, without waiting for the GPU
+            self.group = torch.distributed.new_group(backend="gloo")
 
     def is_preempted(self):
-        return self.event_handler.is_preempted.value == True
+        """True once any rank has seen the preemption signal. In a distributed
+        run this is a collective until it returns True: all ranks call it at
+        the same points and get the same answer, so they stop at the same
+        iteration and save the same checkpoint."""
+        if not self.preempted:
+            preempted = self.event_handler.is_preempted.value == True
+            if self.group is not None:
+                flag = torch.tensor([int(preempted)])
+                torch.distributed.all_reduce(
+                    flag, op=torch.distributed.ReduceOp.MAX, group=self.group
+                )
+                preempted = bool(flag.item())
+            self.preempted = preempted
+        return self.preempted
 
     def stop(self):
         self.observer.stop()
@@ -129,7 +151,11 @@ class ModelAndLoss(nn.Module):
         return loss, output
 
     def distributed(self):
-        self.model = DDP(self.model)
+        if next(self.model.parameters()).is_cuda:
+            self.model = DDP(self.model)
+        else:
+            # apex DDP only handles CUDA tensors
+            self.model = nn.parallel.DistributedDataParallel(self.model)
 
     def load_model_state(self, state):
         if not state is None:
@@ -270,10 +296,6 @@ def get_train_step(
         input_var = Variable(input)
         target_var = Variable(target)
         loss, output = model_and_loss(input_var, target_var)
-        if torch.distributed.is_initialized():
-            reduced_loss = utils.reduce_tensor(loss.data)
-        else:
-            reduced_loss = loss.data
 
         if fp16:
             optimizer.backward(loss)
@@ -296,9 +318,9 @@ def get_train_step(
             optimizer.step()
             optimizer.zero_grad()
 
-        torch.cuda.synchronize()
-
-        return reduced_loss
+        # The loss stays on the device, it is reduced across ranks and read
+        # back by DeviceMetrics every metrics_interval steps
+        return loss.detach()
 
     return _step
 
@@ -318,7 +340,14 @@ def train(
     register_metrics=True,
     total_train_step=0,
     writer=None,
+    metrics_interval=10,
+    start_iteration=0,
 ):
+    """Trains for one epoch, from batch start_iteration on.
+
+    Returns the total number of optimizer steps, and the number of batches
+    of the epoch consumed if it was cut short by preemption, else None.
+    """
     print(f"training...")
     print(f"register_metrics {register_metrics}, logger {logger}.")
     if register_metrics and logger is not None:
@@ -365,71 +394,83 @@ def train(
     end = time.time()
 
     optimizer.zero_grad()
-    last_train_step = total_train_step
-    data_iter = enumerate(train_loader)
+    skipped = train_loader.set_epoch(epoch, start_iteration)
+    data_iter = enumerate(train_loader, skipped)
+    if skipped < start_iteration:
+        # this loader cannot skip batches without loading them
+        data_iter = itertools.islice(data_iter, start_iteration - skipped, None)
     if logger is not None:
         data_iter = logger.iteration_generator_wrapper(data_iter)
     if prof > 0:
         data_iter = utils.first_n(prof, data_iter)
 
+    metrics = utils.DeviceMetrics(["loss"])
+    interval_start = end
+    interval_data_time = 0.0
+    lr = None
+
+    def log_interval():
+        # the only point where the loop waits for the device
+        steps = metrics.steps
+        values, n = metrics.reduce()
+        elapsed = time.time() - interval_start
+        compute_time = max(elapsed - interval_data_time, 1e-9)
+        if writer:
+            writer.add_scalar("train/summary/scalar/learning_rate", lr, epoch)
+            writer.add_scalar(
+                "train/summary/scalar/loss", values["loss"], total_train_step
+            )
+            writer.add_scalar(
+                "perf/summary/scalar/compute_ips", n / compute_time, total_train_step
+            )
+            writer.add_scalar(
+                "perf/summary/scalar/train_total_ips", n / elapsed, total_train_step
+            )
+            writer.log_row("train/learning_rate", x=epoch, y=lr)
+            writer.log_row("train/loss", x=total_train_step, y=values["loss"])
+            writer.log_row("perf/compute_ips", x=total_train_step, y=n / compute_time)
+            writer.log_row("perf/train_total_ips", x=total_train_step, y=n / elapsed)
+        if logger is not None:
+            logger.log_metric("train.loss", values["loss"], n)
+            logger.log_metric("train.compute_ips", n / compute_time)
+            logger.log_metric("train.total_ips", n / elapsed)
+            logger.log_metric("train.compute_time", compute_time / steps)
+
     for i, (input, target) in data_iter:
         bs = input.size(0)
         lr = lr_scheduler(optimizer, i, epoch)
         data_time = time.time() - end
+        interval_data_time += data_time
 
         optimizer_step = ((i + 1) % batch_size_multiplier) == 0
         loss = step(input, target, optimizer_step=optimizer_step)
-
-        it_time = time.time() - end
+        metrics.record([loss], bs)
 
         if optimizer_step:
-            if writer:
-                writer.add_scalar("train/summary/scalar/learning_rate", lr, epoch)
-                writer.add_scalar(
-                    "train/summary/scalar/loss", to_python_float(loss), total_train_step
-                )
-                writer.add_scalar(
-                    "perf/summary/scalar/compute_ips",
-                    calc_ips(bs, it_time - data_time),
-                    total_train_step,
-                )
-                writer.add_scalar(
-                    "perf/summary/scalar/train_total_ips",
-                    calc_ips(bs, it_time),
-                    total_train_step,
-                )
-                run.log_row("train/learning_rate", x=epoch, y=lr)
-                run.log_row("train/loss", x=total_train_step, y=to_python_float(loss))
-                run.log_row(
-                    "perf/compute_ips",
-                    x=total_train_step,
-                    y=calc_ips(bs, it_time - data_time),
-                )
-                run.log_row(
-                    "perf/train_total_ips", x=total_train_step, y=calc_ips(bs, it_time)
-                )
-
             total_train_step += 1
         if logger is not None:
-            logger.log_metric("train.loss", to_python_float(loss), bs)
-            logger.log_metric("train.compute_ips", calc_ips(bs, it_time - data_time))
-            logger.log_metric("train.total_ips", calc_ips(bs, it_time))
             logger.log_metric("train.data_time", data_time)
-            logger.log_metric("train.compute_time", it_time - data_time)
 
-        end = time.time()
+        if (i + 1) % metrics_interval == 0:
+            log_interval()
+            interval_start = time.time()
+            interval_data_time = 0.0
 
-        if writer:
-            writer.flush()
+        end = time.time()
 
         if detector.is_preempted():
             print(
                 datetime.utcnow(),
                 "Exit training loop detecting is_preempted changed to True",
             )
-            return last_train_step
+            # resume after the last optimizer step, gradients accumulated
+            # since then are lost
+            return total_train_step, i + 1 - (i + 1) % batch_size_multiplier
+
+    if metrics.steps:
+        log_interval()
 
-    return total_train_step
+    return total_train_step, None
 
 
 def get_val_step(model_and_loss):
@@ -442,16 +483,8 @@ def get_val_step(model_and_loss):
 
         prec1, prec5 = utils.accuracy(output.data, target, topk=(1, 5))
 
-        if torch.distributed.is_initialized():
-            reduced_loss = utils.reduce_tensor(loss.data)
-            prec1 = utils.reduce_tensor(prec1)
-            prec5 = utils.reduce_tensor(prec5)
-        else:
-            reduced_loss = loss.data
-
-        torch.cuda.synchronize()
-
-        return reduced_loss, prec1, prec5
+        # reduced across ranks and read back by DeviceMetrics
+        return loss.detach(), prec1, prec5
 
     return _step
 
@@ -465,6 +498,7 @@ def validate(
     detector,
     prof=-1,
     register_metrics=True,
+    metrics_interval=10,
 ):
     print(f"validating...")
     print(f"register_metrics {register_metrics}, logger {logger}.")
@@ -533,6 +567,7 @@ def validate(
     step = get_val_step(model_and_loss)
 
     top1 = log.AverageMeter()
+    loss_meter = log.AverageMeter()
     # switch to evaluate mode
     model_and_loss.eval()
 
@@ -544,31 +579,49 @@ def validate(
     if prof > 0:
         data_iter = utils.first_n(prof, data_iter)
 
-    loss_sum = 0.0
-    total_val_step = 0
+    metrics = utils.DeviceMetrics(["loss", "top1", "top5"])
+    latencies = utils.StepLatencies()
+    interval_start = end
+    interval_data_time = 0.0
+
+    def log_interval():
+        # the only point where the loop waits for the device
+        values, n = metrics.reduce()
+        # the steps are done after reduce(), reading their events does not wait
+        step_latencies = latencies.pop()
+        elapsed = time.time() - interval_start
+        compute_time = max(elapsed - interval_data_time, 1e-9)
+        top1.record(values["top1"], n)
+        loss_meter.record(values["loss"], n)
+        if logger is not None:
+            logger.log_metric("val.top1", values["top1"], n)
+            logger.log_metric("val.top5", values["top5"], n)
+            logger.log_metric("val.loss", values["loss"], n)
+            logger.log_metric("val.compute_ips", n / compute_time)
+            logger.log_metric("val.total_ips", n / elapsed)
+            for latency in step_latencies:
+                logger.log_metric("val.compute_latency", latency)
+                logger.log_metric("val.compute_latency_at95", latency)
+                logger.log_metric("val.compute_latency_at99", latency)
+                logger.log_metric("val.compute_latency_at100", latency)
+
     for i, (input, target) in data_iter:
         bs = input.size(0)
         data_time = time.time() - end
+        interval_data_time += data_time
 
+        start = latencies.start()
         loss, prec1, prec5 = step(input, target)
+        latencies.stop(start)
+        metrics.record([loss, prec1, prec5], bs)
 
-        it_time = time.time() - end
-
-        top1.record(to_python_float(prec1), bs)
         if logger is not None:
-            logger.log_metric("val.top1", to_python_float(prec1), bs)
-            logger.log_metric("val.top5", to_python_float(prec5), bs)
-            logger.log_metric("val.loss", to_python_float(loss), bs)
-            logger.log_metric("val.compute_ips", calc_ips(bs, it_time - data_time))
-            logger.log_metric("val.total_ips", calc_ips(bs, it_time))
             logger.log_metric("val.data_time", data_time)
-            logger.log_metric("val.compute_latency", it_time - data_time)
-            logger.log_metric("val.compute_latency_at95", it_time - data_time)
-            logger.log_metric("val.compute_latency_at99", it_time - data_time)
-            logger.log_metric("val.compute_latency_at100", it_time - data_time)
 
-        loss_sum += to_python_float(loss)
-        total_val_step += 1
+        if (i + 1) % metrics_interval == 0:
+            log_interval()
+            interval_start = time.time()
+            interval_data_time = 0.0
 
         end = time.time()
         if detector.is_preempted():
@@ -578,7 +631,10 @@ def validate(
             )
             break
 
-    return [top1, loss_sum / total_val_step]
+    if metrics.steps:
+        log_interval()
+
+    return [top1, loss_meter.get_val()[0]]
 
 
 # Train loop {{{
@@ -611,6 +667,9 @@ def train_loop(
     save_checkpoints=True,
     checkpoint_dir="./",
     total_train_step=0,
+    metrics_interval=10,
+    sharded_checkpoints=False,
+    start_iteration=0,
 ):
     is_first_rank = (
         not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0
@@ -624,14 +683,33 @@ def train_loop(
         print("tensorboard at ", logdir)
         if not os.path.exists(logdir):
             os.makedirs(logdir)
-        writer = SummaryWriter(log_dir=logdir)
+        writer = log.AsyncMetricsWriter(SummaryWriter(log_dir=logdir), run)
     else:
         writer = None
 
     prec1 = -1
+    checkpointer = utils.AsyncCheckpointWriter(
+        checkpoint_dir, sharded=sharded_checkpoints
+    )
     detector = PreemptDetector()
     detector.run()
 
+    def save_state(epoch_index, iteration, is_best):
+        checkpointer.save(
+            {
+                "epoch": epoch_index,
+                "iteration": iteration,
+                "rng_state": utils.get_rng_state(),
+                "arch": model_and_loss.arch,
+                "state_dict": model_and_loss.model.state_dict(),
+                "best_prec1": best_prec1,
+                "optimizer": optimizer.state_dict(),
+                "total_train_step": total_train_step,
+            },
+            is_best,
+            backup_filename=checkpoint_file_name,
+        )
+
     epoch_iter = range(start_epoch, epochs)
     for epoch in epoch_iter:
         world_size = (
@@ -641,12 +719,12 @@ def train_loop(
         )
         if writer:
             writer.add_scalar("train/summary/scalar/world_size", world_size, epoch)
-            run.log_row("train/world_size", x=epoch, y=world_size)
+            writer.log_row("train/world_size", x=epoch, y=world_size)
 
         if logger is not None:
             logger.start_epoch()
         if not skip_training:
-            total_train_step = train(
+            total_train_step, iteration = train(
                 train_loader,
                 model_and_loss,
                 optimizer,
@@ -661,7 +739,23 @@ def train_loop(
                 batch_size_multiplier=batch_size_multiplier,
                 total_train_step=total_train_step,
                 writer=writer,
+                metrics_interval=metrics_interval,
+                start_iteration=start_iteration if epoch == start_epoch else 0,
             )
+            if iteration is not None:
+                # Preempted part way through the epoch. Save the position
+                # right away, before anything else, so that a restart
+                # continues from this batch instead of replaying the epoch.
+                progress = (epoch, iteration) > (start_epoch, start_iteration)
+                if (is_first_rank or sharded_checkpoints) and progress:
+                    save_state(epoch, iteration, False)
+                print(
+                    datetime.utcnow(),
+                    "Exit epoch loop at iteration",
+                    iteration,
+                    "detecting is_preempted changed to True",
+                )
+                break
 
         if not skip_validation and not detector.is_preempted():
             top1, val_loss = validate(
@@ -673,36 +767,29 @@ def train_loop(
                 detector,
                 prof=prof,
                 register_metrics=epoch == start_epoch,
+                metrics_interval=metrics_interval,
             )
             if not detector.is_preempted():
                 prec1, nimg = top1.get_val()
                 if writer:
                     writer.add_scalar("val/summary/scalar/loss", val_loss, epoch)
                     writer.add_scalar("val/summary/scalar/prec1", prec1, epoch)
-                    run.log_row("val/loss", x=epoch, y=val_loss)
-                    run.log_row("val/prec1", x=epoch, y=prec1)
+                    writer.log_row("val/loss", x=epoch, y=val_loss)
+                    writer.log_row("val/prec1", x=epoch, y=prec1)
 
+        # checked once, on every rank, so that all ranks take the same path
+        preempted = detector.is_preempted()
         if logger is not None:
-            print(
-                "Epoch ", epoch, " complete with is_preempted ", detector.is_preempted()
-            )
+            print("Epoch ", epoch, " complete with is_preempted ", preempted)
             logger.end_epoch()
 
-        save_ckpt = is_first_rank and (
-            detector.is_preempted() or (epoch + 1) % save_checkpoint_epochs == 0
+        save_ckpt = (is_first_rank or sharded_checkpoints) and (
+            preempted or (epoch + 1) % save_checkpoint_epochs == 0
         )
 
-        if detector.is_preempted() and start_epoch == epoch:
-            print(
-                "Skipping save checkpoint since no complete epoch finishes till now. ",
-                start_epoch,
-                "-->",
-                epoch,
-            )
-            save_ckpt = False
         print(f"save ckpt {save_ckpt}, ckpt dir {checkpoint_dir}.")
         if save_ckpt:
-            if not skip_validation and not detector.is_preempted():
+            if not skip_validation and not preempted:
                 is_best = logger.metrics["val.top1"]["meter"].get_epoch() > best_prec1
                 best_prec1 = max(
                     logger.metrics["val.top1"]["meter"].get_epoch(), best_prec1
@@ -711,22 +798,10 @@ def train_loop(
                 is_best = False
                 best_prec1 = 0
 
-            ckpt_epoch_index = epoch + 1 if not detector.is_preempted() else epoch
-            utils.save_checkpoint(
-                {
-                    "epoch": ckpt_epoch_index,
-                    "arch": model_and_loss.arch,
-                    "state_dict": model_and_loss.model.state_dict(),
-                    "best_prec1": best_prec1,
-                    "optimizer": optimizer.state_dict(),
-                    "total_train_step": total_train_step,
-                },
-                is_best,
-                checkpoint_dir=checkpoint_dir,
-                backup_filename=checkpoint_file_name,
-            )
+            # the epoch is complete, also if preempted during validation
+            save_state(epoch + 1, 0, is_best)
 
-        if detector.is_preempted():
+        if preempted:
             print(
                 datetime.utcnow(),
                 "Exit epoch loop detecting is_preempted changed to True, save_ckpt:",
@@ -734,6 +809,8 @@ def train_loop(
             )
             break
 
+    # wait for the last checkpoint to be written before exiting
+    checkpointer.close()
     if writer:
         writer.close()
     detector.stop()
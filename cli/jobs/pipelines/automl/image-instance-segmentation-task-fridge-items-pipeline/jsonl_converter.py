@@ -1,10 +1,12 @@
 import argparse
+import collections
 import os
 import json
 import numpy as np
 import PIL.Image as Image
 import xml.etree.ElementTree as ET
 
+from concurrent.futures import ProcessPoolExecutor
 from simplification.cutil import simplify_coords
 from skimage import measure
 
@@ -37,34 +39,41 @@ def convert_mask_to_polygon(
     mask_array = np.array((mask > score_threshold), dtype=np.uint8)
     image_shape = mask_array.shape
 
+    # Only the bounding box of the object can hold contours, so the search
+    # runs on that crop and the contours are shifted back afterwards
+    rows = np.flatnonzero(mask_array.any(axis=1))
+    cols = np.flatnonzero(mask_array.any(axis=0))
+    if len(rows) == 0:
+        return []
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = cols[0], cols[-1] + 1
+
     # Pad the mask to avoid errors at the edge of the mask
     embedded_mask = np.zeros(
         (
-            image_shape[0] + 2 * edge_safety_padding,
-            image_shape[1] + 2 * edge_safety_padding,
+            bottom - top + 2 * edge_safety_padding,
+            right - left + 2 * edge_safety_padding,
         ),
         dtype=np.uint8,
     )
     embedded_mask[
-        edge_safety_padding : image_shape[0] + edge_safety_padding,
-        edge_safety_padding : image_shape[1] + edge_safety_padding,
-    ] = mask_array
+        edge_safety_padding : bottom - top + edge_safety_padding,
+        edge_safety_padding : right - left + edge_safety_padding,
+    ] = mask_array[top:bottom, left:right]
 
     # Find Image Contours
-    contours = measure.find_contours(embedded_mask, 0.5)
+    contours = [
+        contour + (top, left) for contour in measure.find_contours(embedded_mask, 0.5)
+    ]
     simplified_contours = []
 
     for contour in contours:
 
-        # Iteratively reduce polygon points, if necessary
-        if max_polygon_points is not None:
-            simplify_factor = 0
-            while (
-                len(contour) > max_polygon_points
-                and simplify_factor < max_refinement_iterations
-            ):
-                contour = simplify_coords(contour, simplify_factor)
-                simplify_factor += 1
+        # Reduce polygon points, if necessary
+        if max_polygon_points is not None and len(contour) > max_polygon_points:
+            contour = _simplify_contour(
+                contour, max_polygon_points, max_refinement_iterations
+            )
 
         # Convert to [x, y, x, y, ....] coordinates and correct for padding
         unwrapped_contour = [0] * (2 * len(contour))
@@ -76,6 +85,44 @@ def convert_mask_to_polygon(
     return _normalize_contour(simplified_contours, image_shape)
 
 
+def _simplify_contour(contour, max_polygon_points, max_refinement_iterations):
+    """Simplify a contour until it has at most max_polygon_points points,
+    with the smallest integer factor in [0, max_refinement_iterations) that
+    gets there, or with the largest one if none does.
+
+    Like the scan it replaces, each simplification starts from the
+    result of the largest factor known to leave too many points, so the
+    contour shrinks as the search goes on. Rather than trying every factor
+    in turn, the search probes 0, 1, 2, 4, ... and then bisects between
+    the last two probes, which takes about 2 * log2(factor) steps.
+    """
+    last_factor = max_refinement_iterations - 1
+    if last_factor < 0:
+        return contour
+
+    # lo is the largest factor known to leave too many points, and
+    # lo_contour the contour simplified up to that factor
+    lo, lo_contour = -1, contour
+    hi = 0
+    simplified = simplify_coords(lo_contour, hi)
+    while len(simplified) > max_polygon_points:
+        if hi == last_factor:
+            return np.asarray(simplified)
+        lo, lo_contour = hi, simplified
+        hi = min(max(2 * hi, 1), last_factor)
+        simplified = simplify_coords(lo_contour, hi)
+
+    # the smallest good factor is in (lo, hi], and hi is good
+    while hi - lo > 1:
+        factor = (lo + hi) // 2
+        candidate = simplify_coords(lo_contour, factor)
+        if len(candidate) <= max_polygon_points:
+            hi, simplified = factor, candidate
+        else:
+            lo, lo_contour = factor, candidate
+    return np.asarray(simplified)
+
+
 def _normalize_contour(contours, image_shape):
 
     height, width = image_shape[0], image_shape[1]
@@ -119,8 +166,94 @@ def parsing_mask(mask_fname):
     return polygons
 
 
-def convert_mask_in_VOC_to_jsonl(base_dir, remote_path):
+def _convert_annotation(annotation_fname, mask_fname, remote_path):
+    """Build the JSONL line for one PASCAL VOC annotation and its mask.
+
+    :param annotation_fname: Path of the annotation xml file
+    :type annotation_fname: String
+    :param mask_fname: Path of the color-encoded segmentation mask
+    :type mask_fname: String
+    :param remote_path: Prefix of the "images/" folder the image_url points to
+    :type remote_path: String
+    :return: JSON encoded line, without the trailing newline
+    :rtype: String
+    """
+    root = ET.parse(annotation_fname).getroot()
+
+    width = int(root.find("size/width").text)
+    height = int(root.find("size/height").text)
+    # convert mask into polygon
+    polygons = parsing_mask(mask_fname)
+
+    labels = []
+    for index, object in enumerate(root.findall("object")):
+        name = object.find("name").text
+        isCrowd = int(object.find("difficult").text)
+        labels.append(
+            {
+                "label": name,
+                "bbox": "null",
+                "isCrowd": isCrowd,
+                "polygon": polygons[index],
+            }
+        )
+
+    # build the jsonl line
+    image_filename = root.find("filename").text
+    _, file_extension = os.path.splitext(image_filename)
+    json_line = {
+        "image_url": remote_path + "images/" + image_filename,
+        "image_details": {
+            "format": file_extension[1:],
+            "width": width,
+            "height": height,
+        },
+        "label": labels,
+    }
+    return json.dumps(json_line)
+
+
+def _imap_ordered(executor, fn, tasks, max_pending):
+    """Run fn(*args) for each (tag, args) in tasks and yield the
+    (tag, result) pairs in input order as soon as they are available.
 
+    Tasks are submitted lazily, so at most max_pending of them (and their
+    results) are held in memory at any time. Without an executor the
+    tasks run one after the other in the current process.
+    """
+    if executor is None:
+        for tag, args in tasks:
+            yield tag, fn(*args)
+        return
+
+    pending = collections.deque()
+    for tag, args in tasks:
+        pending.append((tag, executor.submit(fn, *args)))
+        if len(pending) >= max_pending:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+    while pending:
+        tag, future = pending.popleft()
+        yield tag, future.result()
+
+
+def convert_mask_in_VOC_to_jsonl(base_dir, remote_path, num_workers=None):
+    """Convert the PASCAL VOC annotations and segmentation masks under
+    base_dir into the train and validation JSONL files.
+
+    Annotations are converted by a pool of num_workers processes and the
+    lines are written out in directory listing order as they complete,
+    with a bounded number of images in flight.
+
+    :param base_dir: Directory holding the "annotations" and
+    "segmentation-masks" folders
+    :type base_dir: String
+    :param remote_path: Prefix of the "images/" folder the image_url points to
+    :type remote_path: String
+    :param num_workers: Number of worker processes, defaults to the number of
+    CPUs. With 1 the conversion runs in the current process.
+    :type num_workers: Int
+    """
     src_images = base_dir
 
     # We'll copy each JSONL file within its related MLTable folder
@@ -141,63 +274,39 @@ def convert_mask_in_VOC_to_jsonl(base_dir, remote_path):
     annotations_folder = os.path.join(src_images, "annotations")
     mask_folder = os.path.join(src_images, "segmentation-masks")
 
-    # sample json line dictionary
-    json_line_sample = {
-        "image_url": remote_path,
-        "image_details": {"format": None, "width": None, "height": None},
-        "label": [],
-    }
-
-    # Read each annotation and convert it to jsonl line
-    with open(train_annotations_file, "w") as train_f:
-        with open(validation_annotations_file, "w") as validation_f:
-            for i, filename in enumerate(os.listdir(annotations_folder)):
-                if filename.endswith(".xml"):
-                    print("Parsing " + os.path.join(src_images, filename))
-
-                    root = ET.parse(
-                        os.path.join(annotations_folder, filename)
-                    ).getroot()
-
-                    width = int(root.find("size/width").text)
-                    height = int(root.find("size/height").text)
-                    # convert mask into polygon
-                    mask_fname = os.path.join(mask_folder, filename[:-4] + ".png")
-                    polygons = parsing_mask(mask_fname)
-
-                    labels = []
-                    for index, object in enumerate(root.findall("object")):
-                        name = object.find("name").text
-                        isCrowd = int(object.find("difficult").text)
-                        labels.append(
-                            {
-                                "label": name,
-                                "bbox": "null",
-                                "isCrowd": isCrowd,
-                                "polygon": polygons[index],
-                            }
-                        )
-
-                    # build the jsonl file
-                    image_filename = root.find("filename").text
-                    _, file_extension = os.path.splitext(image_filename)
-                    json_line = dict(json_line_sample)
-                    json_line["image_url"] = (
-                        json_line["image_url"] + "images/" + image_filename
-                    )
-                    json_line["image_details"]["format"] = file_extension[1:]
-                    json_line["image_details"]["width"] = width
-                    json_line["image_details"]["height"] = height
-                    json_line["label"] = labels
-
-                    if i % train_validation_ratio == 0:
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    def tasks():
+        for i, filename in enumerate(os.listdir(annotations_folder)):
+            if filename.endswith(".xml"):
+                print("Parsing " + os.path.join(src_images, filename))
+                is_validation = i % train_validation_ratio == 0
+                yield is_validation, (
+                    os.path.join(annotations_folder, filename),
+                    os.path.join(mask_folder, filename[:-4] + ".png"),
+                    remote_path,
+                )
+            else:
+                print("Skipping unknown file: {}".format(filename))
+
+    executor = ProcessPoolExecutor(num_workers) if num_workers > 1 else None
+    try:
+        # Read each annotation and convert it to jsonl line
+        with open(train_annotations_file, "w") as train_f:
+            with open(validation_annotations_file, "w") as validation_f:
+                for is_validation, line in _imap_ordered(
+                    executor, _convert_annotation, tasks(), 4 * num_workers
+                ):
+                    if is_validation:
                         # validation annotation
-                        validation_f.write(json.dumps(json_line) + "\n")
+                        validation_f.write(line + "\n")
                     else:
                         # train annotation
-                        train_f.write(json.dumps(json_line) + "\n")
-                else:
-                    print("Skipping unknown file: {}".format(filename))
+                        train_f.write(line + "\n")
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
 if __name__ == "__main__":
@@ -207,8 +316,20 @@ if __name__ == "__main__":
         type=str,
         help="the directory contains images, annotations, and masks",
     )
+    parser.add_argument(
+        "--remote_path",
+        type=str,
+        default="",
+        help="prefix of the images folder used in the image urls",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
 
     args, remaining_args = parser.parse_known_args()
     data_path = args.data_path
 
-    convert_mask_in_VOC_to_jsonl(data_path)
+    convert_mask_in_VOC_to_jsonl(data_path, args.remote_path, args.num_workers)
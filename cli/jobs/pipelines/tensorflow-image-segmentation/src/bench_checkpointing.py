@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Measures the time model.fit() is blocked by each checkpoint of CheckpointCallback,
+copying to the output dir synchronously or in a background thread, on the unet
+model with random images. The output mount is simulated by a local dir with
+copies slowed down to --mount_mbps. Also checks that a new model resumes
+from the last checkpoint with the same epoch, optimizer and weights.
+
+    python bench_checkpointing.py --steps 40 --every_steps 10 --mount_mbps 50
+"""
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from segmentation.model import load_model
+from tf_helper.checkpointing import CheckpointCallback
+
+
+class SlowMountCheckpointCallback(CheckpointCallback):
+    """Copies at mount_mbps MB/s at most."""
+
+    mount_mbps = None
+
+    def _copy_file(self, source, destination):
+        start_time = time.time()
+        super()._copy_file(source, destination)
+        copy_time = os.path.getsize(destination) / (self.mount_mbps * 2**20)
+        time.sleep(max(0.0, copy_time - (time.time() - start_time)))
+
+
+def build_model(args):
+    tf.keras.utils.set_random_seed(0)
+    model = load_model("unet", input_size=args.input_size, num_classes=3)
+    model.compile(optimizer="rmsprop", loss="sparse_categorical_crossentropy")
+    return model
+
+
+def build_dataset(args):
+    rng = np.random.default_rng(0)
+    images = rng.random((args.batch_size, args.input_size, args.input_size, 3))
+    masks = rng.integers(0, 3, (args.batch_size, args.input_size, args.input_size, 1))
+    return (
+        tf.data.Dataset.from_tensors((images.astype(np.float32), masks))
+        .repeat()
+        .take(args.steps)
+    )
+
+
+def measure(args, output_dir, async_copy):
+    """Returns the seconds of the epoch, and the list of stalls of each checkpoint."""
+    model = build_model(args)
+    dataset = build_dataset(args)
+    callbacks = []
+    stalls = []
+    if async_copy is not None:
+        checkpoint_callback = SlowMountCheckpointCallback(
+            model,
+            output_dir,
+            every_epochs=1,
+            every_steps=args.every_steps,
+            async_copy=async_copy,
+        )
+        save = checkpoint_callback.save
+        checkpoint_callback.save = lambda: stalls.append(save())
+        callbacks.append(checkpoint_callback)
+
+    # the first epoch builds the model, and its optimizer slots
+    model.fit(dataset.take(1), epochs=1, verbose=0)
+    start_time = time.time()
+    model.fit(dataset, epochs=1, verbose=0, callbacks=callbacks)
+    return time.time() - start_time, stalls, model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=40)
+    parser.add_argument("--every_steps", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--input_size", type=int, default=160)
+    parser.add_argument("--mount_mbps", type=float, default=50)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    SlowMountCheckpointCallback.mount_mbps = args.mount_mbps
+
+    root = tempfile.mkdtemp()
+    try:
+        print(
+            "{:<24} {:>10} {:>14} {:>14}".format(
+                "checkpointing", "epoch s", "checkpoints", "stall ms / ckpt"
+            )
+        )
+        for name, async_copy in [
+            ("none", None),
+            ("sync copy", False),
+            ("async copy", True),
+        ]:
+            output_dir = os.path.join(root, name.replace(" ", "_"))
+            elapsed, stalls, model = measure(args, output_dir, async_copy)
+            print(
+                "{:<24} {:>10.2f} {:>14} {:>14}".format(
+                    name,
+                    elapsed,
+                    len(stalls),
+                    f"{np.mean(stalls) * 1000:.0f}" if stalls else "-",
+                )
+            )
+
+        # resume from the last checkpoint of the async run
+        size = sum(
+            os.path.getsize(os.path.join(output_dir, file_name))
+            for file_name in os.listdir(output_dir)
+            if file_name.startswith(
+                os.path.basename(tf.train.latest_checkpoint(output_dir))
+            )
+        )
+        resumed_model = build_model(args)
+        initial_epoch = SlowMountCheckpointCallback(resumed_model, output_dir).restore()
+        resumed_model.fit(build_dataset(args).take(1), epochs=1, verbose=0)
+        # one more step on both, from the same state, gives the same weights
+        model.fit(build_dataset(args).take(1), epochs=1, verbose=0)
+        assert initial_epoch == 1, initial_epoch
+        assert int(resumed_model.optimizer.iterations.numpy()) == int(
+            model.optimizer.iterations.numpy()
+        )
+        for resumed_weights, weights in zip(
+            resumed_model.get_weights(), model.get_weights()
+        ):
+            np.testing.assert_allclose(resumed_weights, weights, rtol=1e-4, atol=1e-5)
+        print(
+            f"checkpoint of {size / 2**20:.1f} MiB, resumed at epoch {initial_epoch}, "
+            f"step {int(resumed_model.optimizer.iterations.numpy()) - 1}"
+        )
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,153 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Measures the training input pipeline of TensorflowDistributedModelTrainingSequence
+on synthetic jpg images and png masks, consumed with a simulated training
+step of --step_ms per batch, for several data loading settings: the previous
+pipeline (no prefetch, deterministic map), with prefetch, non-deterministic
+map, and memory or disk cache. Reports the first and later epochs' times,
+and the later epochs' input wait, as measured around next() here and as
+logged through LogTimeOfIterator at the end of each epoch.
+
+    python bench_input_pipeline.py --images 512 --epochs 3 --step_ms 50
+"""
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from segmentation.io import ImageAndMaskSequenceDataset
+from tf_helper.training import TensorflowDistributedModelTrainingSequence
+
+SETTINGS = [
+    ("previous", dict(prefetch_factor=0, deterministic=True)),
+    ("prefetch", dict(deterministic=True)),
+    ("prefetch, input wait logged", dict(deterministic=True, log_input_wait=True)),
+    ("prefetch, non-deterministic", dict()),
+    ("+ cache memory", dict(cache="memory")),
+    ("+ cache disk", dict(cache="disk")),
+]
+
+
+def make_dataset(root, num_images, seed=0):
+    """Writes jpg images of about 500x375 and png trimap masks."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(root, "images"))
+    os.makedirs(os.path.join(root, "masks"))
+    for i in range(num_images):
+        w, h = int(rng.integers(400, 600)), int(rng.integers(300, 450))
+        small = rng.integers(0, 256, (h // 8, w // 8, 3), dtype=np.uint8)
+        image = tf.image.resize(small, [h, w]).numpy().astype(np.uint8)
+        tf.io.write_file(
+            os.path.join(root, "images", f"{i:05d}.jpg"),
+            tf.io.encode_jpeg(image, quality=90),
+        )
+        mask = rng.integers(1, 4, (h, w, 1), dtype=np.uint8)
+        tf.io.write_file(
+            os.path.join(root, "masks", f"{i:05d}.png"), tf.io.encode_png(mask)
+        )
+
+
+def build_handler(args, root, settings):
+    """A training sequence with its datasets set up for a single node, without mlflow."""
+    config = argparse.Namespace(
+        batch_size=args.batch_size,
+        num_workers=tf.data.AUTOTUNE,
+        prefetch_factor=-1,
+        cache="none",
+        shuffle_buffer_size=1024,
+        deterministic=False,
+        log_input_wait=False,
+        model_input_size=args.input_size,
+        distributed_strategy="OneDeviceStrategy",
+    )
+    for key, value in settings.items():
+        setattr(config, key, value)
+
+    handler = TensorflowDistributedModelTrainingSequence()
+    handler.dataloading_config = handler.training_config = config
+    handler.nodes = 1
+    handler.worker_id = 0
+    handler.self_is_main_node = False
+    handler.cache_mode, _, handler.cache_dir = config.cache.partition(":")
+    if handler.cache_mode == "disk":
+        handler.cache_dir = handler.cache_dir or os.path.join(root, "cache")
+
+    helper = ImageAndMaskSequenceDataset(
+        images_dir=os.path.join(root, "images"),
+        masks_dir=os.path.join(root, "masks"),
+        images_filename_pattern="(.*)\\.jpg",
+        masks_filename_pattern="(.*)\\.png",
+        images_type="jpg",
+    )
+    dataset, loading_function = helper.dataset(input_size=args.input_size)
+    handler.setup_datasets(
+        dataset, loading_function, dataset, loading_function, len(helper)
+    )
+    return handler
+
+
+def measure(handler, args):
+    """Returns the seconds of each epoch, the seconds waiting for next() in each
+    epoch, and the input wait logged for each pass."""
+    epoch_times = []
+    epoch_waits = []
+    input_waits = []
+    iterator = iter(handler.training_dataset)
+    for _ in range(args.epochs):
+        start = time.time()
+        wait = 0.0
+        for _ in range(handler.training_steps_per_epoch):
+            wait_start = time.time()
+            next(iterator)
+            wait += time.time() - wait_start
+            # the training step
+            time.sleep(args.step_ms / 1000)
+        epoch_times.append(time.time() - start)
+        epoch_waits.append(wait)
+        # as CustomCallbacks does at the end of each epoch
+        metrics = handler.input_wait_logger.pop_metrics()
+        if "epoch_train_input_wait.time.sum" in metrics:
+            input_waits.append(metrics["epoch_train_input_wait.time.sum"])
+    return epoch_times, epoch_waits, input_waits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--input_size", type=int, default=160)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--step_ms", type=float, default=50)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    root = tempfile.mkdtemp()
+    try:
+        make_dataset(root, args.images)
+        print(
+            "{:<30} {:>10} {:>14} {:>10} {:>12}".format(
+                "input pipeline", "epoch 1 s", "later epochs s", "wait s", "logged s"
+            )
+        )
+        for name, settings in SETTINGS:
+            handler = build_handler(args, root, settings)
+            epoch_times, epoch_waits, input_waits = measure(handler, args)
+            print(
+                "{:<30} {:>10.2f} {:>14.2f} {:>10.2f} {:>12}".format(
+                    name,
+                    epoch_times[0],
+                    np.mean(epoch_times[1:]),
+                    np.mean(epoch_waits[1:]),
+                    f"{np.mean(input_waits[1:]):.2f}" if input_waits[1:] else "-",
+                )
+            )
+            shutil.rmtree(os.path.join(root, "cache"), ignore_errors=True)
+    finally:
+        shutil.rmtree(root)
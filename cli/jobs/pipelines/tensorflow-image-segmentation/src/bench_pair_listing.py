@@ -0,0 +1,163 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Measures ImageAndMaskHelper.build_pair_list() on a tree of empty jpg/png files
+(--dirs subdirectories of --files_per_dir files, for images and for masks),
+compared to the previous implementation (glob twice, regex in python):
+listing with the parallel walker, reusing a pairs index, and listing
+with --nodes processes, each one listing its part of the files.
+The round trip of listing a directory on a mounted storage is simulated
+by adding --scandir_latency_ms to each os.scandir() (used by glob too).
+
+    python bench_pair_listing.py --dirs 100 --files_per_dir 1000 --nodes 4 --scandir_latency_ms 50
+"""
+import os
+import re
+import glob
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+from segmentation.io import ImageAndMaskHelper
+
+
+def legacy_build_pair_list(images_dir, masks_dir):
+    """The previous build_pair_list()."""
+    masks_filename_pattern = re.compile("(.*)\\.png")
+    masks_paths = []
+    for file_path in glob.glob(masks_dir + "/**/*", recursive=True):
+        matches = masks_filename_pattern.match(os.path.basename(file_path))
+        if matches:
+            masks_paths.append((matches.group(1), file_path))
+    masks_paths = dict(masks_paths)
+
+    images_filename_pattern = re.compile("(.*)\\.jpg")
+    images_paths = []
+    for file_path in glob.glob(images_dir + "/**/*", recursive=True):
+        matches = images_filename_pattern.match(os.path.basename(file_path))
+        if matches:
+            images_paths.append((matches.group(1), file_path))
+
+    return [
+        (image_path, masks_paths[image_key])
+        for image_key, image_path in images_paths
+        if image_key in masks_paths
+    ]
+
+
+def slow_scandir(latency):
+    """os.scandir(), after latency seconds."""
+    scandir = os.scandir
+
+    def _scandir(path="."):
+        time.sleep(latency)
+        return scandir(path)
+
+    return _scandir
+
+
+def make_tree(root, dirs, files_per_dir):
+    for kind, extension in [("images", "jpg"), ("masks", "png")]:
+        for i in range(dirs):
+            dir_path = os.path.join(root, kind, f"{i:04d}")
+            os.makedirs(dir_path)
+            for j in range(files_per_dir):
+                open(
+                    os.path.join(dir_path, f"{i:04d}_{j:05d}.{extension}"), "w"
+                ).close()
+
+
+def build_pair_list(root, **kwargs):
+    helper = ImageAndMaskHelper(
+        images_dir=os.path.join(root, "images"),
+        masks_dir=os.path.join(root, "masks"),
+        images_filename_pattern="(.*)\\.jpg",
+        masks_filename_pattern="(.*)\\.png",
+    )
+    return helper.build_pair_list(**kwargs)
+
+
+def node_build_pair_list(root, index_path, nodes, node, results):
+    start_time = time.time()
+    pairs = build_pair_list(
+        root, index_path=index_path, num_shards=nodes, shard_index=node
+    )
+    results.put((node, time.time() - start_time, len(pairs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirs", type=int, default=100)
+    parser.add_argument("--files_per_dir", type=int, default=1000)
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--scandir_latency_ms", type=float, default=50)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, args.dirs, args.files_per_dir)
+        os.scandir = slow_scandir(args.scandir_latency_ms / 1000)
+        num_pairs = args.dirs * args.files_per_dir
+        print(
+            f"{num_pairs} images and {num_pairs} masks in {args.dirs} directories, "
+            f"{args.scandir_latency_ms} ms per directory listing"
+        )
+        print("{:<32} {:>10}".format("listing", "seconds"))
+
+        start_time = time.time()
+        assert (
+            len(
+                legacy_build_pair_list(
+                    *(os.path.join(root, kind) for kind in ["images", "masks"])
+                )
+            )
+            == num_pairs
+        )
+        print("{:<32} {:>10.2f}".format("previous (glob)", time.time() - start_time))
+
+        start_time = time.time()
+        assert len(build_pair_list(root)) == num_pairs
+        print("{:<32} {:>10.2f}".format("parallel scandir", time.time() - start_time))
+
+        index_path = os.path.join(root, "index", "train_pairs.json")
+        start_time = time.time()
+        assert len(build_pair_list(root, index_path=index_path)) == num_pairs
+        print(
+            "{:<32} {:>10.2f}".format(
+                "parallel scandir + write index", time.time() - start_time
+            )
+        )
+
+        start_time = time.time()
+        assert len(build_pair_list(root, index_path=index_path)) == num_pairs
+        print("{:<32} {:>10.2f}".format("reuse index", time.time() - start_time))
+
+        # a new index, each node (process) lists its part of the files
+        index_path = os.path.join(root, "index", "sharded_pairs.json")
+        results = multiprocessing.SimpleQueue()
+        processes = [
+            multiprocessing.Process(
+                target=node_build_pair_list,
+                args=(root, index_path, args.nodes, node, results),
+            )
+            for node in range(args.nodes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        node_results = [results.get() for _ in processes]
+        assert all(length == num_pairs for _, _, length in node_results)
+        print(
+            "{:<32} {:>10.2f}".format(
+                f"{args.nodes} nodes listing (slowest)",
+                max(elapsed for _, elapsed, _ in node_results),
+            )
+        )
+    finally:
+        shutil.rmtree(root)
@@ -7,6 +7,7 @@ This script provides some helper code to help with profiling tensorflow training
 import os
 import time
 import logging
+import threading
 import mlflow
 from typing import Any
 
@@ -148,6 +149,8 @@ class LogTimeOfIterator:
         self.iterator_times = []
         self.metrics = {}
         self.async_collector = async_collector
+        # next() runs in a tf.data thread when wrapped in a tf dataset
+        self._lock = threading.Lock()
 
         self._logger = logging.getLogger(__name__)
 
@@ -174,17 +177,36 @@ class LogTimeOfIterator:
         try:
             start_time = time.time()
             next_val = self.wrapped_iterator.__next__()
-            self.iterator_times.append(time.time() - start_time)
+            with self._lock:
+                self.iterator_times.append(time.time() - start_time)
             return next_val
         except StopIteration as e:
-            self.log_metrics()
+            # unless pop_metrics() already took them
+            if self.iterator_times:
+                self.log_metrics()
             raise e
 
+    def _time_metrics(self, iterator_times):
+        return {
+            f"{self.name}.count": len(iterator_times),
+            f"{self.name}.time.sum": sum(iterator_times),
+            f"{self.name}.time.first": iterator_times[0],
+        }
+
+    def pop_metrics(self):
+        """Returns the metrics of the next() calls since the last pop_metrics(),
+        and resets them. To call at the end of each epoch when the iterator is
+        not exhausted then (ex: followed by repeat() in a tf dataset)."""
+        with self._lock:
+            iterator_times, self.iterator_times = self.iterator_times, []
+            metrics, self.metrics = self.metrics, {}
+        if iterator_times:
+            metrics.update(self._time_metrics(iterator_times))
+        return metrics
+
     def log_metrics(self):
         """Logs metrics once iterator is finished"""
-        self.metrics[f"{self.name}.count"] = len(self.iterator_times)
-        self.metrics[f"{self.name}.time.sum"] = sum(self.iterator_times)
-        self.metrics[f"{self.name}.time.first"] = self.iterator_times[0]
+        self.metrics.update(self._time_metrics(self.iterator_times))
 
         if self.async_collector is not None:
             self._logger.info(f"Async MLFLOW: {self.metrics}")
@@ -64,12 +64,21 @@ def run(args):
             images_filename_pattern=args.images_filename_pattern,
             masks_filename_pattern=args.masks_filename_pattern,
             images_type=args.images_type,
+            listing_workers=args.listing_workers,
         )
 
         # the helper returns a dataset containing paths to images
         # and a loading function to use map() for loading the data
+        # DISTRIBUTED: with a pairs index, each node lists only its part of the files
         train_dataset, train_loading_function = train_dataset_helper.dataset(
-            input_size=args.model_input_size
+            input_size=args.model_input_size,
+            index_path=(
+                os.path.join(args.pairs_index_dir, "train_pairs.json")
+                if args.pairs_index_dir
+                else None
+            ),
+            num_shards=training_handler.nodes,
+            shard_index=training_handler.worker_id,
         )
 
         test_dataset_helper = ImageAndMaskSequenceDataset(
@@ -78,12 +87,20 @@ def run(args):
             images_filename_pattern=args.images_filename_pattern,
             masks_filename_pattern=args.masks_filename_pattern,
             images_type="png",  # masks need to be in png
+            listing_workers=args.listing_workers,
         )
 
         # the helper returns a dataset containing paths to images
         # and a loading function to use map() for loading the data
         val_dataset, val_loading_function = test_dataset_helper.dataset(
-            input_size=args.model_input_size
+            input_size=args.model_input_size,
+            index_path=(
+                os.path.join(args.pairs_index_dir, "test_pairs.json")
+                if args.pairs_index_dir
+                else None
+            ),
+            num_shards=training_handler.nodes,
+            shard_index=training_handler.worker_id,
         )
 
         training_handler.setup_datasets(
@@ -129,7 +146,7 @@ def run(args):
     # runs training sequence
     # NOTE: num_epochs is provided in args
     try:
-        training_handler.train()  # TODO: checkpoints_dir=args.checkpoints)
+        training_handler.train(checkpoints_dir=args.checkpoints)
     except RuntimeError as runtime_exception:  # if runtime error occurs (ex: cuda out of memory)
         # then print some runtime error report in the logs
         training_handler.runtime_error_report(runtime_exception)
@@ -209,6 +226,21 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         help="path to folder containing segmentation masks",
     )
 
+    group.add_argument(
+        "--pairs_index_dir",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to cache the lists of image/mask pairs, reused while the images/masks directories do not change (default: none)",
+    )
+    group.add_argument(
+        "--listing_workers",
+        type=int,
+        required=False,
+        default=16,
+        help="Number of directories listed in parallel when looking for images/masks (default: 16)",
+    )
+
     group = parser.add_argument_group("Training Outputs")
     group.add_argument(
         "--model_output",
@@ -224,6 +256,34 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         default=None,
         help="Path to read/write checkpoints",
     )
+    group.add_argument(
+        "--checkpoints_local_dir",
+        type=str,
+        required=False,
+        default=None,
+        help="Local path to write checkpoints to before copying them to --checkpoints (default: temp dir)",
+    )
+    group.add_argument(
+        "--checkpoint_every_epochs",
+        type=int,
+        required=False,
+        default=1,
+        help="Write a checkpoint every N epochs, 0 to disable (default: 1)",
+    )
+    group.add_argument(
+        "--checkpoint_every_steps",
+        type=int,
+        required=False,
+        default=0,
+        help="Write a checkpoint every N training steps, 0 to disable (default: 0)",
+    )
+    group.add_argument(
+        "--checkpoints_async_copy",
+        type=strtobool,
+        required=False,
+        default=True,
+        help="Copy checkpoints to --checkpoints in a background thread (default: True)",
+    )
     group.add_argument(
         "--register_model_as",
         type=str,
@@ -258,9 +318,29 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         "--cache",
         type=str,
         required=False,
-        choices=["none", "disk", "memory"],
         default="none",
-        help="Use cache either on DISK or in MEMORY, or NONE",
+        help="Cache loaded images: none, memory, disk (in a temp dir) or disk:<path> (ideally a local ssd)",
+    )
+    group.add_argument(
+        "--shuffle_buffer_size",
+        type=int,
+        required=False,
+        default=1024,
+        help="Shuffle buffer size for loaded images, when using cache (default: 1024)",
+    )
+    group.add_argument(
+        "--deterministic",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Keep the order of parallel image loading calls (default: False)",
+    )
+    group.add_argument(
+        "--log_input_wait",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Log the time spent waiting for the input pipeline in each epoch, costs a python call per batch (default: False)",
     )
 
     group = parser.add_argument_group("Model/Training Parameters")
@@ -5,13 +5,65 @@
 This script contains methods to hangle inputs for tensorflow model training.
 """
 import os
+import json
+import time
 import logging
-import glob
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import tensorflow
 
 
+def _scan_dir(dir_path):
+    """Lists a directory with a single scandir() call.
+
+    Returns:
+        files (List[str]), dirs (List[str]): full paths of files and subdirectories
+    """
+    files = []
+    dirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                dirs.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+    return files, dirs
+
+
+def list_files(root_dir, num_shards=1, shard_index=0, workers=16):
+    """Lists all files under root_dir, scanning the directories of each level in parallel.
+
+    Args:
+        root_dir (str): directory to walk
+        num_shards (int): split the listing between num_shards callers
+        shard_index (int): which part of the listing to return
+        workers (int): number of directories listed at the same time
+
+    Returns:
+        files (List[str]): full paths of the files, sorted
+
+    Notes:
+        Files and subdirectories of root_dir are split between shards
+        (in sorted order), a shard only walks its own subdirectories.
+    """
+    root_files, root_dirs = _scan_dir(root_dir)
+    files = sorted(root_files)[shard_index::num_shards]
+    pending_dirs = sorted(root_dirs)[shard_index::num_shards]
+
+    # on a mounted (blob) storage each scandir() is a round trip,
+    # so the directories of a same level are listed concurrently
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending_dirs:
+            next_dirs = []
+            for dir_files, dir_dirs in executor.map(_scan_dir, pending_dirs):
+                files.extend(dir_files)
+                next_dirs.extend(dir_dirs)
+            pending_dirs = next_dirs
+
+    return sorted(files)
+
+
 class ImageAndMaskHelper:
     """Helps locating images and masks for training a segmentation model"""
 
@@ -22,6 +74,7 @@ class ImageAndMaskHelper:
         images_filename_pattern: str,
         masks_filename_pattern: str,
         images_type: str = "png",
+        listing_workers: int = 16,
     ):
         """Initialize the helper class.
 
@@ -31,6 +84,7 @@ class ImageAndMaskHelper:
             images_filename_pattern (str) : regex to locate images in images_dir
             masks_filename_pattern (str) : regex to locate masks in masks_dir (and match images based on group(1))
             images_type (str) : type of the images in images_dir (jpg or png)
+            listing_workers (int) : number of directories listed in parallel
 
         Notes:
             masks have to be PNG
@@ -38,72 +92,231 @@ class ImageAndMaskHelper:
         """
         self.images_dir = images_dir
         self.masks_dir = masks_dir
-        self.images_filename_pattern = images_filename_pattern
+        self.images_filename_pattern = re.compile(images_filename_pattern)
         self.masks_filename_pattern = re.compile(masks_filename_pattern)
         self.images_type = images_type
+        self.listing_workers = listing_workers
         self.logger = logging.getLogger(__name__)
 
         # paths as tuples
         self.image_masks_pairs = []
+        self.parsing_stats = {}
         # paths as slices
         self.images = []
         self.masks = []
 
-    def build_pair_list(self):
+    def _fingerprint(self):
+        """Identifies the content of images_dir/masks_dir for a cached index:
+        the patterns, and the modification time of both directories.
+
+        Notes:
+            changes within subdirectories do not modify this fingerprint,
+            delete the index to force listing the files again.
+        """
+        return "|".join(
+            [
+                self.images_filename_pattern.pattern,
+                self.masks_filename_pattern.pattern,
+                str(os.stat(self.images_dir).st_mtime_ns),
+                str(os.stat(self.masks_dir).st_mtime_ns),
+            ]
+        )
+
+    def _list_matching(self, root_dir, pattern, num_shards, shard_index, not_matching):
+        """Lists files under root_dir whose name matches pattern.
+
+        Returns:
+            matching (List[tuple(str, str)]): group(1) of the match, path relative to root_dir
+        """
+        matching = []
+        # scandir() paths all start with root_dir and a separator
+        prefix_length = len(os.path.join(root_dir, ""))
+        for file_path in list_files(
+            root_dir, num_shards, shard_index, workers=self.listing_workers
+        ):
+            matches = pattern.match(os.path.basename(file_path))
+            if matches:
+                matching.append((matches.group(1), file_path[prefix_length:]))
+            else:
+                # keep some stats
+                self.parsing_stats[not_matching] += 1
+        return matching
+
+    def _read_index(self, index_path, fingerprint):
+        """Returns the content of the json index at index_path, or None if it
+        does not exist (yet) or is for another fingerprint."""
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        if index.get("fingerprint") != fingerprint:
+            return None
+        return index
+
+    def _write_index(self, index_path, index):
+        """Writes a json index, so that readers never see a partial file."""
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        with open(index_path + ".tmp", "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(index_path + ".tmp", index_path)
+
+    def _list_shards(self, index_path, fingerprint, num_shards, shard_index, timeout):
+        """Lists this shard of images_dir/masks_dir, shares it next to index_path,
+        and waits for the listings of the other shards.
+
+        Returns:
+            images (List), masks (List): group(1) and relative path of all images and masks,
+            or None if the other shards did not show up before timeout.
+        """
+        shard_path = f"{index_path}.shard{shard_index}of{num_shards}"
+        self._write_index(
+            shard_path,
+            {
+                "fingerprint": fingerprint,
+                "images": self._list_matching(
+                    self.images_dir,
+                    self.images_filename_pattern,
+                    num_shards,
+                    shard_index,
+                    "images_not_matching",
+                ),
+                "masks": self._list_matching(
+                    self.masks_dir,
+                    self.masks_filename_pattern,
+                    num_shards,
+                    shard_index,
+                    "masks_not_matching",
+                ),
+                "parsing_stats": self.parsing_stats,
+            },
+        )
+
+        images = []
+        masks = []
+        parsing_stats = {"masks_not_matching": 0, "images_not_matching": 0}
+        start_time = time.time()
+        for index in range(num_shards):
+            shard_path = f"{index_path}.shard{index}of{num_shards}"
+            while True:
+                shard = self._read_index(shard_path, fingerprint)
+                if shard is not None:
+                    break
+                if time.time() - start_time > timeout:
+                    self.logger.warning(
+                        f"Listing {shard_path} not found after {timeout}s, listing all files instead."
+                    )
+                    return None, None
+                time.sleep(1.0)
+            images.extend(shard["images"])
+            masks.extend(shard["masks"])
+            for key in parsing_stats:
+                parsing_stats[key] += shard["parsing_stats"][key]
+
+        self.parsing_stats.update(parsing_stats)
+        return images, masks
+
+    def build_pair_list(
+        self,
+        index_path: str = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        timeout: float = 600,
+    ):
         """Builds a list of pairs of paths to image/mask.
 
+        Args:
+            index_path (str) : json file to cache the list of pairs in, reused if
+                images_dir/masks_dir did not change (ideally on a path shared between nodes)
+            num_shards (int) : number of nodes listing files at the same time (requires index_path)
+            shard_index (int) : index of this node
+            timeout (float) : seconds to wait for the listings of the other nodes
+
         Returns:
             image_masks_pairs (List[tuple(str, str)])
+
+        Notes:
+            with num_shards > 1, each node lists its part of the files, and
+            shares it next to index_path, all nodes end up with the same list of pairs.
         """
-        parsing_stats = {
+        self.parsing_stats = {
             "masks_not_matching": 0,
             "images_not_matching": 0,
             "images_without_masks": 0,
         }
-        # search for all masks matching file name pattern
-        masks_filename_pattern = re.compile(self.masks_filename_pattern)
 
-        masks_paths = []
-        for file_path in glob.glob(self.masks_dir + "/**/*", recursive=True):
-            matches = masks_filename_pattern.match(os.path.basename(file_path))
-            if matches:
-                masks_paths.append((matches.group(1), file_path))
-            else:
-                # keep some stats
-                parsing_stats["masks_not_matching"] += 1
-        masks_paths = dict(masks_paths)  # turn list of tuples into a map
-
-        # search for all images matching file name pattern
-        images_filename_pattern = re.compile(self.images_filename_pattern)
-        images_paths = []
-        for file_path in glob.glob(self.images_dir + "/**/*", recursive=True):
-            matches = images_filename_pattern.match(os.path.basename(file_path))
-            if matches:
-                images_paths.append((matches.group(1), file_path))
-            else:
-                # keep some stats
-                parsing_stats["images_not_matching"] += 1
+        fingerprint = None
+        pairs = None
+        if index_path:
+            fingerprint = self._fingerprint()
+            index = self._read_index(index_path, fingerprint)
+            if index is not None:
+                self.logger.info(f"Reusing the list of pairs from {index_path}")
+                pairs = index["pairs"]
+                self.parsing_stats = index["parsing_stats"]
+
+        if pairs is None:
+            images_paths = None
+            if index_path and num_shards > 1:
+                images_paths, masks_paths = self._list_shards(
+                    index_path, fingerprint, num_shards, shard_index, timeout
+                )
+            if images_paths is None:
+                self.parsing_stats["images_not_matching"] = 0
+                self.parsing_stats["masks_not_matching"] = 0
+
+                # search for all images and masks matching file name patterns
+                images_paths = self._list_matching(
+                    self.images_dir,
+                    self.images_filename_pattern,
+                    1,
+                    0,
+                    "images_not_matching",
+                )
+                masks_paths = self._list_matching(
+                    self.masks_dir,
+                    self.masks_filename_pattern,
+                    1,
+                    0,
+                    "masks_not_matching",
+                )
+            masks_paths = dict(masks_paths)  # turn list of tuples into a map
+
+            # now match images and masks
+            pairs = []
+            for image_key, image_path in sorted(images_paths, key=lambda x: x[1]):
+                if image_key in masks_paths:
+                    pairs.append((image_path, masks_paths[image_key]))
+                else:
+                    self.logger.debug(
+                        f"Image {image_path} doesn't have a corresponding mask."
+                    )
+                    # keep some stats
+                    self.parsing_stats["images_without_masks"] += 1
+
+            if index_path and shard_index == 0:
+                self._write_index(
+                    index_path,
+                    {
+                        "fingerprint": fingerprint,
+                        "pairs": pairs,
+                        "parsing_stats": self.parsing_stats,
+                    },
+                )
 
-        # now match images and masks
         self.images = []  # list of images
         self.masks = []  # list of masks (ordered like self.images)
         self.image_masks_pairs = []  # list of tuples
+        for image_path, mask_path in pairs:
+            image_path = os.path.join(self.images_dir, image_path)
+            mask_path = os.path.join(self.masks_dir, mask_path)
+            self.images.append(image_path)
+            self.masks.append(mask_path)
+            self.image_masks_pairs.append((image_path, mask_path))
 
-        for image_key, image_path in images_paths:
-            if image_key in masks_paths:
-                self.images.append(image_path)
-                self.masks.append(masks_paths[image_key])
-                self.image_masks_pairs.append((image_path, masks_paths[image_key]))
-            else:
-                self.logger.debug(
-                    f"Image {image_path} doesn't have a corresponding mask."
-                )
-                # keep some stats
-                parsing_stats["images_without_masks"] += 1
-
-        parsing_stats["found_pairs"] = len(self.image_masks_pairs)
+        self.parsing_stats["found_pairs"] = len(self.image_masks_pairs)
 
-        self.logger.info(f"Finished parsing images/masks paths: {parsing_stats}")
+        self.logger.info(f"Finished parsing images/masks paths: {self.parsing_stats}")
 
         return self.image_masks_pairs
 
@@ -139,10 +352,15 @@ class ImageAndMaskSequenceDataset(ImageAndMaskHelper):
 
         return image, mask
 
-    def dataset(self, input_size=160):
-        """Creates a tf dataset and a loading function."""
+    def dataset(self, input_size=160, **kwargs):
+        """Creates a tf dataset and a loading function.
+
+        Args:
+            input_size (int): size of the loaded images
+            kwargs: passed to build_pair_list()
+        """
         # builds the list of pairs
-        self.build_pair_list()
+        self.build_pair_list(**kwargs)
 
         # https://cs230.stanford.edu/blog/datapipeline/#best-practices
         with tensorflow.device("CPU"):
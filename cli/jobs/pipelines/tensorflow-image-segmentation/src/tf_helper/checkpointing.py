@@ -0,0 +1,196 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+This script provides a keras callback to checkpoint a model during model.fit(),
+writing on local disk first and copying to the (slower) output mount in the background.
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+import tensorflow as tf
+from tensorflow import keras
+
+
+class CheckpointCallback(keras.callbacks.Callback):
+    """To use during model.fit(), saves model, optimizer and epoch every N epochs
+    and/or every N steps with a tf.train.CheckpointManager."""
+
+    def __init__(
+        self,
+        model,
+        output_dir,
+        local_dir=None,
+        every_epochs=1,
+        every_steps=0,
+        max_to_keep=3,
+        async_copy=True,
+        is_chief=True,
+        async_collector=None,
+    ):
+        """Constructor.
+
+        Args:
+            model (keras.Model): compiled model to checkpoint (with its optimizer)
+            output_dir (str): where checkpoints are copied to, and restored from
+            local_dir (str): where checkpoints are written first (default: temp dir)
+            every_epochs (int): checkpoint every N epochs (0 to disable)
+            every_steps (int): checkpoint every N training steps (0 to disable)
+            max_to_keep (int): number of checkpoints kept
+            async_copy (bool): copy to output_dir in a background thread
+            is_chief (bool): only the chief writes checkpoints to output_dir
+            async_collector (dict): to report checkpoint metrics at the end of each epoch
+        """
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+
+        self.output_dir = output_dir
+        self.every_epochs = every_epochs
+        self.every_steps = every_steps
+        self.async_copy = async_copy
+        self.is_chief = is_chief
+        self.async_collector = async_collector if async_collector is not None else {}
+
+        # DISTRIBUTED: with MultiWorkerMirroredStrategy, all workers need to call save()
+        # (reading the variables may need collective ops), but only the chief keeps
+        # its checkpoints, the others write in a temporary dir
+        self.local_tmp_dir = None
+        if local_dir is None or not is_chief:
+            self.local_tmp_dir = tempfile.TemporaryDirectory()
+            local_dir = self.local_tmp_dir.name
+        self.local_dir = local_dir
+
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(
+            model=model, optimizer=model.optimizer, epoch=self.epoch
+        )
+        self.manager = tf.train.CheckpointManager(
+            self.checkpoint,
+            self.local_dir,
+            max_to_keep=max_to_keep if is_chief else 1,
+        )
+
+        self.steps = 0
+        self.copy_thread = None
+        self.copy_exception = None
+
+    def restore(self):
+        """Restores the latest checkpoint from output_dir, if any.
+
+        Returns:
+            initial_epoch (int): the epoch to start training from
+        """
+        latest_checkpoint = tf.train.latest_checkpoint(self.output_dir)
+        if latest_checkpoint is None:
+            self.logger.info(f"No checkpoint to restore in {self.output_dir}")
+            return 0
+
+        self.logger.info(f"Restoring checkpoint {latest_checkpoint}")
+        # NOTE: optimizer slots are restored when created, at the first training step
+        self.checkpoint.restore(latest_checkpoint)
+        return int(self.epoch.numpy())
+
+    def _copy_file(self, source, destination):
+        """Copies one file, so that a partial copy never has the final name."""
+        shutil.copyfile(source, destination + ".tmp")
+        os.replace(destination + ".tmp", destination)
+
+    def _copy(self, checkpoint_path):
+        """Copies a checkpoint from local_dir to output_dir."""
+        try:
+            start_time = time.time()
+            os.makedirs(self.output_dir, exist_ok=True)
+            prefix = os.path.basename(checkpoint_path)
+            for file_name in os.listdir(self.local_dir):
+                if file_name.startswith(prefix + "."):
+                    self._copy_file(
+                        os.path.join(self.local_dir, file_name),
+                        os.path.join(self.output_dir, file_name),
+                    )
+
+            # the state file lists the checkpoints to keep (with relative paths),
+            # it is copied last so that it only points to complete checkpoints
+            self._copy_file(
+                os.path.join(self.local_dir, "checkpoint"),
+                os.path.join(self.output_dir, "checkpoint"),
+            )
+
+            # remove checkpoints that the manager has dropped
+            kept_prefixes = [
+                os.path.basename(path) + "." for path in self.manager.checkpoints
+            ]
+            for file_name in os.listdir(self.output_dir):
+                if file_name.startswith("ckpt-") and not any(
+                    file_name.startswith(kept_prefix) for kept_prefix in kept_prefixes
+                ):
+                    os.remove(os.path.join(self.output_dir, file_name))
+
+            self.async_collector["checkpoint_copy_time"] = time.time() - start_time
+        except Exception as e:
+            self.copy_exception = e
+
+    def wait(self):
+        """Waits for the copy of the last checkpoint (raises if it failed)."""
+        if self.copy_thread is not None:
+            self.copy_thread.join()
+            self.copy_thread = None
+        if self.copy_exception is not None:
+            copy_exception, self.copy_exception = self.copy_exception, None
+            raise copy_exception
+
+    def save(self):
+        """Saves a checkpoint locally, then copies it to output_dir.
+        Returns the time during which training is blocked."""
+        start_time = time.time()
+
+        # the previous copy needs to finish first, the manager could delete its files
+        self.wait()
+
+        checkpoint_path = self.manager.save(checkpoint_number=self.steps)
+        self.logger.info(f"Saved checkpoint {checkpoint_path}")
+
+        if self.is_chief:
+            if self.async_copy:
+                # not a daemon, so that the last copy completes before exiting
+                self.copy_thread = threading.Thread(
+                    target=self._copy, args=(checkpoint_path,)
+                )
+                self.copy_thread.start()
+            else:
+                self._copy(checkpoint_path)
+                self.wait()
+
+        stall_time = time.time() - start_time
+        self.async_collector["epoch_checkpoint_count"] = (
+            self.async_collector.get("epoch_checkpoint_count", 0) + 1
+        )
+        self.async_collector["epoch_checkpoint_stall_time"] = (
+            self.async_collector.get("epoch_checkpoint_stall_time", 0.0) + stall_time
+        )
+        return stall_time
+
+    def on_train_begin(self, logs=None):
+        self.steps = int(self.model.optimizer.iterations.numpy())
+
+    def on_epoch_begin(self, epoch, logs=None):
+        # a checkpoint within this epoch resumes at the start of this epoch
+        self.epoch.assign(epoch)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        if self.every_steps > 0 and self.steps % self.every_steps == 0:
+            self.save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.every_epochs > 0 and (epoch + 1) % self.every_epochs == 0:
+            self.epoch.assign(epoch + 1)
+            self.save()
+
+    def on_train_end(self, logs=None):
+        self.wait()
+        if self.local_tmp_dir is not None:
+            self.local_tmp_dir.cleanup()
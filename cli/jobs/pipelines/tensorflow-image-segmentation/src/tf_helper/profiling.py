@@ -16,7 +16,16 @@ from common.profiling import LogTimeOfIterator
 class CustomCallbacks(keras.callbacks.Callback):
     """To use during model.fit()"""
 
-    def __init__(self, enabled=True):
+    def __init__(self, enabled=True, async_collector=None, timed_iterators=None):
+        """Constructor.
+
+        Args:
+            enabled (bool): log metrics in mlflow
+            async_collector (dict): metrics written by others during the epoch
+                (ex: CheckpointCallback), logged and emptied at the end of each epoch
+            timed_iterators (List[LogTimeOfIterator]): iterators whose metrics
+                are popped and logged at the end of each epoch
+        """
         self.logger = logging.getLogger(__name__)
 
         self.metrics = {}
@@ -25,6 +34,8 @@ class CustomCallbacks(keras.callbacks.Callback):
         self.epoch_end = time.time()  # required for 1st epoch_init_time
         self.test_start = None
         self.enabled = enabled
+        self.async_collector = async_collector
+        self.timed_iterators = timed_iterators or []
 
     def _flush(self):
         self.logger.info(f"MLFLOW: metrics={self.metrics}")
@@ -54,6 +65,15 @@ class CustomCallbacks(keras.callbacks.Callback):
             else:
                 self.metrics[f"epoch_train_{key}"] = logs[key]
 
+        # metrics collected asynchronously since last epoch
+        if self.async_collector:
+            self.metrics.update(self.async_collector)
+            self.async_collector.clear()
+
+        # the iterators are repeated, they do not finish at the end of an epoch
+        for timed_iterator in self.timed_iterators:
+            self.metrics.update(timed_iterator.pop_metrics())
+
         self.epoch_end = time.time()
 
         self._flush()
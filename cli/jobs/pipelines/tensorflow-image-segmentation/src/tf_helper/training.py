@@ -25,7 +25,8 @@ import numpy as np
 # tensorflow imports
 import tensorflow as tf
 
-from tf_helper.profiling import CustomCallbacks
+from tf_helper.profiling import CustomCallbacks, LogTimeOfTensorFlowIterator
+from tf_helper.checkpointing import CheckpointCallback
 from common.nvml import get_nvml_params
 
 
@@ -42,6 +43,12 @@ class TensorflowDistributedModelTrainingSequence:
         self.training_dataset_length = None
         self.training_steps_per_epoch = None
         self.validation_dataset = None
+        self.cache_mode = "none"
+        self.cache_dir = None
+        # filled during each epoch (checkpoints), logged by CustomCallbacks
+        self.async_metrics = {}
+        # times the input pipeline, its metrics are popped by CustomCallbacks
+        self.input_wait_logger = None
 
         # MODEL
         self.model = None
@@ -79,6 +86,18 @@ class TensorflowDistributedModelTrainingSequence:
             )
             self.dataloading_config.prefetch_factor = 0
 
+        # cache can be "none", "memory", "disk" (in a temp dir) or "disk:<path>"
+        self.cache_mode, _, self.cache_dir = self.dataloading_config.cache.partition(
+            ":"
+        )
+        if self.cache_mode not in ("none", "memory", "disk"):
+            raise ValueError(
+                f"cache={self.dataloading_config.cache} is not recognized, use none, memory, disk or disk:<path>."
+            )
+        if self.cache_mode == "disk" and not self.cache_dir:
+            # ideally on a local ssd, not on a mounted (blob) path
+            self.cache_dir = tempfile.gettempdir()
+
         # Get distribution config
         if "TF_CONFIG" not in os.environ:
             self.logger.critical(
@@ -139,11 +158,19 @@ class TensorflowDistributedModelTrainingSequence:
                 "cpu_count": self.cpu_count,
                 "prefetch_factor": self.dataloading_config.prefetch_factor,
                 "cache": self.dataloading_config.cache,
+                "shuffle_buffer_size": self.dataloading_config.shuffle_buffer_size,
+                "deterministic": bool(self.dataloading_config.deterministic),
                 # training params
                 "model_arch": self.training_config.model_arch,
                 "model_input_size": self.training_config.model_input_size,
                 "model_arch_pretrained": False,  # TODO
                 "num_classes": self.training_config.num_classes,
+                # checkpointing
+                "checkpoint_every_epochs": self.training_config.checkpoint_every_epochs,
+                "checkpoint_every_steps": self.training_config.checkpoint_every_steps,
+                "checkpoints_async_copy": bool(
+                    self.training_config.checkpoints_async_copy
+                ),
                 # profiling
                 "enable_profiling": bool(self.training_config.enable_profiling),
             }
@@ -248,6 +275,30 @@ class TensorflowDistributedModelTrainingSequence:
                 f"distributed_strategy={self.training_config.distributed_strategy} is not recognized."
             )
 
+    def _cache(self, dataset: tf.data.Dataset, name: str):
+        """Caches dataset in memory or on disk, depending on cache config.
+
+        On disk, each node/shard uses its own cache file, so that nodes sharing
+        a path do not read each other's shard."""
+        if self.cache_mode == "memory":
+            return dataset.cache()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = os.path.join(
+            self.cache_dir,
+            f"{name}_{self.training_config.model_input_size}px_shard{self.worker_id}of{self.nodes}",
+        )
+        self.logger.info(f"Caching {name} dataset in {cache_file}")
+        return dataset.cache(cache_file)
+
+    def _prefetch(self, dataset: tf.data.Dataset):
+        """Prefetches prefetch_factor batches (AUTOTUNE if <0, none if 0)."""
+        if self.dataloading_config.prefetch_factor == 0:
+            return dataset
+        if self.dataloading_config.prefetch_factor < 0:
+            return dataset.prefetch(tf.data.AUTOTUNE)
+        return dataset.prefetch(self.dataloading_config.prefetch_factor)
+
     def setup_datasets(
         self,
         training_dataset: tf.data.Dataset,
@@ -267,21 +318,46 @@ class TensorflowDistributedModelTrainingSequence:
         # shard(): this node will have a unique subset of data
         _dataset = training_dataset.shard(num_shards=self.nodes, index=self.worker_id)
 
-        # shuffle(): create a random order
-        _dataset = _dataset.shuffle(training_dataset_length // self.nodes)
+        if self.cache_mode == "none":
+            # shuffle(): create a random order (of the paths, before loading)
+            _dataset = _dataset.shuffle(training_dataset_length // self.nodes)
 
         # map(): actually load the data using loading function
+        # deterministic=False lets the parallel calls return out of order, so
+        # that one slow image doesn't hold back the others
         _dataset = _dataset.map(
             training_dataset_loading_function,
             num_parallel_calls=self.training_config.num_workers,
+            deterministic=bool(self.training_config.deterministic),
         )
 
+        if self.cache_mode != "none":
+            # cache(): keep the decoded/resized tensors, epochs after the first
+            # one do not read and decode the images anymore
+            _dataset = self._cache(_dataset, "train")
+
+            # shuffle(): the cache replays the order of the first epoch, so
+            # shuffle the loaded tensors (within a bounded buffer)
+            _dataset = _dataset.shuffle(
+                min(
+                    self.training_config.shuffle_buffer_size,
+                    training_dataset_length // self.nodes,
+                )
+            )
+
         # batch(): create batches
         _dataset = _dataset.batch(self.training_config.batch_size)
 
-        # cache if you ask nicely
-        if self.training_config.cache == "memory":
-            _dataset = _dataset.cache()
+        # prefetch(): load the next batches while the current one is trained on
+        _dataset = self._prefetch(_dataset)
+
+        # PROFILER: time spent waiting for each batch, logged at the end of each epoch
+        self.input_wait_logger = LogTimeOfTensorFlowIterator(
+            _dataset,
+            "epoch_train_input_wait",
+            enabled=bool(self.training_config.log_input_wait),
+        )
+        _dataset = self.input_wait_logger.as_tf_dataset()
 
         # DISTRIBUTED:
         # repeat(): create an infinitely long dataset, required to use experimental_distribute_dataset()
@@ -293,6 +369,12 @@ class TensorflowDistributedModelTrainingSequence:
         options.experimental_distribute.auto_shard_policy = (
             tf.data.experimental.AutoShardPolicy.OFF
         )  # Disable AutoShard.
+        if self.training_config.log_input_wait and hasattr(
+            options.experimental_optimization, "inject_prefetch"
+        ):
+            # recent tf versions add a prefetch() after the last stage, which would
+            # call LogTimeOfIterator ahead of training and time the wrong wait
+            options.experimental_optimization.inject_prefetch = False
         _dataset = _dataset.with_options(options)
 
         # store internally as training_dataset
@@ -314,11 +396,12 @@ class TensorflowDistributedModelTrainingSequence:
         _dataset = _dataset.map(
             validation_dataset_loading_function,
             num_parallel_calls=self.training_config.num_workers,
+            deterministic=bool(self.training_config.deterministic),
         )
+        if self.cache_mode != "none":
+            _dataset = self._cache(_dataset, "valid")
         _dataset = _dataset.batch(self.training_config.batch_size)
-
-        if self.training_config.cache == "memory":
-            _dataset = _dataset.cache()
+        _dataset = self._prefetch(_dataset)
 
         options = tf.data.Options()
         options.experimental_distribute.auto_shard_policy = (
@@ -380,17 +463,40 @@ class TensorflowDistributedModelTrainingSequence:
 
         Args:
             epochs (int, optional): if not provided uses internal config
-            checkpoints_dir (str, optional): path to write checkpoints
+            checkpoints_dir (str, optional): path to write checkpoints, and
+                to resume from if it already contains some
         """
         if epochs is None:
             epochs = self.training_config.num_epochs
 
-        custom_callback_handler = CustomCallbacks(enabled=self.self_is_main_node)
+        custom_callback_handler = CustomCallbacks(
+            enabled=self.self_is_main_node,
+            async_collector=self.async_metrics,
+            timed_iterators=[self.input_wait_logger] if self.input_wait_logger else [],
+        )
 
-        callbacks = [
-            custom_callback_handler,
-            # keras.callbacks.ModelCheckpoint("segmentation.h5", save_best_only=True)
-        ]
+        callbacks = [custom_callback_handler]
+
+        initial_epoch = 0
+        if checkpoints_dir:
+            # DISTRIBUTED: checkpoints are written by the main node only,
+            # on local disk first, then copied to checkpoints_dir
+            checkpoint_callback = CheckpointCallback(
+                self.model,
+                checkpoints_dir,
+                local_dir=self.training_config.checkpoints_local_dir,
+                every_epochs=self.training_config.checkpoint_every_epochs,
+                every_steps=self.training_config.checkpoint_every_steps,
+                async_copy=bool(self.training_config.checkpoints_async_copy),
+                is_chief=self.self_is_main_node,
+                async_collector=self.async_metrics,
+            )
+            # resume model, optimizer and epoch (if checkpoints_dir has a checkpoint)
+            initial_epoch = checkpoint_callback.restore()
+            self.logger.info(f"Training from epoch {initial_epoch} to {epochs}")
+
+            # before custom_callback_handler, which logs its metrics at the end of each epoch
+            callbacks.insert(0, checkpoint_callback)
 
         # PROFILER
         if self.training_config.enable_profiling:
@@ -428,6 +534,7 @@ class TensorflowDistributedModelTrainingSequence:
         self.model.fit(
             self.training_dataset,
             epochs=epochs,
+            initial_epoch=initial_epoch,
             steps_per_epoch=self.training_steps_per_epoch,
             validation_data=self.validation_dataset,
             callbacks=callbacks,
@@ -471,4 +578,27 @@ class TensorflowDistributedModelTrainingSequence:
     def save(self, output_dir: str, name: str = "dev", register_as: str = None) -> None:
         # DISTRIBUTED: you want to save the model only from the main node/process
         # in data distributed mode, all models should theoretically be the same
-        pass
+        # BUT with MultiWorkerMirroredStrategy, all workers need to call model.save()
+        # (reading the variables may need collective ops), so the other nodes
+        # save in a temporary dir discarded right after
+        if self.self_is_main_node:
+            model_dir = os.path.join(output_dir, name)
+        else:
+            model_tmp_dir = tempfile.TemporaryDirectory()
+            model_dir = model_tmp_dir.name
+
+        self.logger.info(f"Saving model in {model_dir}...")
+        os.makedirs(model_dir, exist_ok=True)
+        self.model.save(model_dir)
+
+        if self.self_is_main_node:
+            # MLFLOW: mlflow has a nice method to export the model automatically
+            # add tags and environment for it. You can then use it in Azure ML
+            # to register your model to an endpoint.
+            mlflow.keras.log_model(
+                self.model,
+                artifact_path="final_model",
+                registered_model_name=register_as,  # also register it if name is provided
+            )
+        else:
+            model_tmp_dir.cleanup()
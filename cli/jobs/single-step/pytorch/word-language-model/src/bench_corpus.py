@@ -0,0 +1,125 @@
+###############################################################################
+# Language Modeling on Wikitext-2
+#
+# This file measures the time to load a corpus with data.Corpus, compared to
+# the previous implementation (two passes per file, one tensor per line):
+# tokenizing and writing the cache, then reusing it. Also measures
+# batchify() of main.py, on the int64 tensor (copied) and on the
+# memory-mapped int32 ids (a view). The train split is --data/valid.txt
+# repeated --repeat times.
+#
+#   python bench_corpus.py --data ../data --repeat 20
+#
+###############################################################################
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import torch
+
+import data
+
+parser = argparse.ArgumentParser(description="PyTorch Wikitext-2 Language Model")
+parser.add_argument(
+    "--data", type=str, default="../data", help="folder with a valid.txt file"
+)
+parser.add_argument("--repeat", type=int, default=20, help="size of train split")
+parser.add_argument("--batch_size", type=int, default=20, help="batch size")
+
+
+class LegacyCorpus(object):
+    """The previous data.Corpus."""
+
+    def __init__(self, path):
+        self.dictionary = data.Dictionary()
+        self.train = self.tokenize(os.path.join(path, "train.txt"))
+        self.valid = self.tokenize(os.path.join(path, "valid.txt"))
+        self.test = self.tokenize(os.path.join(path, "test.txt"))
+
+    def tokenize(self, path):
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                words = line.split() + ["<eos>"]
+                for word in words:
+                    self.dictionary.add_word(word)
+
+        with open(path, "r", encoding="utf8") as f:
+            idss = []
+            for line in f:
+                words = line.split() + ["<eos>"]
+                ids = []
+                for word in words:
+                    ids.append(self.dictionary.word2idx[word])
+                idss.append(torch.tensor(ids).type(torch.int64))
+            ids = torch.cat(idss)
+
+        return ids
+
+
+def legacy_batchify(data, bsz):
+    nbatch = data.size(0) // bsz
+    data = data.narrow(0, 0, nbatch * bsz)
+    return data.view(bsz, -1).t().contiguous()
+
+
+def batchify(data, bsz):
+    nbatch = data.size(0) // bsz
+    data = data.narrow(0, 0, nbatch * bsz)
+    return data.view(bsz, -1).t()
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(args.data, "valid.txt"), "r", encoding="utf8") as f:
+            text = f.read()
+        with open(os.path.join(root, "train.txt"), "w", encoding="utf8") as f:
+            for _ in range(args.repeat):
+                f.write(text)
+        for split in ["valid", "test"]:
+            shutil.copyfile(
+                os.path.join(args.data, "valid.txt"), os.path.join(root, split + ".txt")
+            )
+
+        legacy_time, legacy_corpus = timed(LegacyCorpus, root)
+        cache_dir = os.path.join(root, "cache")
+        first_time, corpus = timed(data.Corpus, root, cache_dir)
+        cached_time, cached_corpus = timed(data.Corpus, root, cache_dir)
+        assert cached_corpus.dictionary.idx2word == legacy_corpus.dictionary.idx2word
+        assert torch.equal(cached_corpus.train.long(), legacy_corpus.train)
+
+        print(
+            f"{len(legacy_corpus.train)} train words, {len(legacy_corpus.dictionary)} in vocabulary"
+        )
+        print("{:<36} {:>10}".format("corpus", "seconds"))
+        print("{:<36} {:>10.2f}".format("previous", legacy_time))
+        print("{:<36} {:>10.2f}".format("single pass + write cache", first_time))
+        print("{:<36} {:>10.2f}".format("reuse cache (memory-mapped)", cached_time))
+
+        legacy_time, legacy_data = timed(
+            legacy_batchify, legacy_corpus.train, args.batch_size
+        )
+        view_time, view_data = timed(batchify, cached_corpus.train, args.batch_size)
+        assert torch.equal(view_data.long(), legacy_data)
+        print("{:<36} {:>10} {:>10}".format("batchify", "seconds", "MiB copied"))
+        print(
+            "{:<36} {:>10.3f} {:>10.1f}".format(
+                "previous (int64, contiguous)",
+                legacy_time,
+                legacy_data.numel() * legacy_data.element_size() / 2**20,
+            )
+        )
+        print("{:<36} {:>10.3f} {:>10.1f}".format("view of int32 ids", view_time, 0))
+    finally:
+        shutil.rmtree(root)
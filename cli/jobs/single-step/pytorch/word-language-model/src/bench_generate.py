@@ -0,0 +1,105 @@
+###############################################################################
+# Language Modeling on Wikitext-2
+#
+# This file measures the words/sec of generate.py on a Transformer model
+# (randomly initialized, wikitext-2 sized vocabulary), with the previous
+# loop that runs the whole sequence again for each new word, and with the
+# keys/values cache, for a batch of one or more sequences.
+#
+#   python bench_generate.py --words 100 500 --batch_sizes 1 16 64
+#
+###############################################################################
+
+import time
+import argparse
+
+import torch
+
+import model
+from generate import generate
+
+parser = argparse.ArgumentParser(description="PyTorch Wikitext-2 Language Model")
+parser.add_argument("--ntokens", type=int, default=33278, help="size of vocabulary")
+parser.add_argument("--emsize", type=int, default=200, help="size of word embeddings")
+parser.add_argument("--nhid", type=int, default=200, help="number of hidden units")
+parser.add_argument("--nlayers", type=int, default=2, help="number of layers")
+parser.add_argument("--nhead", type=int, default=2, help="number of heads")
+parser.add_argument("--words", type=int, nargs="+", default=[100, 500])
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 16, 64])
+parser.add_argument("--cuda", action="store_true", help="use CUDA")
+
+
+def legacy_generate(model, ntokens, words, temperature=1.0, device="cpu"):
+    """The previous loop of generate.py, for a Transformer model."""
+    input = torch.randint(ntokens, (1, 1), dtype=torch.long).to(device)
+    with torch.no_grad():
+        for i in range(words):
+            output = model(input, False)
+            word_weights = output[-1].squeeze().div(temperature).exp().cpu()
+            word_idx = torch.multinomial(word_weights, 1)[0]
+            word_tensor = torch.Tensor([[word_idx]]).long().to(device)
+            input = torch.cat([input, word_tensor], 0)
+    return input[1:]
+
+
+def words_per_sec(function, words, batch_size, device):
+    start = time.time()
+    function()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return words * batch_size / (time.time() - start)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device("cuda" if args.cuda else "cpu")
+    transformer = model.TransformerModel(
+        args.ntokens, args.emsize, args.nhead, args.nhid, args.nlayers
+    ).to(device)
+    transformer.eval()
+
+    print(f"torch=={torch.__version__}, {torch.get_num_threads()} threads")
+    print(
+        "{:<24} {:>8} {:>12} {:>12}".format(
+            "generate", "words", "batch size", "words/s"
+        )
+    )
+    for words in args.words:
+        print(
+            "{:<24} {:>8} {:>12} {:>12.1f}".format(
+                "previous loop",
+                words,
+                1,
+                words_per_sec(
+                    lambda: legacy_generate(
+                        transformer, args.ntokens, words, device=device
+                    ),
+                    words,
+                    1,
+                    device,
+                ),
+            )
+        )
+        for batch_size in args.batch_sizes:
+            print(
+                "{:<24} {:>8} {:>12} {:>12.1f}".format(
+                    "keys/values cache",
+                    words,
+                    batch_size,
+                    words_per_sec(
+                        lambda: generate(
+                            transformer,
+                            args.ntokens,
+                            words,
+                            batch_size=batch_size,
+                            device=device,
+                            log_interval=words,
+                        ),
+                        words,
+                        batch_size,
+                        device,
+                    ),
+                )
+            )
@@ -5,9 +5,19 @@
 # ==============================================================================
 
 import os
+import json
+import hashlib
 from io import open
+from itertools import islice
+
+import numpy as np
 import torch
 
+# where the tokenized corpus is cached when no cache_dir is given
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "word_language_model"
+)
+
 
 class Dictionary(object):
     def __init__(self):
@@ -25,31 +35,118 @@ class Dictionary(object):
 
 
 class Corpus(object):
-    def __init__(self, path):
+    def __init__(self, path, cache_dir=None):
         self.dictionary = Dictionary()
-        self.train = self.tokenize(os.path.join(path, "train.txt"))
-        self.valid = self.tokenize(os.path.join(path, "valid.txt"))
-        self.test = self.tokenize(os.path.join(path, "test.txt"))
 
-    def tokenize(self, path):
-        """Tokenizes a text file."""
+        cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        splits = ["train", "valid", "test"]
+        fingerprint = self.fingerprint(
+            [os.path.join(path, split + ".txt") for split in splits]
+        )
+
+        ids = self.load_cache(cache_dir, splits, fingerprint)
+        if ids is None:
+            ids = [
+                self.tokenize(os.path.join(path, split + ".txt")) for split in splits
+            ]
+            self.save_cache(cache_dir, splits, ids, fingerprint)
+            # memory-map the arrays just written, like when reusing the cache
+            ids = self.load_cache(cache_dir, splits, fingerprint) or ids
+
+        # int32 tensors sharing memory with the (memory-mapped) arrays
+        self.train, self.valid, self.test = [torch.from_numpy(split) for split in ids]
+
+    @staticmethod
+    def fingerprint(paths, block_size=1 << 20):
+        """Size and SHA-256 of the text files. Their contents, not their
+        modification times, so that a cache stays valid for a corpus that
+        is downloaded again by every job."""
+        fingerprint = {}
+        for path in paths:
+            assert os.path.exists(path)
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(block_size), b""):
+                    digest.update(block)
+            fingerprint[os.path.basename(path)] = [
+                os.path.getsize(path),
+                digest.hexdigest(),
+            ]
+        return fingerprint
+
+    def load_cache(self, cache_dir, splits, fingerprint):
+        """Loads the dictionary, and memory-maps the ids of each split, if
+        cache_dir has them for the same text files. Returns None otherwise."""
+        try:
+            with open(os.path.join(cache_dir, "vocab.json"), "r", encoding="utf8") as f:
+                vocab = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if vocab.get("fingerprint") != fingerprint:
+            return None
+
+        self.dictionary = Dictionary()
+        self.dictionary.idx2word = vocab["idx2word"]
+        self.dictionary.word2idx = {
+            word: idx for idx, word in enumerate(self.dictionary.idx2word)
+        }
+        # copy-on-write mapping: pages are read when used, the file is never modified
+        return [
+            np.load(os.path.join(cache_dir, split + ".ids.npy"), mmap_mode="c")
+            for split in splits
+        ]
+
+    def save_cache(self, cache_dir, splits, ids, fingerprint):
+        """Writes the ids of each split as int32 .npy, and the dictionary last."""
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for split, split_ids in zip(splits, ids):
+                np.save(os.path.join(cache_dir, split + ".ids.npy"), split_ids)
+            vocab_path = os.path.join(cache_dir, "vocab.json")
+            with open(vocab_path + ".tmp", "w", encoding="utf8") as f:
+                json.dump(
+                    {"fingerprint": fingerprint, "idx2word": self.dictionary.idx2word},
+                    f,
+                )
+            os.replace(vocab_path + ".tmp", vocab_path)
+        except OSError as e:
+            print(
+                "WARNING: could not cache the tokenized corpus in {}: {}".format(
+                    cache_dir, e
+                )
+            )
+
+    def tokenize(self, path, lines_per_block=65536):
+        """Tokenizes a text file, in a single pass.
+
+        Returns the ids of the words as an int32 numpy array."""
         assert os.path.exists(path)
-        # Add words to the dictionary
-        with open(path, "r", encoding="utf8") as f:
-            for line in f:
-                words = line.split() + ["<eos>"]
-                for word in words:
-                    self.dictionary.add_word(word)
+        word2idx = self.dictionary.word2idx
+        idx2word = self.dictionary.idx2word
 
-        # Tokenize file content
+        blocks = []
         with open(path, "r", encoding="utf8") as f:
-            idss = []
-            for line in f:
-                words = line.split() + ["<eos>"]
-                ids = []
-                for word in words:
-                    ids.append(self.dictionary.word2idx[word])
-                idss.append(torch.tensor(ids).type(torch.int64))
-            ids = torch.cat(idss)
-
-        return ids
+            while True:
+                lines = list(islice(f, lines_per_block))
+                if not lines:
+                    break
+                words = []
+                for line in lines:
+                    words += line.split()
+                    words.append("<eos>")
+
+                # Add new words to the dictionary, in order of first occurrence
+                for word in dict.fromkeys(words):
+                    if word not in word2idx:
+                        word2idx[word] = len(idx2word)
+                        idx2word.append(word)
+
+                blocks.append(
+                    np.fromiter(
+                        map(word2idx.__getitem__, words),
+                        dtype=np.int32,
+                        count=len(words),
+                    )
+                )
+
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int32)
@@ -41,51 +41,90 @@ parser.add_argument(
     help="temperature - higher will increase diversity",
 )
 parser.add_argument("--log-interval", type=int, default=100, help="reporting interval")
-args = parser.parse_args()
-
-# Set the random seed manually for reproducibility.
-torch.manual_seed(args.seed)
-if torch.cuda.is_available():
-    if not args.cuda:
-        print("WARNING: You have a CUDA device, so you should probably run with --cuda")
-
-device = torch.device("cuda" if args.cuda else "cpu")
-
-if args.temperature < 1e-3:
-    parser.error("--temperature has to be greater or equal 1e-3")
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    default=1,
+    help="number of sequences generated at once (written one after the other)",
+)
 
-with open(args.checkpoint, "rb") as f:
-    model = torch.load(f).to(device)
-model.eval()
 
-corpus = data.Corpus(args.data)
-ntokens = len(corpus.dictionary)
+def generate(
+    model, ntokens, words, batch_size=1, temperature=1.0, device="cpu", log_interval=100
+):
+    """Samples batch_size sequences of words from the model, starting from random words.
 
-is_transformer_model = (
-    hasattr(model, "model_type") and model.model_type == "Transformer"
-)
-if not is_transformer_model:
-    hidden = model.init_hidden(1)
-input = torch.randint(ntokens, (1, 1), dtype=torch.long).to(device)
+    Returns the indices of the generated words [words, batch size], on device."""
+    is_transformer_model = (
+        hasattr(model, "model_type") and model.model_type == "Transformer"
+    )
+    if is_transformer_model:
+        cache = model.init_cache()
+    else:
+        hidden = model.init_hidden(batch_size)
+    input = torch.randint(ntokens, (1, batch_size), dtype=torch.long, device=device)
+    word_indices = torch.empty(words, batch_size, dtype=torch.long, device=device)
 
-with open(args.outf, "w") as outf:
     with torch.no_grad():  # no tracking history
-        for i in range(args.words):
+        for i in range(words):
             if is_transformer_model:
-                output = model(input, False)
-                word_weights = output[-1].squeeze().div(args.temperature).exp().cpu()
-                word_idx = torch.multinomial(word_weights, 1)[0]
-                word_tensor = torch.Tensor([[word_idx]]).long().to(device)
-                input = torch.cat([input, word_tensor], 0)
+                # only the new words go through the model,
+                # attending to the keys/values cached for the previous ones
+                output, cache = model.forward_incremental(input, cache)
             else:
                 output, hidden = model(input, hidden)
-                word_weights = output.squeeze().div(args.temperature).exp().cpu()
-                word_idx = torch.multinomial(word_weights, 1)[0]
-                input.fill_(word_idx)
 
-            word = corpus.dictionary.idx2word[word_idx]
+            # sample on device, the distributions are never copied to cpu
+            word_weights = torch.softmax(
+                output.view(batch_size, ntokens) / temperature, dim=-1
+            )
+            input = torch.multinomial(word_weights, 1).view(1, batch_size)
+            word_indices[i] = input[0]
+
+            if i % log_interval == 0:
+                print("| Generated {}/{} words".format(i, words))
+
+    return word_indices
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    # Set the random seed manually for reproducibility.
+    torch.manual_seed(args.seed)
+    if torch.cuda.is_available():
+        if not args.cuda:
+            print(
+                "WARNING: You have a CUDA device, so you should probably run with --cuda"
+            )
+
+    device = torch.device("cuda" if args.cuda else "cpu")
+
+    if args.temperature < 1e-3:
+        parser.error("--temperature has to be greater or equal 1e-3")
+
+    with open(args.checkpoint, "rb") as f:
+        model = torch.load(f).to(device)
+    model.eval()
+
+    corpus = data.Corpus(args.data)
+    ntokens = len(corpus.dictionary)
+
+    word_indices = generate(
+        model,
+        ntokens,
+        args.words,
+        batch_size=args.batch_size,
+        temperature=args.temperature,
+        device=device,
+        log_interval=args.log_interval,
+    )
 
-            outf.write(word + ("\n" if i % 20 == 19 else " "))
+    with open(args.outf, "w") as outf:
+        for sequence_index, sequence in enumerate(word_indices.t().tolist()):
+            if sequence_index > 0:
+                outf.write("\n")
+            for i, word_idx in enumerate(sequence):
+                word = corpus.dictionary.idx2word[word_idx]
 
-            if i % args.log_interval == 0:
-                print("| Generated {}/{} words".format(i, args.words))
+                outf.write(word + ("\n" if i % 20 == 19 else " "))
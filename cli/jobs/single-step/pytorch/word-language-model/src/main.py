@@ -22,6 +22,12 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "--data", type=str, default="./data/wikitext-2", help="location of the data corpus"
 )
+parser.add_argument(
+    "--corpus_cache",
+    type=str,
+    default=None,
+    help="location of the tokenized corpus, reused while the data does not change (default: ~/.cache/word_language_model)",
+)
 parser.add_argument(
     "--model",
     type=str,
@@ -88,7 +94,7 @@ device = torch.device("cuda" if args.cuda else "cpu")
 # Load data
 ###############################################################################
 
-corpus = data.Corpus(args.data)
+corpus = data.Corpus(args.data, cache_dir=args.corpus_cache)
 
 # Starting from sequential data, batchify arranges the dataset into columns.
 # For instance, with the alphabet as the sequence and batch size 4, we'd get
@@ -109,8 +115,11 @@ def batchify(data, bsz):
     # Trim off any extra elements that wouldn't cleanly fit (remainders).
     data = data.narrow(0, 0, nbatch * bsz)
     # Evenly divide the data across the bsz batches.
-    data = data.view(bsz, -1).t().contiguous()
-    return data.to(device)
+    data = data.view(bsz, -1).t()
+    if device.type == "cpu":
+        # a view of the (memory-mapped) corpus, nothing is copied
+        return data
+    return data.contiguous().to(device)
 
 
 eval_batch_size = 10
@@ -167,8 +176,9 @@ def repackage_hidden(h):
 
 def get_batch(source, i):
     seq_len = min(args.bptt, len(source) - 1 - i)
-    data = source[i : i + seq_len]
-    target = source[i + 1 : i + 1 + seq_len].view(-1)
+    # the corpus is int32, only the batch is converted to int64
+    data = source[i : i + seq_len].long()
+    target = source[i + 1 : i + 1 + seq_len].reshape(-1).long()
     return data, target
 
 
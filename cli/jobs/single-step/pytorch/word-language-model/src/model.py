@@ -111,10 +111,11 @@ class PositionalEncoding(nn.Module):
         pe = pe.unsqueeze(0).transpose(0, 1)
         self.register_buffer("pe", pe)
 
-    def forward(self, x):
+    def forward(self, x, offset=0):
         r"""Inputs of forward function
         Args:
             x: the sequence fed to the positional encoder model (required).
+            offset: the position of the first element of x in the sequence (default=0).
         Shape:
             x: [sequence length, batch size, embed dim]
             output: [sequence length, batch size, embed dim]
@@ -122,7 +123,7 @@ class PositionalEncoding(nn.Module):
             >>> output = pos_encoder(x)
         """
 
-        x = x + self.pe[: x.size(0), :]
+        x = x + self.pe[offset : offset + x.size(0), :]
         return self.dropout(x)
 
 
@@ -177,3 +178,94 @@ class TransformerModel(nn.Module):
         output = self.transformer_encoder(src, self.src_mask)
         output = self.decoder(output)
         return F.log_softmax(output, dim=-1)
+
+    def init_cache(self):
+        """Returns an empty cache of keys/values for forward_incremental()."""
+        return [None] * len(self.transformer_encoder.layers)
+
+    def forward_incremental(self, src, cache):
+        r"""Runs the model on new tokens only, reusing the keys/values of the
+        previous tokens kept in cache, instead of running the whole sequence
+        again. Attention is causal, as in forward(src, has_mask=True).
+        Args:
+            src: the new tokens (required).
+            cache: keys/values of the previous tokens, from init_cache() or
+                the previous call (required).
+        Shape:
+            src: [new length, batch size]
+            output: [new length, batch size, ntoken]
+        Examples:
+            >>> cache = model.init_cache()
+            >>> output, cache = model.forward_incremental(src, cache)
+        """
+        past_length = 0 if cache[0] is None else cache[0][0].size(0)
+
+        output = self.encoder(src) * math.sqrt(self.ninp)
+        output = self.pos_encoder(output, offset=past_length)
+        new_cache = []
+        for layer, layer_cache in zip(self.transformer_encoder.layers, cache):
+            # same computation as TransformerEncoderLayer, with cached self attention
+            if getattr(layer, "norm_first", False):
+                attention, layer_cache = self._self_attention_incremental(
+                    layer.self_attn, layer.norm1(output), layer_cache, past_length
+                )
+                output = output + layer.dropout1(attention)
+                output = output + self._feed_forward(layer, layer.norm2(output))
+            else:
+                attention, layer_cache = self._self_attention_incremental(
+                    layer.self_attn, output, layer_cache, past_length
+                )
+                output = layer.norm1(output + layer.dropout1(attention))
+                output = layer.norm2(output + self._feed_forward(layer, output))
+            new_cache.append(layer_cache)
+        if self.transformer_encoder.norm is not None:
+            output = self.transformer_encoder.norm(output)
+
+        output = self.decoder(output)
+        return F.log_softmax(output, dim=-1), new_cache
+
+    @staticmethod
+    def _feed_forward(layer, x):
+        return layer.dropout2(
+            layer.linear2(layer.dropout(layer.activation(layer.linear1(x))))
+        )
+
+    @staticmethod
+    def _self_attention_incremental(self_attn, x, layer_cache, past_length):
+        """Multi-head self attention of the new positions x over the cached
+        and new keys/values. Returns the attention output, and the keys/values."""
+        length, batch_size, embed_dim = x.shape
+        head_dim = embed_dim // self_attn.num_heads
+
+        query, key, value = F.linear(
+            x, self_attn.in_proj_weight, self_attn.in_proj_bias
+        ).chunk(3, dim=-1)
+        if layer_cache is not None:
+            key = torch.cat([layer_cache[0], key], 0)
+            value = torch.cat([layer_cache[1], value], 0)
+
+        def split_heads(t):
+            # [length, batch size, embed dim] -> [batch size * heads, length, head dim]
+            return t.reshape(
+                t.size(0), batch_size * self_attn.num_heads, head_dim
+            ).transpose(0, 1)
+
+        scores = torch.bmm(
+            split_heads(query) / math.sqrt(head_dim),
+            split_heads(key).transpose(1, 2),
+        )
+        if length > 1:
+            # new position i can only attend to positions up to past_length + i
+            mask = torch.ones(
+                length, past_length + length, dtype=torch.bool, device=x.device
+            ).triu(past_length + 1)
+            scores = scores.masked_fill(mask, float("-inf"))
+        weights = F.dropout(
+            F.softmax(scores, dim=-1), p=self_attn.dropout, training=self_attn.training
+        )
+        attention = (
+            torch.bmm(weights, split_heads(value))
+            .transpose(0, 1)
+            .reshape(length, batch_size, embed_dim)
+        )
+        return self_attn.out_proj(attention), (key, value)
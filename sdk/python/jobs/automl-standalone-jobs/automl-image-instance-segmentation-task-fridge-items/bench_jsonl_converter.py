@@ -0,0 +1,179 @@
+"""Compare the throughput of convert_mask_in_VOC_to_jsonl with the previous
+serial implementation, which simplified each contour with a linear scan
+over the simplification factor, on a synthetic PASCAL VOC mask set.
+
+    python bench_jsonl_converter.py --images 200 --workers 1 2 4
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import PIL.Image as Image
+
+from simplification.cutil import simplify_coords
+from skimage import measure
+
+import jsonl_converter
+
+ANNOTATION = """<annotation>
+    <filename>{name}.jpg</filename>
+    <size><width>{width}</width><height>{height}</height><depth>3</depth></size>
+{objects}</annotation>
+"""
+OBJECT = """    <object>
+        <name>{label}</name>
+        <difficult>0</difficult>
+    </object>
+"""
+LABELS = ["can", "carton", "milk_bottle", "water_bottle"]
+
+
+def make_dataset(root, num_images, width, height, seed=0):
+    """Writes num_images color-encoded masks with irregular blobs and their
+    annotations under root, laid out like odFridgeObjectsMask."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(root, "annotations"))
+    os.makedirs(os.path.join(root, "segmentation-masks"))
+    yy, xx = np.mgrid[:height, :width]
+    cell_h, cell_w = height // 2, width // 3
+    for n in range(num_images):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        objects = []
+        # one object per grid cell so that none hides another
+        cells = rng.permutation(6)[: rng.integers(2, 6)]
+        for obj_id, cell in enumerate(cells, start=1):
+            cy = (cell // 3 + rng.uniform(0.4, 0.6)) * cell_h
+            cx = (cell % 3 + rng.uniform(0.4, 0.6)) * cell_w
+            radius = rng.uniform(0.25, 0.45) * min(cell_h, cell_w)
+            # a wobbly, jagged outline like a hand drawn mask, so contours
+            # have many more than 100 points
+            angle = np.arctan2(yy - cy, xx - cx)
+            wobble = sum(
+                rng.uniform(0.01, 0.05)
+                * k**-0.5
+                * np.sin(k * angle + rng.uniform(0, 6.3))
+                for k in (3, 5, 7, 13, 29, 61, 127)
+            )
+            inside = np.hypot(yy - cy, xx - cx) < radius * (1 + wobble)
+            mask[inside] = obj_id
+            objects.append(OBJECT.format(label=rng.choice(LABELS)))
+        name = "{:05d}".format(n)
+        Image.fromarray(mask).save(
+            os.path.join(root, "segmentation-masks", name + ".png")
+        )
+        with open(os.path.join(root, "annotations", name + ".xml"), "w") as f:
+            f.write(
+                ANNOTATION.format(
+                    name=name, width=width, height=height, objects="".join(objects)
+                )
+            )
+
+
+def legacy_convert_mask_to_polygon(
+    mask,
+    max_polygon_points=100,
+    score_threshold=0.5,
+    max_refinement_iterations=25,
+    edge_safety_padding=1,
+):
+    """The previous convert_mask_to_polygon, which searched the whole mask
+    for contours and tried every simplification factor in turn."""
+    mask = mask[0]
+    mask_array = np.array((mask > score_threshold), dtype=np.uint8)
+    image_shape = mask_array.shape
+    embedded_mask = np.zeros(
+        (
+            image_shape[0] + 2 * edge_safety_padding,
+            image_shape[1] + 2 * edge_safety_padding,
+        ),
+        dtype=np.uint8,
+    )
+    embedded_mask[
+        edge_safety_padding : image_shape[0] + edge_safety_padding,
+        edge_safety_padding : image_shape[1] + edge_safety_padding,
+    ] = mask_array
+    contours = measure.find_contours(embedded_mask, 0.5)
+    simplified_contours = []
+    for contour in contours:
+        if max_polygon_points is not None:
+            simplify_factor = 0
+            while (
+                len(contour) > max_polygon_points
+                and simplify_factor < max_refinement_iterations
+            ):
+                contour = simplify_coords(contour, simplify_factor)
+                simplify_factor += 1
+        unwrapped_contour = [0] * (2 * len(contour))
+        unwrapped_contour[::2] = np.ceil(contour[:, 1]) - edge_safety_padding
+        unwrapped_contour[1::2] = np.ceil(contour[:, 0]) - edge_safety_padding
+        simplified_contours.append(unwrapped_contour)
+    return jsonl_converter._normalize_contour(simplified_contours, image_shape)
+
+
+def run(root, num_workers, legacy=False):
+    """Converts the data set and returns the seconds taken and the lines."""
+    os.makedirs("./data/training-mltable-folder/", exist_ok=True)
+    os.makedirs("./data/validation-mltable-folder/", exist_ok=True)
+    convert_mask_to_polygon = jsonl_converter.convert_mask_to_polygon
+    if legacy:
+        # parsing_mask looks the function up in the module, and runs in this
+        # process with num_workers=1
+        jsonl_converter.convert_mask_to_polygon = legacy_convert_mask_to_polygon
+    try:
+        start = time.perf_counter()
+        jsonl_converter.convert_mask_in_VOC_to_jsonl(root, "azureml://", num_workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        jsonl_converter.convert_mask_to_polygon = convert_mask_to_polygon
+    lines = []
+    for split in (
+        "training-mltable-folder/train",
+        "validation-mltable-folder/validation",
+    ):
+        with open("./data/{}_annotations.jsonl".format(split)) as f:
+            lines.extend(f)
+    return elapsed, lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        root = os.path.join(workdir, "masks")
+        make_dataset(root, args.images, args.width, args.height)
+        os.chdir(workdir)
+
+        # the progress output of the converter is not part of the benchmark
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                baseline, baseline_lines = run(root, 1, legacy=True)
+                results = [(w, run(root, w)) for w in args.workers]
+
+        print("{:<28} {:>10}".format("implementation", "images/s"))
+        print("{:<28} {:>10.1f}".format("linear scan, serial", args.images / baseline))
+        for workers, (elapsed, lines) in results:
+            assert len(lines) == len(baseline_lines)
+            changed = sum(a != b for a, b in zip(lines, baseline_lines))
+            print(
+                "{:<28} {:>10.1f}   {} of {} lines differ".format(
+                    "bisection, {} worker(s)".format(workers),
+                    args.images / elapsed,
+                    changed,
+                    len(lines),
+                )
+            )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
@@ -3,6 +3,13 @@ import os
 import sys
 import argparse
 
+import numpy as np
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Define Converters
 
 
@@ -73,6 +80,131 @@ class BoundingBoxConverter(CocoToJSONLinesConverter):
         return self.json_lines_data
 
 
+class StreamingBoundingBoxConverter(CocoToJSONLinesConverter):
+    """Converts a COCO file of any size with memory bounded by the number of
+    images and annotations rather than by the size of the JSON.
+
+    The "categories", "images" and "annotations" arrays are parsed
+    incrementally with ijson, in that order whatever their order in the
+    file. Images are kept in a compact index of their ids and sizes, and
+    annotations as rows of a numpy record array, so annotations may come
+    in any order. convert() then yields the JSON lines one image at a
+    time, in the order of the images in the file, each with its labels in
+    the order of its annotations in the file, the same as
+    BoundingBoxConverter produces.
+    """
+
+    _ANNOTATION_DTYPE = np.dtype(
+        [
+            ("row", np.int64),
+            ("category", np.int64),
+            ("bbox", np.float64, 4),
+            ("iscrowd", np.int64),
+        ]
+    )
+    _MISSING_ISCROWD = np.iinfo(np.int64).min
+    _CHUNK_SIZE = 16384
+
+    def __init__(self, coco_file_path):
+        if ijson is None:
+            raise ImportError(
+                "StreamingBoundingBoxConverter requires ijson, "
+                "install it with 'pip install ijson'"
+            )
+        self.coco_file_path = coco_file_path
+
+    def _items(self, prefix):
+        with open(self.coco_file_path, "rb") as f:
+            yield from ijson.items(f, prefix, use_float=True)
+
+    def _read_images(self):
+        file_names, ids, widths, heights = [], [], [], []
+        for coco_image in self._items("images.item"):
+            file_names.append(coco_image["file_name"])
+            ids.append(coco_image["id"])
+            widths.append(coco_image["width"])
+            heights.append(coco_image["height"])
+        # id -> row lookups are done with a binary search over the sorted ids
+        ids = np.array(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        return file_names, widths, heights, ids[order], order
+
+    def _read_annotations(self, category_rows, sorted_ids, order):
+        def flush(image_ids, categories, bboxes, iscrowds):
+            image_ids = np.array(image_ids, dtype=np.int64)
+            positions = np.searchsorted(sorted_ids, image_ids)
+            found = positions < len(sorted_ids)
+            found[found] = sorted_ids[positions[found]] == image_ids[found]
+            if not found.all():
+                missing = image_ids[~found][0]
+                raise KeyError(
+                    "annotation refers to unknown image id {}".format(missing)
+                )
+            chunk = np.empty(len(image_ids), dtype=self._ANNOTATION_DTYPE)
+            chunk["row"] = order[positions]
+            chunk["category"] = categories
+            chunk["bbox"] = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+            chunk["iscrowd"] = iscrowds
+            chunks.append(chunk)
+
+        chunks = []
+        image_ids, categories, bboxes, iscrowds = [], [], [], []
+        for annotation in self._items("annotations.item"):
+            image_ids.append(annotation["image_id"])
+            categories.append(category_rows[annotation["category_id"]])
+            bboxes.append(annotation["bbox"])
+            iscrowds.append(annotation.get("iscrowd", self._MISSING_ISCROWD))
+            if len(image_ids) == self._CHUNK_SIZE:
+                flush(image_ids, categories, bboxes, iscrowds)
+                image_ids, categories, bboxes, iscrowds = [], [], [], []
+        flush(image_ids, categories, bboxes, iscrowds)
+        annotations = np.concatenate(chunks)
+        del chunks[:]
+        # group by image, keeping the file order within each image
+        return annotations[np.argsort(annotations["row"], kind="stable")]
+
+    def convert(self):
+        categories = {}
+        for category in self._items("categories.item"):
+            categories[category["id"]] = category["name"]
+        category_names = list(categories.values())
+        category_rows = {id: row for row, id in enumerate(categories)}
+
+        file_names, widths, heights, sorted_ids, order = self._read_images()
+        annotations = self._read_annotations(category_rows, sorted_ids, order)
+        bounds = np.searchsorted(annotations["row"], np.arange(len(file_names) + 1))
+
+        for index, file_name in enumerate(file_names):
+            width, height = widths[index], heights[index]
+            json_line = {
+                "image_url": file_name,
+                "image_details": {
+                    "format": file_name[file_name.rfind(".") + 1 :],
+                    "width": width,
+                    "height": height,
+                },
+                "label": [],
+            }
+            image_annotations = annotations[bounds[index] : bounds[index + 1]]
+            for _, category, bbox, iscrowd in image_annotations.tolist():
+                # if bbox comes as normalized, skip normalization.
+                if max(bbox) < 1.5:
+                    scale_x, scale_y = 1, 1
+                else:
+                    scale_x, scale_y = width, height
+                label = {
+                    "label": category_names[category],
+                    "topX": bbox[0] / scale_x,
+                    "topY": bbox[1] / scale_y,
+                    "bottomX": (bbox[0] + bbox[2]) / scale_x,
+                    "bottomY": (bbox[1] + bbox[3]) / scale_y,
+                }
+                if iscrowd != self._MISSING_ISCROWD:
+                    label["isCrowd"] = iscrowd
+                json_line["label"].append(label)
+            yield json_line
+
+
 if __name__ == "__main__":
     # Parse arguments that are passed into the script
     parser = argparse.ArgumentParser()
@@ -87,6 +219,11 @@ if __name__ == "__main__":
         default="ObjectDetection",
     )
     parser.add_argument("--base_url", type=str, default=None)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="parse the COCO file incrementally, for files too large to load",
+    )
 
     args = parser.parse_args()
 
@@ -95,6 +232,7 @@ if __name__ == "__main__":
     output_file_path = output_dir + "/" + args.output_file_name
     task_type = args.task_type
     base_url = args.base_url
+    streaming = args.streaming
 
     def read_coco_file(coco_file):
         with open(coco_file) as f_in:
@@ -102,6 +240,7 @@ if __name__ == "__main__":
 
     def write_json_lines(converter, filename, base_url=None):
         json_lines_data = converter.convert()
+        count = 0
         with open(filename, "w") as outfile:
             for json_line in json_lines_data:
                 if base_url is not None:
@@ -109,17 +248,20 @@ if __name__ == "__main__":
                     json_line["image_url"] = (
                         base_url + image_url[image_url.rfind("/") + 1 :]
                     )
-                json.dump(json_line, outfile, separators=(",", ":"))
-                outfile.write("\n")
-            print(f"Conversion completed. Converted {len(json_lines_data)} lines.")
-
-    coco_data = read_coco_file(input_coco_file_path)
+                # json.dumps encodes the line in one call to the C encoder,
+                # json.dump writes it out piece by piece
+                outfile.write(json.dumps(json_line, separators=(",", ":")) + "\n")
+                count += 1
+            print(f"Conversion completed. Converted {count} lines.")
 
     print("Converting for {}".format(task_type))
 
     # Defined in azureml.contrib.dataset.labeled_dataset.LabeledDatasetTask.OBJECT_DETECTION.value
     if task_type == "ObjectDetection":
-        converter = BoundingBoxConverter(coco_data)
+        if streaming:
+            converter = StreamingBoundingBoxConverter(input_coco_file_path)
+        else:
+            converter = BoundingBoxConverter(read_coco_file(input_coco_file_path))
         write_json_lines(converter, output_file_path, base_url)
 
     else:
@@ -0,0 +1,115 @@
+"""Measure the peak RSS and the seconds per million annotations of
+coco2jsonl.py with and without --streaming, on a synthetic COCO file
+whose annotations are shuffled and stored before the images.
+
+    python bench_coco2jsonl.py --images 100000 --annotations 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CATEGORIES = ["can", "carton", "milk_bottle", "water_bottle"]
+
+
+def write_coco_file(path, num_images, num_annotations, seed=0):
+    """Writes the file piece by piece so that the benchmark itself does not
+    need the whole data set in memory."""
+    rng = random.Random(seed)
+    image_ids = rng.sample(range(10 * num_images), num_images)
+    with open(path, "w") as f:
+        f.write('{"annotations": [')
+        for i in range(num_annotations):
+            x, y = rng.uniform(0, 500), rng.uniform(0, 400)
+            annotation = {
+                "id": i,
+                "image_id": rng.choice(image_ids),
+                "category_id": rng.randrange(len(CATEGORIES)) + 1,
+                "bbox": [x, y, rng.uniform(1, 140), rng.uniform(1, 80)],
+                "area": 0.0,
+                "iscrowd": 0,
+            }
+            if i % 7 == 0:
+                # already normalized boxes are passed through as is
+                annotation["bbox"] = [x / 640, y / 480, 0.05, 0.05]
+            if i % 11 == 0:
+                del annotation["iscrowd"]
+            f.write(("," if i else "") + json.dumps(annotation))
+        f.write('], "images": [')
+        for i, image_id in enumerate(image_ids):
+            image = {
+                "id": image_id,
+                "width": 640,
+                "height": 480,
+                "file_name": "images/{:08d}.jpg".format(image_id),
+            }
+            f.write(("," if i else "") + json.dumps(image))
+        f.write('], "categories": ')
+        json.dump([{"id": i + 1, "name": name} for i, name in enumerate(CATEGORIES)], f)
+        f.write("}")
+
+
+def run(coco_path, output_dir, output_file_name, streaming):
+    """Runs coco2jsonl.py in a child process and returns the seconds taken
+    and its peak RSS in MiB."""
+    command = [
+        sys.executable,
+        os.path.join(HERE, "coco2jsonl.py"),
+        "--input_coco_file_path",
+        coco_path,
+        "--output_dir",
+        output_dir,
+        "--output_file_name",
+        output_file_name,
+        "--task_type",
+        "ObjectDetection",
+    ]
+    if streaming:
+        command.append("--streaming")
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, stdout=devnull)
+    # wait4 reports the resource usage of that one child
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError("coco2jsonl.py failed")
+    return elapsed, usage.ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--images", type=int, default=100000)
+    parser.add_argument("--annotations", type=int, default=1000000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        coco_path = os.path.join(workdir, "coco.json")
+        write_coco_file(coco_path, args.images, args.annotations)
+        size = os.path.getsize(coco_path) / 2**20
+        print(
+            "{} images, {} annotations, {:.0f} MiB of COCO JSON".format(
+                args.images, args.annotations, size
+            )
+        )
+
+        print("{:<12} {:>12} {:>16}".format("mode", "peak MiB", "s / M annots"))
+        outputs = {}
+        for mode, streaming in (("json.load", False), ("streaming", True)):
+            output_file_name = mode.replace(".", "_") + ".jsonl"
+            elapsed, peak = run(coco_path, workdir, output_file_name, streaming)
+            rate = elapsed / args.annotations * 1e6
+            print("{:<12} {:>12.0f} {:>16.2f}".format(mode, peak, rate))
+            with open(os.path.join(workdir, output_file_name), "rb") as f:
+                outputs[mode] = f.read()
+        assert outputs["json.load"] == outputs["streaming"], "outputs differ"
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,97 @@
+"""bench_nms.py
+
+Compares ms/batch of the per-image non_max_suppression loop with
+batched_non_max_suppression (one torchvision batched_nms call) and the
+NumPy non_max_suppression_numpy, on synthetic YOLOv5 outputs, and counts
+the images for which they return different detections.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from yolo_onnx_preprocessing_utils import (
+    batched_non_max_suppression,
+    non_max_suppression,
+    non_max_suppression_numpy,
+)
+
+
+def synthetic_prediction(batch_size, num_boxes, num_classes, seed=0):
+    """YOLO-like outputs: boxes clustered around a few objects per image,
+    with about 2% of them above the default confidence threshold."""
+    rng = np.random.default_rng(seed)
+    pred = np.empty((batch_size, num_boxes, 5 + num_classes), dtype=np.float32)
+    objects = np.concatenate(
+        (
+            rng.uniform(50, 590, size=(batch_size, 10, 2)),  # centers
+            rng.uniform(20, 200, size=(batch_size, 10, 2)),  # sizes
+        ),
+        2,
+    )
+    which = rng.integers(0, 10, size=(batch_size, num_boxes))
+    pred[..., :4] = np.take_along_axis(objects, which[..., None], 1)
+    pred[..., :4] *= rng.normal(1, 0.05, size=(batch_size, num_boxes, 4))
+    pred[..., 4] = rng.uniform(0, 1, size=(batch_size, num_boxes)) ** 100
+    pred[..., 5:] = rng.uniform(0, 1, size=(batch_size, num_boxes, num_classes))
+    return pred
+
+
+def count_mismatches(expected, actual):
+    """Number of images whose detections differ. The per-image loop and
+    batched_nms keep classes (and images) apart by offsetting the boxes, which
+    can flip float32 IoU comparisons that sit right at the threshold."""
+    mismatches = 0
+    for e, a in zip(expected, actual):
+        if e is None or a is None:
+            mismatches += not (e is None and a is None)
+            continue
+        e, a = np.asarray(e), np.asarray(a)
+        if e.shape != a.shape or not np.allclose(
+            e[np.lexsort(e.T)], a[np.lexsort(a.T)], atol=1e-4
+        ):
+            mismatches += 1
+    return mismatches
+
+
+def timed(fn, repeat):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark YOLO NMS.")
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--num_boxes", type=int, default=25200)
+    parser.add_argument("--num_classes", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'batch':>5s} {'per-image ms':>13s} {'batched ms':>11s} {'numpy ms':>9s} "
+        f"{'mismatched images (batched, numpy)':>35s}"
+    )
+    for batch_size in args.batch_sizes:
+        pred = synthetic_prediction(batch_size, args.num_boxes, args.num_classes)
+        pred_t = torch.from_numpy(pred)
+
+        expected = non_max_suppression(pred_t)
+        batched_mismatches = count_mismatches(
+            expected, batched_non_max_suppression(pred_t)
+        )
+        numpy_mismatches = count_mismatches(expected, non_max_suppression_numpy(pred))
+
+        loop_ms = timed(lambda: non_max_suppression(pred_t), args.repeat)
+        batched_ms = timed(lambda: batched_non_max_suppression(pred_t), args.repeat)
+        numpy_ms = timed(lambda: non_max_suppression_numpy(pred), args.repeat)
+        print(
+            f"{batch_size:5d} {loop_ms:13.2f} {batched_ms:11.2f} {numpy_ms:9.2f} "
+            f"{batched_mismatches:27d}, {numpy_mismatches:d}"
+        )
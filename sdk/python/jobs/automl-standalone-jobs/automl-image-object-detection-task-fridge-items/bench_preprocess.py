@@ -0,0 +1,68 @@
+"""bench_preprocess.py
+
+Batch-size sweep comparing the per-image preprocess() with preprocess_batch(),
+which letterboxes every image straight into one preallocated Nx3xHxW buffer on
+a thread pool, on synthetic JPEG images of varying sizes.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from yolo_onnx_preprocessing_utils import preprocess, preprocess_batch
+
+
+def make_images(folder, count, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        height, width = rng.integers(300, 1200, size=2)
+        img = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        path = os.path.join(folder, "{}.jpg".format(i))
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def per_image(paths, img_size):
+    results = [preprocess(path, img_size) for path in paths]
+    return np.concatenate([img for img, _ in results]), [pad for _, pad in results]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark YOLO preprocessing.")
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_images(folder, max(args.batch_sizes))
+
+        expected, expected_pads = per_image(paths, args.img_size)
+        batch, pads, _ = preprocess_batch(paths, args.img_size, args.num_workers)
+        assert np.array_equal(batch, expected) and pads == expected_pads
+
+        print(f"{'batch':>5s} {'per-image img/s':>16s} {'batched img/s':>14s}")
+        for batch_size in args.batch_sizes:
+            subset = paths[:batch_size]
+            out = np.empty((batch_size, 3, args.img_size, args.img_size), np.float32)
+            rates = []
+            for fn in (
+                lambda: per_image(subset, args.img_size),
+                lambda: preprocess_batch(
+                    subset, args.img_size, args.num_workers, out=out
+                ),
+            ):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    fn()
+                rates.append(batch_size * args.repeat / (time.perf_counter() - start))
+            print(f"{batch_size:5d} {rates[0]:16.1f} {rates[1]:14.1f}")
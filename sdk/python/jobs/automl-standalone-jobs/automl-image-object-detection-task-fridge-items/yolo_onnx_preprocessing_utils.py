@@ -1,11 +1,18 @@
 import cv2
 import numpy as np
-import torch
 import time
-import torchvision
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from typing import Any, Dict, List
 
+try:
+    import torch
+    import torchvision
+except ImportError:
+    # ONNX Runtime deployments can use the NumPy functions without torch
+    torch = None
+    torchvision = None
+
 
 def letterbox(
     img,
@@ -108,6 +115,46 @@ def unpad_bbox(boxes, img_shape, pad):
     return img_height, img_width
 
 
+def unpad_bbox_batch(boxes, image_indices, img_shape, pads):
+    """Correct bbox coordinates of a whole batch at once by removing the padded
+    area each image got from letterbox, and clip them to the unpadded image
+
+    :param boxes: bbox absolute coordinates from prediction for all images, modified in place
+    :type boxes: <class 'numpy.ndarray'> or torch.Tensor of shape nx4
+    :param image_indices: index of the image each box belongs to
+    :type image_indices: <class 'numpy.ndarray'> or torch.Tensor of shape n
+    :param img_shape: letterboxed image shape, the same for the whole batch
+    :type img_shape: <class 'tuple'>: (height, width)
+    :param pads: pad used in letterbox image for inference, for each image
+    :type pads: <class 'list'> of (width, height) or array of shape bx2
+    :return: (unpadded) image heights and widths
+    :rtype: <class 'numpy.ndarray'>, <class 'numpy.ndarray'> of shape b
+    """
+    pads = np.asarray(pads, dtype=np.float64).reshape(-1, 2)
+    left = np.round(pads[:, 0] - 0.1).astype(np.int64)
+    right = np.round(pads[:, 0] + 0.1).astype(np.int64)
+    top = np.round(pads[:, 1] - 0.1).astype(np.int64)
+    bottom = np.round(pads[:, 1] + 0.1).astype(np.int64)
+    img_widths = img_shape[1] - (left + right)
+    img_heights = img_shape[0] - (top + bottom)
+
+    if boxes is not None and len(boxes):
+        # per box [left, top, left, top] offsets and [w, h, w, h] upper bounds
+        offsets = np.stack((left, top, left, top), 1)
+        bounds = np.stack((img_widths, img_heights, img_widths, img_heights), 1)
+        if _is_tensor(boxes):
+            offsets = torch.as_tensor(offsets, dtype=boxes.dtype, device=boxes.device)
+            bounds = torch.as_tensor(bounds, dtype=boxes.dtype, device=boxes.device)
+            boxes -= offsets[image_indices]
+            torch.max(boxes, torch.zeros_like(boxes), out=boxes)
+            torch.min(boxes, bounds[image_indices], out=boxes)
+        else:
+            boxes -= offsets[image_indices].astype(boxes.dtype)
+            np.clip(boxes, 0, bounds[image_indices], out=boxes)
+
+    return img_heights, img_widths
+
+
 def _convert_to_rcnn_output(output, height, width, pad):
     # output: nx6 (x1, y1, x2, y2, conf, cls)
     rcnn_label: Dict[str, List[Any]] = {"boxes": [], "labels": [], "scores": []}
@@ -125,20 +172,25 @@ def _convert_to_rcnn_output(output, height, width, pad):
     return rcnn_label, (img_height, img_width)
 
 
+def _is_tensor(x):
+    return torch is not None and isinstance(x, torch.Tensor)
+
+
 def xywh2xyxy(x):
-    """Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+    """Convert ...x4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+
+    Any number of leading dimensions is supported, e.g. nx4 boxes of one image
+    or bxnx4 boxes of a batch.
 
     :param x: bbox coordinates in [x center, y center, w, h]
     :type x: <class 'numpy.ndarray'> or torch.Tensor
     :return: new bbox coordinates in [x1, y1, x2, y2]
     :rtype: <class 'numpy.ndarray'> or torch.Tensor
     """
-    y = torch.zeros_like(x) if isinstance(x, torch.Tensor) else np.zeros_like(x)
-    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
-    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
-    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
-    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
-    return y
+    xy, half_wh = x[..., :2], x[..., 2:4] / 2
+    if _is_tensor(x):
+        return torch.cat((xy - half_wh, xy + half_wh), -1)
+    return np.concatenate((xy - half_wh, xy + half_wh), -1)
 
 
 def box_iou(box1, box2):
@@ -289,6 +341,202 @@ def non_max_suppression(
     return output
 
 
+def _nonzero(mask):
+    """Indices of the true elements of mask as a tuple, for tensors and arrays"""
+    return mask.nonzero(as_tuple=True) if _is_tensor(mask) else mask.nonzero()
+
+
+def _candidate_detections(prediction, conf_thres, multi_label, classes):
+    """Select the detections of a whole batch that pass the confidence threshold
+
+    Works on torch tensors and numpy arrays alike.
+
+    :param prediction: predictions of shape bxnx(5+nc)
+    :type prediction: <class 'torch.Tensor'> or <class 'numpy.ndarray'>
+    :return: detections mx6 (x1, y1, x2, y2, conf, cls) and the image index of each
+    :rtype: (<class 'torch.Tensor'>, <class 'torch.Tensor'>) or numpy equivalents
+    """
+    is_tensor = _is_tensor(prediction)
+    nc = prediction.shape[2] - 5  # number of classes
+    if multi_label and nc < 2:
+        multi_label = False  # multiple labels per box (adds 0.5ms/img)
+
+    image_index, box_index = _nonzero(prediction[..., 4] > conf_thres)
+    x = prediction[image_index, box_index]  # confidence
+
+    # Compute conf
+    cls_conf = x[:, 5:] * x[:, 4:5]  # conf = obj_conf * cls_conf
+
+    # Box (center x, center y, width, height) to (x1, y1, x2, y2)
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = _nonzero(cls_conf > conf_thres)
+        image_index = image_index[i]
+        if is_tensor:
+            x = torch.cat((box[i], cls_conf[i, j, None], j[:, None].float()), 1)
+        else:
+            x = np.concatenate(
+                (box[i], cls_conf[i, j, None], j[:, None].astype(box.dtype)), 1
+            )
+    else:  # best class only
+        if is_tensor:
+            conf, j = cls_conf.max(1, keepdim=True)
+            x = torch.cat((box, conf, j.float()), 1)
+        else:
+            j = cls_conf.argmax(1)[:, None]
+            conf = np.take_along_axis(cls_conf, j, 1)
+            x = np.concatenate((box, conf, j.astype(box.dtype)), 1)
+        keep = conf.reshape(-1) > conf_thres
+        x, image_index = x[keep], image_index[keep]
+
+    # Filter by class
+    if classes:
+        if is_tensor:
+            keep = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        else:
+            keep = (x[:, 5:6] == np.asarray(classes)).any(1)
+        x, image_index = x[keep], image_index[keep]
+
+    return x, image_index
+
+
+def _split_by_image(x, image_index, keep, batch_size, max_det):
+    """Split kept detections, sorted by decreasing score, into per image outputs
+    of at most max_det detections; images without detections get None"""
+    if _is_tensor(x):
+        order = torch.sort(image_index[keep], stable=True)[1]
+        keep = keep[order]
+        counts = torch.bincount(image_index[keep], minlength=batch_size).tolist()
+        chunks = torch.split(x[keep], counts)
+    else:
+        order = np.argsort(image_index[keep], kind="stable")
+        keep = keep[order]
+        counts = np.bincount(image_index[keep], minlength=batch_size).tolist()
+        chunks = np.split(x[keep], np.cumsum(counts)[:-1])
+    return [chunk[:max_det] if len(chunk) else None for chunk in chunks]
+
+
+def batched_non_max_suppression(
+    prediction,
+    conf_thres=0.1,
+    iou_thres=0.6,
+    multi_label=False,
+    classes=None,
+    agnostic=False,
+    max_det=300,
+):
+    """Performs per-class Non-Maximum Suppression (NMS) on the inference results of
+    a whole batch with a single torchvision batched_nms call
+
+    Boxes of different images (and classes, unless agnostic) are kept apart by
+    batched_nms' per-index coordinate offsets instead of a Python loop over images.
+    Results match non_max_suppression without merge, up to float32 rounding of the
+    offset boxes, and there is no time limit.
+
+    :param prediction: predictions
+    :type prediction: <class 'torch.Tensor'> of shape bxnx(5+nc)
+    :param conf_thres: confidence threshold
+    :type conf_thres: float
+    :param iou_thres: IoU threshold
+    :type iou_thres: float
+    :param multi_label: enable to have multiple labels in each box?
+    :type multi_label: bool
+    :param classes: specific target class
+    :type classes:
+    :param agnostic: enable class agnostic NMS?
+    :type agnostic: bool
+    :param max_det: maximum number of detections per image
+    :type max_det: int
+    :return: detections with shape: nx6 (x1, y1, x2, y2, conf, cls), None for images without any
+    :rtype: <class 'list'>
+    """
+    if prediction.dtype is torch.float16:
+        prediction = prediction.float()  # to FP32
+
+    nc = prediction.shape[2] - 5  # number of classes
+    x, image_index = _candidate_detections(prediction, conf_thres, multi_label, classes)
+    if not x.shape[0]:
+        return [None] * prediction.shape[0]
+
+    # One NMS group per image, or per (image, class) pair
+    groups = image_index if agnostic else image_index * nc + x[:, 5].long()
+    keep = torchvision.ops.batched_nms(x[:, :4], x[:, 4], groups, iou_thres)
+    return _split_by_image(x, image_index, keep, prediction.shape[0], max_det)
+
+
+def nms_numpy(boxes, scores, iou_thres):
+    """Greedy Non-Maximum Suppression in NumPy, equivalent to torchvision.ops.nms
+
+    :param boxes: boxes in (x1, y1, x2, y2) format
+    :type boxes: <class 'numpy.ndarray'> of shape nx4
+    :param scores: score of each box
+    :type scores: <class 'numpy.ndarray'> of shape n
+    :param iou_thres: boxes overlapping a kept box with a higher IoU are discarded
+    :type iou_thres: float
+    :return: indices of the kept boxes, sorted by decreasing score
+    :rtype: <class 'numpy.ndarray'>
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])
+        h = np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])
+        inter = np.maximum(w, 0) * np.maximum(h, 0)
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def non_max_suppression_numpy(
+    prediction,
+    conf_thres=0.1,
+    iou_thres=0.6,
+    multi_label=False,
+    classes=None,
+    agnostic=False,
+    max_det=300,
+):
+    """NumPy implementation of batched_non_max_suppression, for ONNX Runtime
+    deployments that do not have torch installed
+
+    Candidates of the whole batch are selected with array operations, then the
+    greedy NMS runs once per image (and class, unless agnostic).
+
+    :param prediction: predictions, e.g. the output of an ONNX Runtime session
+    :type prediction: <class 'numpy.ndarray'> of shape bxnx(5+nc)
+    :return: detections with shape: nx6 (x1, y1, x2, y2, conf, cls), None for images without any
+    :rtype: <class 'list'>
+    """
+    prediction = np.asarray(prediction)
+    if prediction.dtype == np.float16:
+        prediction = prediction.astype(np.float32)  # to FP32
+
+    nc = prediction.shape[2] - 5  # number of classes
+    x, image_index = _candidate_detections(prediction, conf_thres, multi_label, classes)
+    if not x.shape[0]:
+        return [None] * prediction.shape[0]
+
+    groups = image_index if agnostic else image_index * nc + x[:, 5].astype(np.int64)
+    # Greedy NMS costs O(kept * candidates), so run it per group rather than
+    # on the whole batch at once
+    order = np.argsort(groups, kind="stable")
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    keep = np.concatenate(
+        [
+            members[nms_numpy(x[members, :4], x[members, 4], iou_thres)]
+            for members in np.split(order, bounds)
+        ]
+    )
+    keep = keep[np.argsort(-x[keep, 4], kind="stable")]
+    return _split_by_image(x, image_index, keep, prediction.shape[0], max_det)
+
+
 def _read_image(ignore_data_errors: bool, image_url: str, use_cv2: bool = False):
     try:
         if use_cv2:
@@ -318,10 +566,90 @@ def preprocess(image_url, img_size=640):
 
     img, ratio, pad = letterbox(img0, new_shape=img_size, auto=False, scaleup=False)
 
-    # Convert
-    img = img[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB, to 3x640x640
-    img = np.ascontiguousarray(img)
-    np_image = torch.from_numpy(img)
-    np_image = np.expand_dims(np_image, axis=0)
-    np_image = np_image.astype(np.float32) / 255.0
+    # Convert BGR to RGB, to 1x3x640x640, and scale to [0, 1] in a single pass
+    np_image = np.empty((1, 3) + img.shape[:2], dtype=np.float32)
+    _write_chw_scaled(img, np_image[0])
     return np_image, pad
+
+
+def _write_chw_scaled(img, out):
+    """Write a BGR HWC uint8 image into a RGB CHW float32 view scaled to [0, 1]
+
+    :param img: BGR image
+    :type img: <class 'numpy.ndarray'> of shape hxwx3
+    :param out: destination, e.g. a slice of a batch buffer
+    :type out: <class 'numpy.ndarray'> of shape 3xhxw
+    """
+    np.divide(
+        img[:, :, ::-1].transpose(2, 0, 1),
+        np.float32(255.0),
+        out=out,
+        dtype=np.float32,
+        casting="unsafe",
+    )
+
+
+def preprocess_batch(image_urls, img_size=640, num_workers=8, out=None):
+    """Read and letterbox a batch of images into a single preallocated buffer
+
+    Each image is decoded and resized on a thread pool (cv2 releases the GIL) and
+    written directly into its slot of the Nx3xHxW buffer, padding included, instead
+    of going through per-image letterbox, transpose, contiguous and float copies.
+    The result matches stacking preprocess() outputs.
+
+    :param image_urls: paths of the images
+    :type image_urls: <class 'list'>
+    :param img_size: letterbox size
+    :type img_size: int
+    :param num_workers: number of decoding threads
+    :type num_workers: int
+    :param out: optional float32 buffer of shape Nx3ximg_sizeximg_size to reuse across batches
+    :type out: <class 'numpy.ndarray'>
+    :return: the batch, and for each image the letterbox pad in (width, height) and scale
+        ratio, both None for images that could not be read (their slot is left as padding)
+    :rtype: <class 'numpy.ndarray'>, <class 'list'>, <class 'list'>
+    """
+    shape = (len(image_urls), 3, img_size, img_size)
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape or out.dtype != np.float32:
+        raise ValueError(
+            "out must be a float32 array of shape {}, got {} {}".format(
+                shape, out.dtype, out.shape
+            )
+        )
+    pad_value = np.float32(114) / np.float32(255.0)
+
+    def load(i):
+        slot = out[i]
+        slot.fill(pad_value)
+        img0 = _read_image(
+            ignore_data_errors=True, image_url=image_urls[i], use_cv2=True
+        )
+        if img0 is None:
+            return None, None
+
+        # Same geometry as letterbox(img0, img_size, auto=False, scaleup=False)
+        shape = img0.shape[:2]
+        r = min(img_size / shape[0], img_size / shape[1], 1.0)
+        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+        dw = (img_size - new_unpad[0]) / 2
+        dh = (img_size - new_unpad[1]) / 2
+        if shape[::-1] != new_unpad:  # resize
+            img0 = cv2.resize(img0, new_unpad, interpolation=cv2.INTER_LINEAR)
+        top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+
+        _write_chw_scaled(
+            img0, slot[:, top : top + new_unpad[1], left : left + new_unpad[0]]
+        )
+        return (dw, dh), (r, r)
+
+    if num_workers > 1 and len(image_urls) > 1:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(load, range(len(image_urls))))
+    else:
+        results = [load(i) for i in range(len(image_urls))]
+
+    pads = [pad for pad, _ in results]
+    ratios = [ratio for _, ratio in results]
+    return out, pads, ratios
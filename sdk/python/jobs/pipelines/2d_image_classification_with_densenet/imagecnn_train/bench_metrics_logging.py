@@ -0,0 +1,116 @@
+"""Measure training throughput on the syntetic data backend with metric
+logging disabled, with the loss read back and logged synchronously on
+every iteration (the previous behaviour), and with on-device accumulation
+read every --metrics-interval iterations and logged from a background
+thread.
+
+    python bench_metrics_logging.py --arch resnet50 -b 64 --iterations 200
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+import torch.nn as nn
+import torch.backends.cudnn as cudnn
+from torch.utils.tensorboard import SummaryWriter
+
+import image_classification.logger as log
+from image_classification.dataloaders import get_syntetic_loader
+from image_classification.training import (
+    ModelAndLoss,
+    get_optimizer,
+    lr_step_policy,
+    run,
+    train,
+)
+
+
+class NeverPreempted(object):
+    def is_preempted(self):
+        return False
+
+
+class SyncMetricsWriter(object):
+    """Logs and flushes on the calling thread, as train() used to."""
+
+    def __init__(self, writer, run):
+        self.writer = writer
+        self.run = run
+
+    def add_scalar(self, tag, value, step):
+        self.writer.add_scalar(tag, value, step)
+
+    def log_row(self, name, **kwargs):
+        self.run.log_row(name, **kwargs)
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+def measure(args, model_and_loss, optimizer, mode):
+    loader, _ = get_syntetic_loader(None, args.batch_size, 1000, False)
+    logdir = tempfile.mkdtemp()
+    if mode == "disabled":
+        logger, writer, interval = None, None, args.iterations
+    else:
+        logger = log.Logger(args.print_freq, [])
+        if mode == "every iteration":
+            writer = SyncMetricsWriter(SummaryWriter(log_dir=logdir), run)
+            interval = 1
+        else:
+            writer = log.AsyncMetricsWriter(SummaryWriter(log_dir=logdir), run)
+            interval = args.metrics_interval
+        logger.start_epoch()
+
+    lr_scheduler = lr_step_policy(args.lr, [30, 60, 80], 0.1, 0, logger=logger)
+    common = dict(
+        train_loader=loader,
+        model_and_loss=model_and_loss,
+        optimizer=optimizer,
+        lr_scheduler=lr_scheduler,
+        fp16=False,
+        logger=logger,
+        epoch=0,
+        detector=NeverPreempted(),
+        writer=writer,
+        metrics_interval=interval,
+    )
+    # warm up cudnn autotuning and the allocator
+    train(prof=args.warmup, register_metrics=True, **common)
+    torch.cuda.synchronize()
+    start = time.time()
+    train(prof=args.iterations, register_metrics=False, **common)
+    torch.cuda.synchronize()
+    elapsed = time.time() - start
+    if writer is not None:
+        writer.close()
+    return args.iterations * args.batch_size / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--arch", default="resnet50")
+    parser.add_argument("--batch-size", "-b", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--metrics-interval", type=int, default=10)
+    parser.add_argument("--print-freq", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=0.1)
+    args = parser.parse_args()
+
+    cudnn.benchmark = True
+    model_and_loss = ModelAndLoss((args.arch, "classic"), nn.CrossEntropyLoss)
+    optimizer = get_optimizer(
+        list(model_and_loss.model.named_parameters()), False, args.lr, 0.9, 1e-4
+    )
+
+    print("{:<32} {:>10}".format("metric logging", "img/s"))
+    for mode in (
+        "disabled",
+        "every iteration",
+        "every {} iterations, async".format(args.metrics_interval),
+    ):
+        ips = measure(args, model_and_loss, optimizer, mode)
+        print("{:<32} {:>10.1f}".format(mode, ips))
@@ -0,0 +1,113 @@
+"""Compare the input pipeline of the "pytorch" data backend, which opens
+and decodes a JPEG per sample and applies RandomResizedCrop and a random
+flip, with the "shards" backend reading the same images packed by
+pack_shards.py. A synthetic ImageFolder of JPEGs is written first; the
+page cache is warm for both, so the difference is decoding, resizing and
+per-file overhead.
+
+    python bench_shards.py --images 2048 --batch-size 64 --workers 2
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from image_classification.dataloaders import ShardDataset, fast_collate, image_dataset
+from pack_shards import pack_split
+
+
+def make_image_folder(root, num_images, num_classes, seed=0):
+    """JPEGs of smooth noise at typical ImageNet sizes, around 500x375."""
+    rng = np.random.default_rng(seed)
+    for c in range(num_classes):
+        os.makedirs(os.path.join(root, "class{:03d}".format(c)))
+    for i in range(num_images):
+        w, h = rng.integers(400, 600), rng.integers(300, 450)
+        small = rng.integers(0, 256, (h // 8, w // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((w, h), Image.BILINEAR)
+        image.save(
+            os.path.join(
+                root, "class{:03d}".format(i % num_classes), "{:06d}.jpg".format(i)
+            ),
+            quality=90,
+        )
+
+
+def directory_size(root):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(root)
+        for name in names
+    )
+
+
+def measure(dataset, args):
+    """Images per second through a DataLoader like the train loaders'."""
+    loader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.workers,
+        collate_fn=fast_collate,
+        drop_last=True,
+    )
+    images = 0
+    start = time.perf_counter()
+    for epoch in range(args.epochs):
+        for data, _ in loader:
+            images += data.shape[0]
+    return images / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--images", type=int, default=2048)
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--epochs", type=int, default=2)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    workdir = tempfile.mkdtemp()
+    try:
+        folder = os.path.join(workdir, "train")
+        shards = os.path.join(workdir, "shards")
+        make_image_folder(folder, args.images, args.classes)
+
+        start = time.perf_counter()
+        pack_split(folder, shards, workers=args.workers)
+        packed = time.perf_counter() - start
+        print(
+            "packed {} images in {:.1f} s, {:.0f} MiB of JPEG -> {:.0f} MiB".format(
+                args.images,
+                packed,
+                directory_size(folder) / 2**20,
+                directory_size(shards) / 2**20,
+            )
+        )
+
+        jpeg = image_dataset(
+            folder,
+            transforms.Compose(
+                [transforms.RandomResizedCrop(224), transforms.RandomHorizontalFlip()]
+            ),
+        )
+        print("{:<40} {:>10}".format("train input pipeline", "img/s"))
+        for name, dataset in (
+            ("ImageFolder, decode + RandomResizedCrop", jpeg),
+            (
+                "ShardDataset, mmap + random crop",
+                ShardDataset(shards, random_crop=True),
+            ),
+            ("ShardDataset, mmap + center crop", ShardDataset(shards)),
+        ):
+            print("{:<40} {:>10.1f}".format(name, measure(dataset, args)))
+    finally:
+        shutil.rmtree(workdir)
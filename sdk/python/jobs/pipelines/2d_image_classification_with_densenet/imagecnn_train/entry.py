@@ -1,11 +1,12 @@
 from pathlib import Path
+import os
 import sys
 import runpy
 import json
 import shutil
+import time
 from multiprocessing.pool import ThreadPool
 from multiprocessing import cpu_count
-import functools
 from enum import Enum
 
 from mldesigner import command_component, Input
@@ -13,6 +14,7 @@ from mldesigner import command_component, Input
 
 class Data_BackendEnum(Enum):
     pytorch = "pytorch"
+    shards = "shards"
     syntetic = "syntetic"
     dali_gpu = "dali-gpu"
     dali_cpu = "dali-cpu"
@@ -41,39 +43,132 @@ class Lr_ScheduleEnum(Enum):
     cosine = "cosine"
 
 
+class MaterializeEnum(Enum):
+    auto = "auto"
+    hardlink = "hardlink"
+    symlink = "symlink"
+    copy = "copy"
+    manifest = "manifest"
+
+
+# Read by image_classification.dataloaders in place of an ImageFolder layout
+MANIFEST_FILE_NAME = "file_list.txt"
+
+
+def _same_filesystem(src_dir, dst_dir):
+    try:
+        return os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        return False
+
+
+def _link_or_copy(src, dst, mode):
+    """Materialize src at dst, returns the mode actually used."""
+    if mode in ("hardlink", "symlink"):
+        link = os.link if mode == "hardlink" else os.symlink
+        try:
+            link(src, dst)
+            return mode
+        except FileExistsError:
+            # rerun on the same output, replace the previous file
+            os.unlink(dst)
+            link(src, dst)
+            return mode
+        except OSError:
+            # e.g. a filesystem without hard links, fall back to copying
+            pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
 def convert_image_directory_to_specific_format(
-    image_dir_path, output_root, is_train=False
+    image_dir_path,
+    output_root,
+    is_train=False,
+    materialize="auto",
+    num_workers=None,
+    chunk_size=1024,
 ):
-    # convert image directory to train component input data format
+    """Lay out the images listed in images.lst as an ImageFolder tree,
+    output_root/{train,val}/<category>/<file name>, for the train loaders.
+
+    materialize selects how each image gets there:
+    "hardlink" or "symlink" link to the source image, "copy" copies it,
+    and "auto" hard links when source and output are on the same
+    filesystem and copies otherwise. Links fall back to copies if the
+    filesystem refuses them. Copies run in chunks of chunk_size files on
+    num_workers threads (default: cpu count) with progress reports.
+    "manifest" writes no images at all, only a file list with the path
+    and class index of every image, which the pytorch and dali data
+    backends read in place of the directory tree.
+    """
+    materialize = MaterializeEnum(materialize).value
     image_dir_path = Path(image_dir_path)
     image_list_path = image_dir_path / "images.lst"
-    output_data_path = output_root / ("train" if is_train else "val")
+    output_data_path = Path(output_root) / ("train" if is_train else "val")
     category_list = []
     file_name_list = []
     with open(image_list_path, "r") as fin:
         for line in fin:
             line = json.loads(line)
-            # print(line)
             category_list.append(line["category"])
             file_name_list.append(line["image_info"]["file_name"])
-            (output_data_path / line["category"]).mkdir(parents=True, exist_ok=True)
-    print(
-        f"file number {len(file_name_list)}, category number {len(set(category_list))}."
-    )
+    categories = sorted(set(category_list))
+    print(f"file number {len(file_name_list)}, category number {len(categories)}.")
 
-    def copy_file(index):
-        target_dir = output_data_path / category_list[index]
-        shutil.copyfile(
-            str(image_dir_path / file_name_list[index]),
-            str(target_dir / Path(file_name_list[index]).name),
-        )
+    output_data_path.mkdir(parents=True, exist_ok=True)
+    if materialize == "manifest":
+        # class indices follow the sorted category names, as in ImageFolder
+        class_to_idx = {category: i for i, category in enumerate(categories)}
+        manifest_path = output_data_path / MANIFEST_FILE_NAME
+        with open(manifest_path, "w") as fout:
+            for category, file_name in zip(category_list, file_name_list):
+                path = os.path.relpath(image_dir_path / file_name, output_data_path)
+                fout.write(f"{path} {class_to_idx[category]}\n")
+        print(f"manifest {manifest_path} lists {len(file_name_list)} files.")
+        return output_root
 
-    with ThreadPool(cpu_count()) as p:
-        p.map(functools.partial(copy_file), range(len(file_name_list)))
+    for category in categories:
+        (output_data_path / category).mkdir(exist_ok=True)
 
-    print(
-        f"output path {output_data_path} has {len(list(output_data_path.glob('**/*')))} files."
-    )
+    mode = materialize
+    if mode == "auto":
+        same_fs = _same_filesystem(image_dir_path, output_data_path)
+        mode = "hardlink" if same_fs else "copy"
+    print(f"materializing {output_data_path} with {mode}.")
+
+    def materialize_chunk(start):
+        modes = set()
+        for index in range(start, min(start + chunk_size, len(file_name_list))):
+            file_name = file_name_list[index]
+            modes.add(
+                _link_or_copy(
+                    str(image_dir_path / file_name),
+                    str(output_data_path / category_list[index] / Path(file_name).name),
+                    mode,
+                )
+            )
+        return min(start + chunk_size, len(file_name_list)) - start, modes
+
+    done = 0
+    modes = set()
+    start_time = last_report = time.time()
+    with ThreadPool(num_workers or cpu_count()) as p:
+        chunks = range(0, len(file_name_list), chunk_size)
+        for count, chunk_modes in p.imap_unordered(materialize_chunk, chunks):
+            done += count
+            modes |= chunk_modes
+            now = time.time()
+            if now - last_report >= 10 or done == len(file_name_list):
+                last_report = now
+                print(
+                    f"{done}/{len(file_name_list)} files, "
+                    f"{done / max(now - start_time, 1e-6):.0f} files/s"
+                )
+    if "copy" in modes and mode != "copy":
+        print(f"could not {mode} some files, copied them instead.")
+
+    print(f"output path {output_data_path} has {done} files.")
     return output_root
 
 
@@ -104,15 +199,27 @@ def main(
     raport_file="experiment_raport.json",
     workspace="./",
     save_checkpoint_epochs: int = 10,
+    materialize="auto",
 ):
     new_data_path = Path(train_data).parent / "new_dataset"
     convert_image_directory_to_specific_format(
-        image_dir_path=train_data, output_root=new_data_path, is_train=True
+        image_dir_path=train_data,
+        output_root=new_data_path,
+        is_train=True,
+        materialize=materialize,
     )
     convert_image_directory_to_specific_format(
-        image_dir_path=val_data, output_root=new_data_path
+        image_dir_path=val_data, output_root=new_data_path, materialize=materialize
     )
     print(f"new data path {new_data_path}")
+    if Data_BackendEnum(data_backend) == Data_BackendEnum.shards:
+        # decode the images once, epochs then read the packed arrays
+        from pack_shards import pack_dataset
+
+        new_data_path = pack_dataset(
+            new_data_path, Path(train_data).parent / "new_dataset_shards"
+        )
+        print(f"packed data path {new_data_path}")
     sys.argv = [
         "main",
         "--data",
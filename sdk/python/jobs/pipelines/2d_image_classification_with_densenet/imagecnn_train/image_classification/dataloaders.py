@@ -28,13 +28,22 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import os
+import itertools
+import json
+import queue
+import threading
 import torch
 import numpy as np
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
 from PIL import Image
 
-DATA_BACKEND_CHOICES = ["pytorch", "syntetic"]
+DATA_BACKEND_CHOICES = ["pytorch", "shards", "syntetic"]
+# Written by entry.py in place of an ImageFolder layout, see ImageListDataset
+MANIFEST_FILE_NAME = "file_list.txt"
+# Written by pack_shards.py, see ShardDataset
+SHARD_INDEX_FILE_NAME = "index.json"
+SHARD_LABELS_FILE_NAME = "labels.npy"
 try:
     from nvidia.dali.plugin.pytorch import DALIClassificationIterator
     from nvidia.dali.pipeline import Pipeline
@@ -78,6 +87,119 @@ def load_jpeg_from_file(path, cuda=True, fp16=False):
     return input
 
 
+def _manifest_path(data_dir):
+    path = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    return path if os.path.isfile(path) else None
+
+
+def _file_list_args(data_dir):
+    # The manifest uses DALI's file_list format, paths relative to data_dir
+    manifest_path = _manifest_path(data_dir)
+    return {} if manifest_path is None else {"file_list": manifest_path}
+
+
+class ImageListDataset(torch.utils.data.Dataset):
+    """Images listed in a manifest, one "<path> <class index>" line per
+    image with paths relative to the manifest's directory, as written by
+    entry.py's "manifest" materialize mode. Yields the same (image, class
+    index) samples as datasets.ImageFolder over the equivalent directory
+    tree, in manifest order.
+    """
+
+    def __init__(self, manifest_path, transform=None):
+        root = os.path.dirname(manifest_path)
+        self.samples = []
+        with open(manifest_path) as f:
+            for line in f:
+                path, target = line.rstrip("\n").rsplit(" ", 1)
+                self.samples.append((os.path.join(root, path), int(target)))
+        self.targets = [target for _, target in self.samples]
+        self.transform = transform
+        self.loader = datasets.folder.default_loader
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, target = self.samples[index]
+        sample = self.loader(path)
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample, target
+
+
+class ResumableSampler(torch.utils.data.Sampler):
+    """Wraps a DistributedSampler so that an epoch can be resumed part way.
+    The first `start` indices of the next epoch are dropped here, before the
+    DataLoader fetches them, so the consumed images are never read or
+    decoded again. The order of the epoch is the same as without it.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.start = 0
+
+    def set_epoch(self, epoch):
+        self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        # only the epoch being resumed starts late
+        start, self.start = self.start, 0
+        return itertools.islice(iter(self.sampler), start, None)
+
+    def __len__(self):
+        return len(self.sampler) - self.start
+
+
+def image_dataset(data_dir, transform):
+    """ImageListDataset if data_dir holds a manifest, otherwise ImageFolder."""
+    manifest_path = _manifest_path(data_dir)
+    if manifest_path is not None:
+        return ImageListDataset(manifest_path, transform)
+    return datasets.ImageFolder(data_dir, transform)
+
+
+class ShardDataset(torch.utils.data.Dataset):
+    """Images packed by pack_shards.py: decoded, resized and center cropped
+    to size x size, stored as uint8 HWC arrays in memory-mapped .npy shards.
+    Yields (HWC uint8 array, class index) with a crop x crop window of each
+    image, at a random position and randomly flipped if random_crop is set,
+    otherwise centered. Nothing is decoded and the windows are views of the
+    mapped shards, fast_collate does the only copy.
+    """
+
+    def __init__(self, shard_dir, crop=224, random_crop=False):
+        with open(os.path.join(shard_dir, SHARD_INDEX_FILE_NAME)) as f:
+            index = json.load(f)
+        self.files = [os.path.join(shard_dir, s["file"]) for s in index["shards"]]
+        self.offsets = np.cumsum([0] + [s["count"] for s in index["shards"]])
+        self.targets = np.load(os.path.join(shard_dir, SHARD_LABELS_FILE_NAME))
+        self.size = index["size"]
+        self.crop = crop
+        self.random_crop = random_crop
+        # mapped on first use, i.e. in each DataLoader worker
+        self.shards = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            self.shards = [np.load(f, mmap_mode="r") for f in self.files]
+        shard = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        image = self.shards[shard][index - self.offsets[shard]]
+        if self.random_crop:
+            # torch's generator, which DataLoader seeds per worker
+            y, x = torch.randint(0, self.size - self.crop + 1, (2,)).tolist()
+            image = image[y : y + self.crop, x : x + self.crop]
+            if torch.rand(1).item() < 0.5:
+                image = image[:, ::-1]
+        else:
+            o = (self.size - self.crop) // 2
+            image = image[o : o + self.crop, o : o + self.crop]
+        return image, int(self.targets[index])
+
+
 class HybridTrainPipe(Pipeline):
     def __init__(
         self, batch_size, num_threads, device_id, data_dir, crop, dali_cpu=False
@@ -97,6 +219,7 @@ class HybridTrainPipe(Pipeline):
             shard_id=rank,
             num_shards=world_size,
             random_shuffle=True,
+            **_file_list_args(data_dir),
         )
 
         if dali_cpu:
@@ -159,6 +282,7 @@ class HybridValPipe(Pipeline):
             shard_id=rank,
             num_shards=world_size,
             random_shuffle=False,
+            **_file_list_args(data_dir),
         )
 
         self.decode = ops.ImageDecoder(device="mixed", output_type=types.RGB)
@@ -201,6 +325,10 @@ class DALIWrapper(object):
             self.dalipipeline, self.num_classes, self.one_hot
         )
 
+    def set_epoch(self, epoch, start_batch=0):
+        # DALI shards and shuffles inside the pipeline, nothing can be skipped
+        return 0
+
 
 def get_dali_train_loader(dali_cpu=False):
     def gdtl(
@@ -284,28 +412,38 @@ def get_dali_val_loader():
     return gdvl
 
 
+def _batch_buffer(shape):
+    """An uninitialized uint8 tensor, in shared memory when called in a
+    DataLoader worker so that passing it to the main process copies
+    nothing, the way default_collate allocates its output."""
+    if torch.utils.data.get_worker_info() is None:
+        return torch.empty(shape, dtype=torch.uint8)
+    elem = torch.tensor([], dtype=torch.uint8)
+    storage = elem.storage()._new_shared(int(np.prod(shape)))
+    return elem.new(storage).view(shape)
+
+
 def fast_collate(batch):
-    imgs = [img[0] for img in batch]
-    targets = torch.tensor([target[1] for target in batch], dtype=torch.int64)
-    w = imgs[0].size[0]
-    h = imgs[0].size[1]
-    tensor = torch.zeros((len(imgs), 3, h, w), dtype=torch.uint8)
-    for i, img in enumerate(imgs):
+    targets = torch.tensor([target for _, target in batch], dtype=torch.int64)
+    first = batch[0][0]
+    # PIL images or HWC arrays, e.g. from ShardDataset
+    h, w = first.shape[:2] if isinstance(first, np.ndarray) else first.size[::-1]
+    tensor = _batch_buffer((len(batch), 3, h, w))
+    out = tensor.numpy()
+    for i, (img, _) in enumerate(batch):
         nump_array = np.asarray(img, dtype=np.uint8)
-        tens = torch.from_numpy(nump_array)
         if nump_array.ndim < 3:
-            nump_array = np.expand_dims(nump_array, axis=-1)
-        nump_array = np.rollaxis(nump_array, 2)
-
-        tensor[i] += torch.from_numpy(nump_array)
+            # grayscale, repeated over the three channels
+            out[i] = nump_array
+        else:
+            # HWC to CHW in the one copy into the batch
+            out[i] = nump_array.transpose(2, 0, 1)
 
     return tensor, targets
 
 
 def expand(num_classes, dtype, tensor):
-    e = torch.zeros(
-        tensor.size(0), num_classes, dtype=dtype, device=torch.device("cuda")
-    )
+    e = torch.zeros(tensor.size(0), num_classes, dtype=dtype, device=tensor.device)
     e = e.scatter(1, tensor.unsqueeze(1), 1.0)
     return e
 
@@ -353,6 +491,9 @@ class PrefetchedWrapper(object):
             input = next_input
             target = next_target
 
+        # one yield per batch of the loader, set_epoch() counts on it; an
+        # epoch resumed at its end has no batch left
+        if not first:
             yield input, target
 
     def __init__(self, dataloader, num_classes, fp16, one_hot):
@@ -362,72 +503,150 @@ class PrefetchedWrapper(object):
         self.one_hot = one_hot
         self.num_classes = num_classes
 
-    def __iter__(self):
+    def set_epoch(self, epoch, start_batch=0):
+        """Makes the next iteration yield the batches of epoch from
+        start_batch on. Returns the number of batches skipped, which is 0
+        if the sampler cannot skip them."""
+        self.epoch = epoch
+        if isinstance(self.dataloader.sampler, ResumableSampler):
+            self.dataloader.sampler.start = start_batch * self.dataloader.batch_size
+            return start_batch
+        return 0
+
+    def _next_epoch(self):
         if self.dataloader.sampler is not None and isinstance(
-            self.dataloader.sampler, torch.utils.data.distributed.DistributedSampler
+            self.dataloader.sampler,
+            (torch.utils.data.distributed.DistributedSampler, ResumableSampler),
         ):
 
             self.dataloader.sampler.set_epoch(self.epoch)
         self.epoch += 1
+
+    def __iter__(self):
+        self._next_epoch()
         return PrefetchedWrapper.prefetched_loader(
             self.dataloader, self.num_classes, self.fp16, self.one_hot
         )
 
 
-def get_pytorch_train_loader(
-    data_path,
-    batch_size,
-    num_classes,
-    one_hot,
-    workers=5,
-    _worker_init_fn=None,
-    fp16=False,
-):
-    traindir = os.path.join(data_path, "train")
-    train_dataset = datasets.ImageFolder(
-        traindir,
-        transforms.Compose(
-            [transforms.RandomResizedCrop(224), transforms.RandomHorizontalFlip()]
-        ),
-    )
+class CPUPrefetchedWrapper(PrefetchedWrapper):
+    """PrefetchedWrapper for nodes without a GPU. A background thread
+    converts and normalizes the next batches while the current one is used,
+    into a ring of float buffers allocated once and reused, pinned if CUDA
+    is available. A batch stays valid until the next one is requested.
+    """
+
+    def __init__(self, dataloader, num_classes, fp16, one_hot, depth=2):
+        super(CPUPrefetchedWrapper, self).__init__(
+            dataloader, num_classes, fp16, one_hot
+        )
+        self.depth = depth
+        dtype = torch.half if fp16 else torch.float
+        mean = torch.tensor([0.485 * 255, 0.456 * 255, 0.406 * 255])
+        std = torch.tensor([0.229 * 255, 0.224 * 255, 0.225 * 255])
+        # (x - mean) / std as x * scale + shift
+        self.scale = (1 / std).view(1, 3, 1, 1).to(dtype)
+        self.shift = (-mean / std).view(1, 3, 1, 1).to(dtype)
+        # depth batches queued, one being filled and one in use
+        self.buffers = [None] * (depth + 2)
+
+    def _normalize(self, input, slot):
+        buffer = self.buffers[slot]
+        if buffer is None or buffer.shape != input.shape:
+            buffer = torch.empty(
+                input.shape,
+                dtype=self.scale.dtype,
+                pin_memory=torch.cuda.is_available(),
+            )
+            self.buffers[slot] = buffer
+        # one conversion pass and one fused multiply-add; mixed uint8/float
+        # arithmetic takes a slower path
+        buffer.copy_(input)
+        return torch.addcmul(self.shift, buffer, self.scale, out=buffer)
+
+    def _produce(self, loader, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for i, (input, target) in enumerate(loader):
+                input = self._normalize(input, i % len(self.buffers))
+                if self.one_hot:
+                    target = expand(self.num_classes, self.scale.dtype, target)
+                if not put((input, target)):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def _prefetch(self, loader):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        threading.Thread(
+            target=self._produce, args=(loader, batches, stop), daemon=True
+        ).start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # also when the consumer stops early, e.g. with --prof
+            stop.set()
+
+    def __iter__(self):
+        self._next_epoch()
+        return self._prefetch(self.dataloader)
+
 
+def _prefetched_wrapper():
+    return PrefetchedWrapper if torch.cuda.is_available() else CPUPrefetchedWrapper
+
+
+def _train_loader(
+    train_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
+):
+    # a single process shuffles the same way as one rank of a distributed
+    # run, so that the order of an epoch can be replayed on resume
     if torch.distributed.is_initialized():
         train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset)
     else:
-        train_sampler = None
+        train_sampler = torch.utils.data.distributed.DistributedSampler(
+            train_dataset, num_replicas=1, rank=0
+        )
+    train_sampler = ResumableSampler(train_sampler)
 
     train_loader = torch.utils.data.DataLoader(
         train_dataset,
         batch_size=batch_size,
-        shuffle=(train_sampler is None),
+        shuffle=False,
         num_workers=workers,
         worker_init_fn=_worker_init_fn,
-        pin_memory=True,
+        pin_memory=torch.cuda.is_available(),
         sampler=train_sampler,
         collate_fn=fast_collate,
         drop_last=True,
     )
 
     return (
-        PrefetchedWrapper(train_loader, num_classes, fp16, one_hot),
+        _prefetched_wrapper()(train_loader, num_classes, fp16, one_hot),
         len(train_loader),
     )
 
 
-def get_pytorch_val_loader(
-    data_path,
-    batch_size,
-    num_classes,
-    one_hot,
-    workers=5,
-    _worker_init_fn=None,
-    fp16=False,
+def _val_loader(
+    val_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
 ):
-    valdir = os.path.join(data_path, "val")
-    val_dataset = datasets.ImageFolder(
-        valdir, transforms.Compose([transforms.Resize(256), transforms.CenterCrop(224)])
-    )
-
     if torch.distributed.is_initialized():
         val_sampler = torch.utils.data.distributed.DistributedSampler(val_dataset)
     else:
@@ -440,11 +659,83 @@ def get_pytorch_val_loader(
         shuffle=False,
         num_workers=workers,
         worker_init_fn=_worker_init_fn,
-        pin_memory=True,
+        pin_memory=torch.cuda.is_available(),
         collate_fn=fast_collate,
     )
 
-    return PrefetchedWrapper(val_loader, num_classes, fp16, one_hot), len(val_loader)
+    return (
+        _prefetched_wrapper()(val_loader, num_classes, fp16, one_hot),
+        len(val_loader),
+    )
+
+
+def get_pytorch_train_loader(
+    data_path,
+    batch_size,
+    num_classes,
+    one_hot,
+    workers=5,
+    _worker_init_fn=None,
+    fp16=False,
+):
+    traindir = os.path.join(data_path, "train")
+    train_dataset = image_dataset(
+        traindir,
+        transforms.Compose(
+            [transforms.RandomResizedCrop(224), transforms.RandomHorizontalFlip()]
+        ),
+    )
+    return _train_loader(
+        train_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
+    )
+
+
+def get_pytorch_val_loader(
+    data_path,
+    batch_size,
+    num_classes,
+    one_hot,
+    workers=5,
+    _worker_init_fn=None,
+    fp16=False,
+):
+    valdir = os.path.join(data_path, "val")
+    val_dataset = image_dataset(
+        valdir, transforms.Compose([transforms.Resize(256), transforms.CenterCrop(224)])
+    )
+    return _val_loader(
+        val_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
+    )
+
+
+def get_shard_train_loader(
+    data_path,
+    batch_size,
+    num_classes,
+    one_hot,
+    workers=5,
+    _worker_init_fn=None,
+    fp16=False,
+):
+    train_dataset = ShardDataset(os.path.join(data_path, "train"), random_crop=True)
+    return _train_loader(
+        train_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
+    )
+
+
+def get_shard_val_loader(
+    data_path,
+    batch_size,
+    num_classes,
+    one_hot,
+    workers=5,
+    _worker_init_fn=None,
+    fp16=False,
+):
+    val_dataset = ShardDataset(os.path.join(data_path, "val"))
+    return _val_loader(
+        val_dataset, batch_size, num_classes, one_hot, workers, _worker_init_fn, fp16
+    )
 
 
 class SynteticDataLoader(object):
@@ -470,6 +761,10 @@ class SynteticDataLoader(object):
         while True:
             yield self.input_data, self.input_target
 
+    def set_epoch(self, epoch, start_batch=0):
+        # every batch is the same, there is nothing to skip
+        return start_batch
+
 
 def get_syntetic_loader(
     data_path,
@@ -28,6 +28,11 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from collections import OrderedDict
+import math
+import queue
+import threading
+import time
+import traceback
 import dllogger
 import numpy as np
 
@@ -52,9 +57,9 @@ LOSS_METER = lambda: Meter(AverageMeter(), AverageMeter(), MinMeter())
 ACC_METER = lambda: Meter(AverageMeter(), AverageMeter(), MaxMeter())
 LR_METER = lambda: Meter(LastMeter(), LastMeter(), LastMeter())
 
-LAT_100 = lambda: Meter(QuantileMeter(1), QuantileMeter(1), QuantileMeter(1))
-LAT_99 = lambda: Meter(QuantileMeter(0.99), QuantileMeter(0.99), QuantileMeter(0.99))
-LAT_95 = lambda: Meter(QuantileMeter(0.95), QuantileMeter(0.95), QuantileMeter(0.95))
+LAT_100 = lambda: Meter(QuantileSketch(1), QuantileSketch(1), QuantileSketch(1))
+LAT_99 = lambda: Meter(QuantileSketch(0.99), QuantileSketch(0.99), QuantileSketch(0.99))
+LAT_95 = lambda: Meter(QuantileSketch(0.95), QuantileSketch(0.95), QuantileSketch(0.95))
 
 
 class Meter(object):
@@ -120,6 +125,130 @@ class QuantileMeter(object):
         return self.vals, self.n
 
 
+class QuantileSketch(object):
+    """Streaming replacement for QuantileMeter with fixed memory.
+
+    Values are counted in logarithmically sized buckets as in DDSketch
+    (Masson et al., 2019), so any quantile is within relative_accuracy of
+    the exact one while the state stays a few KiB no matter how many values
+    are seen. Values at or below min_value share a single bucket and values
+    above max_value are counted in the last one; the exact minimum and
+    maximum are kept as well, so q=0 and q=1 are exact. Single values are
+    buffered and bucketed buffer_size at a time with numpy.
+
+    Sketches with the same parameters can be merged, either by passing one
+    to record() or by summing their counts across ranks, see
+    utils.all_reduce_sketch.
+    """
+
+    def __init__(
+        self,
+        q,
+        relative_accuracy=0.01,
+        min_value=1e-9,
+        max_value=1e9,
+        buffer_size=1024,
+    ):
+        self.q = q
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.buffer_size = buffer_size
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket 0 holds everything up to min_value
+        self.offset = math.ceil(math.log(min_value) / self.log_gamma) - 1
+        self.num_buckets = (
+            math.ceil(math.log(max_value) / self.log_gamma) - self.offset + 1
+        )
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+        self.pending = []
+        self.min = math.inf
+        self.max = -math.inf
+        self.n = 0
+
+    def record(self, val, n=1):
+        if n == 1 and isinstance(val, float):
+            # the common case, kept as cheap as appending to QuantileMeter
+            self.pending.append(val)
+            if len(self.pending) >= self.buffer_size:
+                self.flush()
+        elif isinstance(val, QuantileSketch):
+            self.merge(val)
+        elif isinstance(val, (list, tuple, np.ndarray)):
+            self._add(np.asarray(val, dtype=np.float64).ravel())
+        else:
+            self._add(np.array([val], dtype=np.float64), weight=n)
+
+    def _add(self, vals, weight=1):
+        if vals.size == 0:
+            return
+        with np.errstate(divide="ignore", invalid="ignore"):
+            i = np.ceil(np.log(vals) / self.log_gamma) - self.offset
+        i[~(vals > self.min_value)] = 0
+        i = np.minimum(i, self.num_buckets - 1).astype(np.int64)
+        self.counts += np.bincount(i, minlength=self.num_buckets) * weight
+        self.min = min(self.min, float(vals.min()))
+        self.max = max(self.max, float(vals.max()))
+        self.n += vals.size * weight
+
+    def flush(self):
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self._add(np.array(pending, dtype=np.float64))
+
+    def merge(self, other):
+        if other.num_buckets != self.num_buckets or other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different parameters")
+        self.flush()
+        other.flush()
+        self.counts += other.counts
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.n += other.n
+
+    def copy(self):
+        other = QuantileSketch(
+            self.q,
+            self.relative_accuracy,
+            self.min_value,
+            self.max_value,
+            self.buffer_size,
+        )
+        other.merge(self)
+        return other
+
+    def quantile(self, q):
+        self.flush()
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        # the same rank as np.quantile(..., interpolation="nearest")
+        rank = round(q * (self.n - 1))
+        i = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        if i == 0:
+            val = self.min
+        else:
+            val = 2 * self.gamma ** (i + self.offset) / (self.gamma + 1)
+        return min(max(val, self.min), self.max)
+
+    def get_val(self):
+        return self.quantile(self.q), self.n
+
+    def get_data(self):
+        self.flush()
+        if self.n == 0:
+            return None, 0
+        # a snapshot, the caller resets this sketch right after
+        return self.copy(), self.n
+
+
 class MaxMeter(object):
     def __init__(self):
         self.reset()
@@ -154,7 +283,7 @@ class MinMeter(object):
         if self.min is None:
             self.min = val
         else:
-            self.min = max(self.min, val)
+            self.min = min(self.min, val)
         self.n = n
 
     def get_val(self):
@@ -206,6 +335,89 @@ class AverageMeter(object):
         return self.val / self.n, self.n
 
 
+class ArrayAverageMeter(AverageMeter):
+    """AverageMeter that also takes a list or array of samples in one
+    record() call, e.g. per-sample latencies or a whole interval of losses,
+    and sums them with numpy in float64 instead of value by value.
+    """
+
+    def record(self, val, n=1):
+        if isinstance(val, (list, tuple, np.ndarray)):
+            vals = np.asarray(val, dtype=np.float64)
+            self.n += vals.size
+            self.val += float(vals.sum())
+        else:
+            super(ArrayAverageMeter, self).record(val, n=n)
+
+
+class ArrayMaxMeter(MaxMeter):
+    """MaxMeter that also takes a list or array of samples in one record()
+    call and counts them all in n.
+    """
+
+    def record(self, val, n=1):
+        if isinstance(val, (list, tuple, np.ndarray)):
+            vals = np.asarray(val, dtype=np.float64)
+            if vals.size == 0:
+                return
+            val, n = float(vals.max()), vals.size
+        if self.max is None:
+            self.max = val
+        else:
+            self.max = max(self.max, val)
+        self.n += n
+
+
+class AsyncMetricsWriter(object):
+    """Sends scalars to a TensorBoard SummaryWriter and rows to an AzureML
+    run from a background thread, so the training loop only enqueues them.
+    The SummaryWriter is flushed at most every flush_secs and on close().
+    """
+
+    def __init__(self, writer, run, flush_secs=30):
+        self.writer = writer
+        self.run = run
+        self.flush_secs = flush_secs
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def add_scalar(self, tag, value, step):
+        self.queue.put((self.writer.add_scalar, (tag, value, step), {}))
+
+    def log_row(self, name, **kwargs):
+        self.queue.put((self.run.log_row, (name,), kwargs))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+
+    def _loop(self):
+        last_flush = time.time()
+        dirty = False
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_secs)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                fn, args, kwargs = item
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    # a failed upload must not stop training
+                    traceback.print_exc()
+                dirty = True
+            if dirty and time.time() - last_flush >= self.flush_secs:
+                self.writer.flush()
+                last_flush = time.time()
+                dirty = False
+        self.writer.flush()
+
+
 class Logger(object):
     def __init__(self, print_interval, backends, verbose=False, last_epoch=-1):
         self.epoch = last_epoch
@@ -21,7 +21,7 @@ def mixup(alpha, num_classes, data, target):
         bs = data.size(0)
         c = np.random.beta(alpha, alpha)
 
-        perm = torch.randperm(bs).cuda()
+        perm = torch.randperm(bs, device=data.device)
 
         md = c * data + (1 - c) * data[perm, :]
         mt = c * target + (1 - c) * target[perm, :]
@@ -42,6 +42,9 @@ class MixUpWrapper(object):
     def __iter__(self):
         return self.mixup_loader(self.dataloader)
 
+    def set_epoch(self, epoch, start_batch=0):
+        return self.dataloader.set_epoch(epoch, start_batch)
+
 
 class NLLMultiLabelSmooth(nn.Module):
     def __init__(self, smoothing=0.0):
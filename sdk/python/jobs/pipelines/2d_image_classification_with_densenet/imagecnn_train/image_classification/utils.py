@@ -28,10 +28,14 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import os
+import hashlib
+import random
+import uuid
 import numpy as np
 import torch
 import shutil
 import torch.distributed as dist
+from concurrent.futures import ThreadPoolExecutor
 
 
 def should_backup_checkpoint(args):
@@ -44,6 +48,9 @@ def should_backup_checkpoint(args):
 import time
 
 
+SHARDS_KEY = "sharded_checkpoint"
+
+
 def save_checkpoint(
     state,
     is_best,
@@ -51,26 +58,298 @@ def save_checkpoint(
     checkpoint_dir="./",
     backup_filename=None,
 ):
-    if (not torch.distributed.is_initialized()) or torch.distributed.get_rank() == 0:
+    """Synchronous version of AsyncCheckpointWriter.save."""
+    writer = AsyncCheckpointWriter(checkpoint_dir)
+    writer.save(state, is_best, filename=filename, backup_filename=backup_filename)
+    writer.close()
+
+
+class _HashingWriter(object):
+    """File wrapper that computes the sha256 of everything torch.save writes,
+    so the checksum costs no second read of the checkpoint."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _map_leaves(obj, fn, path=()):
+    """Rebuilds nested dicts, lists and tuples with fn(path, value) applied
+    to every other value."""
+    if isinstance(obj, dict):
+        mapped = type(obj)((k, _map_leaves(v, fn, path + (k,))) for k, v in obj.items())
+        if hasattr(obj, "_metadata"):
+            # module versions that load_state_dict reads
+            mapped._metadata = obj._metadata
+        return mapped
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_map_leaves(v, fn, path + (i,)) for i, v in enumerate(obj))
+    return fn(path, obj)
+
+
+def _shard_path(path, rank):
+    return "{}.shard{}".format(path, rank)
+
+
+def _checksum_path(path):
+    return path + ".sha256"
+
+
+def _replace_checksum(path, digest):
+    tmp = _checksum_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(digest + "\n")
+    os.replace(tmp, _checksum_path(path))
+
+
+def _write_atomic(obj, path):
+    """torch.saves obj next to path and renames it into place, so path
+    always holds a complete checkpoint. Returns the sha256 of the file."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        writer = _HashingWriter(f)
+        torch.save(obj, writer)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    digest = writer.sha256.hexdigest()
+    _replace_checksum(path, digest)
+    return digest
+
+
+def _link_atomic(src, dst, digest):
+    """Points dst at the contents of src with a hardlink, or a copy where the
+    file system has none (e.g. blobfuse), and renames it into place."""
+    tmp = dst + ".tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+    _replace_checksum(dst, digest)
+
+
+def verify_checkpoint(path):
+    """Compares path with the sha256 written next to it by save_checkpoint.
+    Files saved without one are accepted."""
+    if not os.path.isfile(_checksum_path(path)):
+        print("=> no checksum for '{}', not verified".format(path))
+        return True
+    with open(_checksum_path(path)) as f:
+        expected = f.read().strip()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    if sha256.hexdigest() != expected:
+        print("=> checksum mismatch for '{}'".format(path))
+        return False
+    return True
+
+
+def load_checkpoint(path, map_location=None):
+    """Loads a checkpoint written by save_checkpoint or AsyncCheckpointWriter,
+    including its shards if it was saved sharded. Returns None if the file
+    or any of its shards is missing, truncated or from a different save."""
+    if not os.path.isfile(path) or not verify_checkpoint(path):
+        return None
+    checkpoint = torch.load(path, map_location=map_location)
+    shards = checkpoint.pop(SHARDS_KEY, None)
+    if shards is None:
+        return checkpoint
+    tensors = {}
+    for rank in range(shards["num_shards"]):
+        shard_path = _shard_path(path, rank)
+        if not os.path.isfile(shard_path) or not verify_checkpoint(shard_path):
+            print("=> missing or corrupt shard '{}'".format(shard_path))
+            return None
+        shard = torch.load(shard_path, map_location=map_location)
+        if shard["tag"] != shards["tag"]:
+            print("=> shard '{}' is from a different save".format(shard_path))
+            return None
+        tensors.update(shard["tensors"])
+    return _map_leaves(checkpoint, lambda p, v: tensors.get(p, v))
+
+
+class AsyncCheckpointWriter(object):
+    """Saves checkpoints without holding up training for the write.
+
+    save() copies the tensors of the state to pinned CPU buffers, which are
+    reused between saves, and returns once the copy is queued; a background
+    thread then waits for it, writes the file and renames it into place.
+    model_best.pth.tar and the backup file are hardlinks to the new file
+    instead of full copies. Each file gets a .sha256 next to it, checked by
+    load_checkpoint.
+
+    With sharded=True every rank must call save(). The tensors are spread
+    over the ranks by size, each rank writes its shard as
+    <filename>.shard<rank>, and rank 0 also writes the rest of the state to
+    <filename>. Otherwise only rank 0 writes.
+    """
+
+    def __init__(self, checkpoint_dir="./", sharded=False):
+        self.checkpoint_dir = checkpoint_dir
+        self.sharded = sharded
+        distributed = torch.distributed.is_initialized()
+        self.rank = torch.distributed.get_rank() if distributed else 0
+        self.world_size = torch.distributed.get_world_size() if distributed else 1
+        self.pin_memory = torch.cuda.is_available()
+        self.buffers = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def _snapshot(self, path, tensor):
+        buffer = self.buffers.get(path)
+        if (
+            buffer is None
+            or buffer.shape != tensor.shape
+            or buffer.dtype != tensor.dtype
+        ):
+            buffer = torch.empty(
+                tensor.shape,
+                dtype=tensor.dtype,
+                layout=tensor.layout,
+                pin_memory=self.pin_memory,
+            )
+            self.buffers[path] = buffer
+        buffer.copy_(tensor.detach(), non_blocking=True)
+        return buffer
+
+    def _assign_shards(self, state):
+        """Maps each tensor path to a rank, largest tensors first onto the
+        least loaded rank. Every rank computes the same assignment."""
+        sizes = {}
+
+        def measure(path, value):
+            if torch.is_tensor(value):
+                sizes[path] = value.numel() * value.element_size()
+            return value
+
+        _map_leaves(state, measure)
+        load = [0] * self.world_size
+        owner = {}
+        for path in sorted(sizes, key=lambda p: -sizes[p]):
+            rank = load.index(min(load))
+            owner[path] = rank
+            load[rank] += sizes[path]
+        return owner
+
+    def save(
+        self,
+        state,
+        is_best,
+        filename="checkpoint.pth.tar",
+        backup_filename=None,
+    ):
+        if not self.sharded and self.rank != 0:
+            return None
+        # the previous write still reads the pinned buffers
+        self.wait()
         start_time = time.time()
-        # filename = os.path.join('/tmp/', filename)
-        filename = os.path.join(checkpoint_dir, filename)
-        print(f"filename {filename}, ckpt dir {checkpoint_dir}")
-        torch.save(state, filename)
+
+        if self.sharded:
+            owner = self._assign_shards(state)
+            tag = [uuid.uuid4().hex]
+            if self.world_size > 1:
+                dist.broadcast_object_list(tag, src=0)
+            mine = {}
+
+            def split(path, value):
+                if not torch.is_tensor(value):
+                    return value
+                if owner[path] == self.rank:
+                    mine[path] = self._snapshot(path, value)
+                # load_checkpoint fills it in from the shards
+                return None
+
+            skeleton = _map_leaves(state, split)
+            files = [
+                (_shard_path(filename, self.rank), {"tag": tag[0], "tensors": mine})
+            ]
+            if self.rank == 0:
+                skeleton[SHARDS_KEY] = {"num_shards": self.world_size, "tag": tag[0]}
+                files.append((filename, skeleton))
+        else:
+            snapshot = _map_leaves(
+                state,
+                lambda p, v: self._snapshot(p, v) if torch.is_tensor(v) else v,
+            )
+            files = [(filename, snapshot)]
+
+        copied = None
+        if torch.cuda.is_available():
+            copied = torch.cuda.Event()
+            copied.record()
         elapsed_time = time.time() - start_time
-        # print("save checkpoint time on local /tmp ", elapsed_time)
+        print("save checkpoint time (snapshot) ", elapsed_time)
+
+        aliases = []
         if is_best:
-            start_time = time.time()
-            shutil.copyfile(
-                filename, os.path.join(checkpoint_dir, "model_best.pth.tar")
-            )
-            elapsed_time = time.time() - start_time
-            print("save best checkpoint time (copy to blob) ", elapsed_time)
+            aliases.append("model_best.pth.tar")
         if backup_filename is not None:
+            aliases.append(backup_filename)
+        self.pending = self.executor.submit(
+            self._write, filename, files, aliases, copied
+        )
+        return self.pending
+
+    def _write(self, filename, files, aliases, copied):
+        if copied is not None:
+            copied.synchronize()
+        for name, obj in files:
             start_time = time.time()
-            shutil.copyfile(filename, os.path.join(checkpoint_dir, backup_filename))
+            path = os.path.join(self.checkpoint_dir, name)
+            digest = _write_atomic(obj, path)
+            for alias in aliases:
+                # shards keep their .shard<rank> suffix
+                alias_name = alias + name[len(filename) :]
+                _link_atomic(
+                    path, os.path.join(self.checkpoint_dir, alias_name), digest
+                )
             elapsed_time = time.time() - start_time
-            print("save checkpoint time (copy to blob) ", elapsed_time)
+            print(
+                "save checkpoint time (background write) {} ".format(path), elapsed_time
+            )
+
+    def wait(self):
+        """Blocks until the last save is on disk, raising its error if any."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+def get_rng_state():
+    """The random number generator states of this process, to be stored in a
+    checkpoint and restored with set_rng_state."""
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "python": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"].cpu())
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state["cuda"].cpu())
 
 
 def timed_generator(gen):
@@ -116,6 +395,100 @@ def reduce_tensor(tensor):
     return rt
 
 
+def all_reduce_sketch(sketch):
+    """Merges a logger.QuantileSketch in place with the sketches of the same
+    metric on all other ranks, so every rank ends up with the quantiles of
+    the values recorded anywhere.
+    """
+    if not torch.distributed.is_initialized():
+        return sketch
+    sketch.flush()
+    device = torch.device("cuda" if dist.get_backend() == "nccl" else "cpu")
+    counts = torch.from_numpy(sketch.counts).to(device)
+    extremes = torch.tensor([-sketch.min, sketch.max], dtype=torch.float64)
+    extremes = extremes.to(device)
+    dist.all_reduce(counts, op=dist.ReduceOp.SUM)
+    dist.all_reduce(extremes, op=dist.ReduceOp.MAX)
+    sketch.counts = counts.cpu().numpy()
+    sketch.n = int(sketch.counts.sum())
+    sketch.min, sketch.max = -extremes[0].item(), extremes[1].item()
+    return sketch
+
+
+class DeviceMetrics(object):
+    """Accumulates sample-weighted sums of per-step metric tensors on the
+    device they were computed on, so that recording them does not wait
+    for the device. reduce() sums them over all ranks with a single
+    all_reduce and copies the averages to the host in one transfer.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.reset()
+
+    def reset(self):
+        self.sums = None
+        self.n = 0
+        self.steps = 0
+
+    def record(self, values, n=1):
+        stacked = torch.stack([v.detach().reshape(()).float() for v in values])
+        if self.sums is None:
+            self.sums = stacked * n
+        else:
+            self.sums.add_(stacked, alpha=n)
+        self.n += n
+        self.steps += 1
+
+    def reduce(self):
+        """Returns the average of each metric over the samples recorded on
+        all ranks since the last reduce(), and the number of samples."""
+        if self.sums is None:
+            return None, 0
+        totals = torch.cat([self.sums, self.sums.new_tensor([self.n])])
+        if torch.distributed.is_initialized():
+            dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+        totals = totals.tolist()
+        n = totals[-1]
+        self.reset()
+        return {name: total / n for name, total in zip(self.names, totals)}, int(n)
+
+
+class StepLatencies(object):
+    """Measures the compute latency of each step without waiting for the
+    device after it: on a GPU with CUDA events recorded around the step and
+    read back together by pop(), on CPU with the host clock, the step being
+    done when it returns.
+    """
+
+    def __init__(self, cuda=None):
+        self.cuda = torch.cuda.is_available() if cuda is None else cuda
+        self.steps = []
+
+    def start(self):
+        if self.cuda:
+            start = torch.cuda.Event(enable_timing=True)
+            start.record()
+            return start
+        return time.time()
+
+    def stop(self, start):
+        if self.cuda:
+            end = torch.cuda.Event(enable_timing=True)
+            end.record()
+            self.steps.append((start, end))
+        else:
+            self.steps.append(time.time() - start)
+
+    def pop(self):
+        """Returns the latency in seconds of each step since the last pop()."""
+        steps, self.steps = self.steps, []
+        if not self.cuda or not steps:
+            return steps
+        steps[-1][1].synchronize()
+        return [start.elapsed_time(end) / 1000 for start, end in steps]
+
+
 def first_n(n, generator):
     for i, d in zip(range(n), generator):
         yield d
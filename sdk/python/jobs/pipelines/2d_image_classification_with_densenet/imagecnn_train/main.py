@@ -219,6 +219,14 @@ def add_parser_arguments(parser):
         metavar="N",
         help="print frequency (default: 10)",
     )
+    parser.add_argument(
+        "--metrics-interval",
+        default=None,
+        type=int,
+        metavar="N",
+        help="number of iterations between reads of the loss and accuracy "
+        "from the GPU, which wait for the GPU to finish (default: print frequency)",
+    )
     parser.add_argument(
         "--resume",
         default="",
@@ -301,6 +309,13 @@ def add_parser_arguments(parser):
         help="how many epochs run between saving checkpoints",
     )
 
+    parser.add_argument(
+        "--sharded-checkpoints",
+        action="store_true",
+        help="every rank writes a shard of each checkpoint instead of rank 0 "
+        "writing all of it",
+    )
+
     parser.add_argument(
         "--log_redirect", action="store_true", help="Redirect log to files."
     )
@@ -326,13 +341,14 @@ def main(gpu_index, args):
     args.local_rank = gpu_index
     args.distributed = args.world_size > 1
     if args.distributed:
-        args.gpu = args.local_rank % torch.cuda.device_count()
-        print("using gpu ", args.gpu)
-        torch.cuda.set_device(args.gpu)
+        if torch.cuda.is_available():
+            args.gpu = args.local_rank % torch.cuda.device_count()
+            print("using gpu ", args.gpu)
+            torch.cuda.set_device(args.gpu)
 
         args.rank = args.rank * args.ngpus_per_node + gpu_index
         dist.init_process_group(
-            backend="nccl",
+            backend="nccl" if torch.cuda.is_available() else "gloo",
             init_method=args.dist_url,
             world_size=args.world_size,
             rank=args.rank,
@@ -394,36 +410,47 @@ def main(gpu_index, args):
             print("=> no pretrained weights found at '{}'".format(args.resume))
 
     start_epoch = 0
+    start_iteration = 0
+    rng_state = None
     args.total_train_step = 0
     # check previous saved checkpoint first
     # if there is none, then resume from user specified checkpoint if there is
+    # a checkpoint that fails its checksum, e.g. one cut short by preemption,
+    # is skipped in favour of the next candidate
     target_ckpt_path = args.workspace + "/" + checkpoint_file_name
-    ckpt_path = target_ckpt_path
-    if not os.path.isfile(ckpt_path):
-        print("=> no checkpoint found at '{}'".format(ckpt_path))
-        ckpt_path = args.resume
+    checkpoint = None
+    for ckpt_path in (target_ckpt_path, args.resume):
+        if not ckpt_path:
+            continue
+        if not os.path.isfile(ckpt_path):
+            print("=> no checkpoint found at '{}'".format(ckpt_path))
+            continue
+        print("=> loading checkpoint '{}'".format(ckpt_path))
+        checkpoint = load_checkpoint(
+            ckpt_path,
+            map_location=lambda storage, loc: (
+                storage.cuda(args.gpu) if torch.cuda.is_available() else storage
+            ),
+        )
+        if checkpoint is not None:
+            break
+        print("=> skipping invalid checkpoint '{}'".format(ckpt_path))
 
     # optionally resume from a checkpoint
-    if ckpt_path:
-        if os.path.isfile(ckpt_path):
-            print("=> loading checkpoint '{}'".format(ckpt_path))
-            checkpoint = torch.load(
-                ckpt_path, map_location=lambda storage, loc: storage.cuda(args.gpu)
-            )
-            start_epoch = checkpoint["epoch"]
-            best_prec1 = checkpoint["best_prec1"]
-            model_state = checkpoint["state_dict"]
-            optimizer_state = checkpoint["optimizer"]
-            args.total_train_step = checkpoint["total_train_step"]
-            print(
-                "=> loaded checkpoint '{}' (epoch {})".format(
-                    ckpt_path, checkpoint["epoch"]
-                )
+    if checkpoint is not None:
+        start_epoch = checkpoint["epoch"]
+        # checkpoints saved on preemption are part way through an epoch
+        start_iteration = checkpoint.get("iteration", 0)
+        rng_state = checkpoint.get("rng_state")
+        best_prec1 = checkpoint["best_prec1"]
+        model_state = checkpoint["state_dict"]
+        optimizer_state = checkpoint["optimizer"]
+        args.total_train_step = checkpoint["total_train_step"]
+        print(
+            "=> loaded checkpoint '{}' (epoch {}, iteration {})".format(
+                ckpt_path, checkpoint["epoch"], start_iteration
             )
-        else:
-            print("=> no checkpoint found at '{}'".format(ckpt_path))
-            model_state = None
-            optimizer_state = None
+        )
     else:
         model_state = None
         optimizer_state = None
@@ -438,7 +465,7 @@ def main(gpu_index, args):
         (args.arch, args.model_config),
         loss,
         pretrained_weights=pretrained_weights,
-        cuda=True,
+        cuda=torch.cuda.is_available(),
         fp16=args.fp16,
     )
 
@@ -446,6 +473,9 @@ def main(gpu_index, args):
     if args.data_backend == "pytorch":
         get_train_loader = get_pytorch_train_loader
         get_val_loader = get_pytorch_val_loader
+    elif args.data_backend == "shards":
+        get_train_loader = get_shard_train_loader
+        get_val_loader = get_shard_val_loader
     elif args.data_backend == "dali-gpu":
         get_train_loader = get_dali_train_loader(dali_cpu=False)
         get_val_loader = get_dali_val_loader()
@@ -526,6 +556,13 @@ def main(gpu_index, args):
 
     model_and_loss.load_model_state(model_state)
 
+    # the checkpoint holds the generator states of rank 0, the other ranks
+    # keep the ones seeded above
+    if rng_state is not None and (
+        not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0
+    ):
+        set_rng_state(rng_state)
+
     train_loop(
         model_and_loss,
         optimizer,
@@ -547,6 +584,9 @@ def main(gpu_index, args):
         save_checkpoints=args.save_checkpoints and not args.evaluate,
         checkpoint_dir=args.workspace,
         total_train_step=args.total_train_step,
+        metrics_interval=args.metrics_interval or args.print_freq,
+        sharded_checkpoints=args.sharded_checkpoints,
+        start_iteration=start_iteration,
     )
     exp_duration = time.time() - exp_start_time
     if not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0:
@@ -584,7 +624,8 @@ if __name__ == "__main__":
     # extract master ip from os env as a workaround
     args.dist_url = "tcp://" + os.environ["AZ_BATCHAI_MPI_MASTER_NODE"] + ":23456"
 
-    ngpus_per_node = torch.cuda.device_count()
+    # a single process on nodes without a GPU
+    ngpus_per_node = max(torch.cuda.device_count(), 1)
     args.distributed = args.world_size > 1
 
     # Since we have ngpus_per_node processes per node, the total world_size
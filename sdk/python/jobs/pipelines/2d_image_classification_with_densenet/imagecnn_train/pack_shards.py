@@ -0,0 +1,143 @@
+"""Pack an image data set for the "shards" data backend. Every image of
+<data>/train and <data>/val (ImageFolder trees or entry.py manifests) is
+decoded once, resized and center cropped to --size x --size, and written
+as uint8 HWC arrays into .npy shards of --images-per-shard images:
+
+    <output>/{train,val}/shard-00000.npy, ...   (n, size, size, 3) uint8
+    <output>/{train,val}/labels.npy             (N,) int64
+    <output>/{train,val}/index.json             size and shard list
+
+Training then memory-maps the shards (see dataloaders.ShardDataset), so
+epochs read large sequential files and crop arrays instead of opening and
+decoding a JPEG per sample. index.json is written last: a split without
+it is incomplete and is packed again.
+
+    python pack_shards.py --data /data/imagenet --output /data/imagenet-shards
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+
+from image_classification.dataloaders import (
+    SHARD_INDEX_FILE_NAME,
+    SHARD_LABELS_FILE_NAME,
+    image_dataset,
+)
+
+
+def _decode(job):
+    path, size = job
+    transform = transforms.Compose(
+        [transforms.Resize(size), transforms.CenterCrop(size)]
+    )
+    return np.asarray(transform(datasets.folder.pil_loader(path)), dtype=np.uint8)
+
+
+def pack_split(src_dir, dst_dir, size=256, images_per_shard=4096, workers=None):
+    """Packs the images of one split, src_dir, into shards under dst_dir.
+    Does nothing if dst_dir already holds a complete packing at this size.
+    Returns the number of images packed.
+    """
+    index_path = os.path.join(dst_dir, SHARD_INDEX_FILE_NAME)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["size"] == size:
+            print(f"{dst_dir} is already packed.")
+            return sum(shard["count"] for shard in index["shards"])
+
+    samples = image_dataset(src_dir, None).samples
+    os.makedirs(dst_dir, exist_ok=True)
+    np.save(
+        os.path.join(dst_dir, SHARD_LABELS_FILE_NAME),
+        np.array([target for _, target in samples], dtype=np.int64),
+    )
+
+    shards = []
+    shard = None
+    start_time = last_report = time.time()
+    jobs = ((path, size) for path, _ in samples)
+    with Pool(workers or cpu_count()) as p:
+        # imap keeps the sample order, which the labels follow
+        for i, image in enumerate(p.imap(_decode, jobs, chunksize=16)):
+            offset = i % images_per_shard
+            if offset == 0:
+                if shard is not None:
+                    shard.flush()
+                count = min(images_per_shard, len(samples) - i)
+                file_name = "shard-{:05d}.npy".format(len(shards))
+                shard = np.lib.format.open_memmap(
+                    os.path.join(dst_dir, file_name),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(count, size, size, 3),
+                )
+                shards.append({"file": file_name, "count": count})
+            shard[offset] = image
+            now = time.time()
+            if now - last_report >= 10:
+                last_report = now
+                print(
+                    f"{i + 1}/{len(samples)} images, "
+                    f"{(i + 1) / (now - start_time):.0f} images/s"
+                )
+    if shard is not None:
+        shard.flush()
+        del shard
+
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"size": size, "shards": shards}, f)
+    os.replace(index_path + ".tmp", index_path)
+    print(f"packed {len(samples)} images into {len(shards)} shards in {dst_dir}.")
+    return len(samples)
+
+
+def pack_dataset(data_path, output_path, size=256, images_per_shard=4096, workers=None):
+    """Packs data_path/{train,val} into output_path/{train,val}."""
+    for split in ("train", "val"):
+        pack_split(
+            os.path.join(data_path, split),
+            os.path.join(output_path, split),
+            size=size,
+            images_per_shard=images_per_shard,
+            workers=workers,
+        )
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack images into .npy shards")
+    parser.add_argument("--data", required=True, help="path to dataset")
+    parser.add_argument("--output", required=True, help="path to write shards to")
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=256,
+        help="side of the stored images, at least the 224 crop (default: 256)",
+    )
+    parser.add_argument(
+        "--images-per-shard",
+        type=int,
+        default=4096,
+        help="images per .npy file (default: 4096)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="decoding processes (default: cpu count)",
+    )
+    args = parser.parse_args()
+    pack_dataset(
+        args.data,
+        args.output,
+        size=args.size,
+        images_per_shard=args.images_per_shard,
+        workers=args.workers,
+    )
@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Measures the overhead of the profiling modes of PyTorchProfilerHandler on
+one training epoch on cpu, and the size of what each one exports: the
+previous setup (the whole epoch as one profiled step, with stacks and
+memory), a window of training steps, and the phase counters only.
+
+    python bench_profiling.py --batch_size 32 --batches 20
+"""
+import os
+import time
+import argparse
+
+import torch.nn as nn
+import torch.optim as optim
+
+from bench_training_options import build_handler
+from profiling import PyTorchProfilerHandler
+
+MODES = [
+    ("no profiling", None),
+    (
+        "whole epoch, stacks + memory",
+        dict(wait=0, warmup=0, active=1, export_stacks=True, profile_memory=True),
+    ),
+    ("window wait=1 warmup=1 active=3", dict(wait=1, warmup=1, active=3)),
+    ("counters only", dict(counters_only=True)),
+]
+
+
+def directory_size(root):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(root)
+        for name in names
+    )
+
+
+def measure(args, profiler_kwargs):
+    """Returns the seconds of a profiled epoch, the MiB exported and the
+    phase metrics, after an unprofiled warm up epoch."""
+    handler = build_handler(args, {})
+    optimizer = optim.SGD(handler.model.parameters(), lr=0.01, momentum=0.9)
+    criterion = nn.CrossEntropyLoss()
+    handler._epoch_train(0, optimizer, criterion)
+
+    profiler_handler = PyTorchProfilerHandler(
+        enabled=profiler_kwargs is not None, rank=0, **(profiler_kwargs or {})
+    )
+    profiler = profiler_handler.start_profiler()
+    whole_epoch = profiler_kwargs is not None and profiler_kwargs.get("active") == 1
+    # the previous setup only called profiler.step() at the end of the epoch
+    handler.profiler = None if whole_epoch else profiler
+    handler.phase_counters = profiler_handler.phase_counters
+
+    start = time.time()
+    handler._epoch_train(1, optimizer, criterion)
+    if whole_epoch:
+        profiler.step()
+    if profiler is not None:
+        profiler.stop()
+    elapsed = time.time() - start
+
+    size = 0
+    if profiler_handler.profiler_output_tmp_dir is not None:
+        size = directory_size(profiler_handler.profiler_output_tmp_dir.name)
+        profiler_handler.profiler_output_tmp_dir.cleanup()
+    metrics = {}
+    if handler.phase_counters is not None:
+        metrics = handler.phase_counters.pop_metrics()
+    return elapsed, size / 2**20, metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--input_size", type=int, default=112)
+    parser.add_argument("--num_classes", type=int, default=365)
+    args = parser.parse_args()
+
+    results = []
+    for name, profiler_kwargs in MODES:
+        results.append((name,) + measure(args, profiler_kwargs))
+
+    print("{:<34} {:>10} {:>12}".format("profiling", "epoch s", "exported MiB"))
+    for name, elapsed, size, _ in results:
+        print("{:<34} {:>10.2f} {:>12.1f}".format(name, elapsed, size))
+    for name, value in sorted(results[-1][3].items()):
+        if name.endswith("_ms_per_step"):
+            print("{:<34} {:>10.1f}".format(name, value))
@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Measures the wall time of PyTorchDistributedModelTrainingSequence._epoch_eval
+against world size on cpu with the gloo backend, with every process
+evaluating the whole validation set (shard_validation=False) and with the
+set split between processes (shard_validation=True). Also checks that both
+report the same metrics. Each process gets cpu_count // world_size threads.
+
+    python bench_sharded_eval.py --world_sizes 1 2 4 --samples 512
+"""
+import os
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, TensorDataset
+
+from model import load_model
+from train import PyTorchDistributedModelTrainingSequence, UnpaddedDistributedSampler
+
+
+def evaluate(rank, world_size, args, shard_validation, port, results):
+    torch.set_num_threads(max(1, os.cpu_count() // world_size))
+    torch.distributed.init_process_group(
+        "gloo",
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=world_size,
+    )
+
+    # a training sequence set up by hand, without mlflow
+    handler = PyTorchDistributedModelTrainingSequence()
+    handler.dataloading_config = argparse.Namespace(
+        non_blocking=False, prefetch_to_device=False, shard_validation=shard_validation
+    )
+    handler.device = torch.device("cpu")
+    handler.world_size = world_size
+    handler.world_rank = rank
+    handler.multinode_available = world_size > 1
+
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(
+        torch.randn(
+            args.samples, 3, args.input_size, args.input_size, generator=generator
+        ),
+        torch.randint(args.num_classes, (args.samples,), generator=generator),
+    )
+    sampler = None
+    if shard_validation:
+        sampler = UnpaddedDistributedSampler(
+            dataset, num_replicas=world_size, rank=rank
+        )
+    handler.validation_data_loader = DataLoader(
+        dataset, batch_size=args.batch_size, sampler=sampler
+    )
+
+    # same seed, same weights in every process
+    torch.manual_seed(0)
+    model = load_model("resnet18", output_dimension=args.num_classes, pretrained=False)
+    if handler.multinode_available:
+        model = torch.nn.parallel.DistributedDataParallel(model)
+    handler.model = model
+
+    criterion = nn.CrossEntropyLoss()
+    handler._epoch_eval(0, criterion)
+    torch.distributed.barrier()
+    start = time.time()
+    metrics = handler._epoch_eval(1, criterion)
+    torch.distributed.barrier()
+    elapsed = time.time() - start
+    if rank == 0:
+        results.put((elapsed, metrics))
+    torch.distributed.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world_sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--samples", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--input_size", type=int, default=112)
+    parser.add_argument("--num_classes", type=int, default=365)
+    parser.add_argument("--port", type=int, default=29511)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cpus, {args.samples} validation samples")
+    print(
+        "{:>10} {:>16} {:>12} {:>10}".format(
+            "world size", "eval", "seconds", "accuracy"
+        )
+    )
+    results = mp.get_context("spawn").SimpleQueue()
+    reference = None
+    for world_size in args.world_sizes:
+        for shard_validation in (False, True):
+            mp.spawn(
+                evaluate,
+                args=(world_size, args, shard_validation, args.port, results),
+                nprocs=world_size,
+            )
+            args.port += 1
+            elapsed, (running_loss, num_correct, num_samples) = results.get()
+            assert num_samples == args.samples, num_samples
+            # loss is summed in a different order, compare with a tolerance
+            if reference is None:
+                reference = (running_loss, num_correct)
+            assert abs(running_loss - reference[0]) < 1e-6 * abs(reference[0])
+            assert num_correct == reference[1]
+            print(
+                "{:>10} {:>16} {:>12.2f} {:>10.4f}".format(
+                    world_size,
+                    "sharded" if shard_validation else "full per rank",
+                    elapsed,
+                    num_correct / num_samples,
+                )
+            )
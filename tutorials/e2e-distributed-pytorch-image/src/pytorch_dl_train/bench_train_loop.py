@@ -0,0 +1,136 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Compares the samples/sec of one training epoch of
+PyTorchDistributedModelTrainingSequence._epoch_train with the previous loop,
+which built one-hot targets and read the loss and accuracy back from the
+device on every batch. On a gpu, the new loop is measured with and without
+prefetch_to_device. Uses random images, so only the training loop is measured.
+
+    python bench_train_loop.py --batch_size 64 --batches 100
+"""
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+
+from model import load_model
+from train import PyTorchDistributedModelTrainingSequence
+
+
+def legacy_epoch_train(self, epoch, optimizer, criterion):
+    """The previous _epoch_train()."""
+    self.model.train()
+    self.training_data_sampler.set_epoch(epoch)
+
+    num_correct = 0
+    num_total_images = 0
+    running_loss = 0.0
+
+    for images, targets in self.training_data_loader:
+        images = images.to(
+            self.device, non_blocking=self.dataloading_config.non_blocking
+        )
+        one_hot_targets = torch.nn.functional.one_hot(
+            targets.to(self.device, non_blocking=self.dataloading_config.non_blocking),
+            num_classes=len(self.labels),
+        ).float()
+
+        optimizer.zero_grad()
+        outputs = self.model(images)
+        loss = criterion(outputs, one_hot_targets)
+        correct = torch.argmax(outputs, dim=-1) == (targets.to(self.device))
+
+        running_loss += loss.item() * images.size(0)
+        num_correct += torch.sum(correct).item()
+        num_total_images += len(images)
+
+        loss.backward()
+        optimizer.step()
+
+    return running_loss, num_correct, num_total_images
+
+
+def build_handler(args, prefetch_to_device):
+    """A training sequence set up for a single process, without mlflow."""
+    handler = PyTorchDistributedModelTrainingSequence()
+    handler.dataloading_config = argparse.Namespace(
+        non_blocking=True, prefetch_to_device=prefetch_to_device
+    )
+    handler.device = torch.device(0 if torch.cuda.is_available() else "cpu")
+    handler.labels = list(range(args.num_classes))
+
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(
+        torch.randn(
+            args.batch_size * args.batches,
+            3,
+            args.input_size,
+            args.input_size,
+            generator=generator,
+        ),
+        torch.randint(
+            args.num_classes, (args.batch_size * args.batches,), generator=generator
+        ),
+    )
+    handler.training_data_sampler = DistributedSampler(dataset, num_replicas=1, rank=0)
+    handler.training_data_loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        pin_memory=torch.cuda.is_available(),
+        sampler=handler.training_data_sampler,
+    )
+    handler.model = load_model(
+        "resnet18", output_dimension=args.num_classes, pretrained=False
+    ).to(handler.device)
+    return handler
+
+
+def measure(handler, epoch_train):
+    """Returns the samples/sec of the second of two epochs."""
+    optimizer = optim.SGD(handler.model.parameters(), lr=0.01, momentum=0.9)
+    criterion = nn.CrossEntropyLoss()
+    epoch_train(handler, 0, optimizer, criterion)
+    start = time.time()
+    _, _, num_samples = epoch_train(handler, 1, optimizer, criterion)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return num_samples / (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=100)
+    parser.add_argument("--input_size", type=int, default=224)
+    parser.add_argument("--num_classes", type=int, default=365)
+    parser.add_argument("--num_workers", type=int, default=2)
+    args = parser.parse_args()
+
+    variants = [
+        ("per-batch .item(), one-hot", False, legacy_epoch_train),
+        (
+            "on-device metrics",
+            False,
+            PyTorchDistributedModelTrainingSequence._epoch_train,
+        ),
+    ]
+    if torch.cuda.is_available():
+        variants.append(
+            (
+                "on-device metrics, prefetch",
+                True,
+                PyTorchDistributedModelTrainingSequence._epoch_train,
+            )
+        )
+
+    print("{:<32} {:>10}".format("train loop", "samples/s"))
+    for name, prefetch_to_device, epoch_train in variants:
+        handler = build_handler(args, prefetch_to_device)
+        print("{:<32} {:>10.1f}".format(name, measure(handler, epoch_train)))
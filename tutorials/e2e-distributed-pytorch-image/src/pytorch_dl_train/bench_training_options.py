@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Reports the training step time of PyTorchDistributedModelTrainingSequence
+for each training performance option (AMP, channels_last, torch.compile,
+gradient accumulation, DistributedDataParallel settings) on cpu, with
+random images so that only the model step is measured. DDP runs in a
+single process gloo group. On cpu, AMP uses bfloat16.
+
+    python bench_training_options.py --batch_size 32 --batches 20
+"""
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+
+from model import load_model
+from train import PyTorchDistributedModelTrainingSequence
+
+OPTIONS = [
+    ("fp32", {}),
+    ("amp", {"enable_amp": True}),
+    ("channels_last", {"channels_last": True}),
+    ("channels_last + amp", {"channels_last": True, "enable_amp": True}),
+    ("compile", {"enable_compile": True}),
+    ("gradient accumulation x4", {"gradient_accumulation_steps": 4}),
+    ("ddp", {"ddp": True}),
+    (
+        "ddp bucket view + static graph",
+        {"ddp": True, "ddp_gradient_as_bucket_view": True, "ddp_static_graph": True},
+    ),
+]
+
+
+def build_handler(args, options):
+    """A training sequence set up for a single process, without mlflow."""
+    config = argparse.Namespace(
+        non_blocking=False,
+        prefetch_to_device=False,
+        enable_amp=False,
+        channels_last=False,
+        enable_compile=False,
+        gradient_accumulation_steps=1,
+        ddp_gradient_as_bucket_view=False,
+        ddp_static_graph=False,
+    )
+    for key, value in options.items():
+        setattr(config, key, value)
+
+    handler = PyTorchDistributedModelTrainingSequence()
+    handler.dataloading_config = handler.training_config = config
+    handler.device = torch.device("cpu")
+    handler.multinode_available = options.get("ddp", False)
+    handler.self_is_main_node = False
+
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(
+        torch.randn(
+            args.batch_size * args.batches,
+            3,
+            args.input_size,
+            args.input_size,
+            generator=generator,
+        ),
+        torch.randint(
+            args.num_classes, (args.batch_size * args.batches,), generator=generator
+        ),
+    )
+    handler.training_data_sampler = DistributedSampler(dataset, num_replicas=1, rank=0)
+    handler.training_data_loader = DataLoader(
+        dataset, batch_size=args.batch_size, sampler=handler.training_data_sampler
+    )
+
+    torch.manual_seed(0)
+    handler.setup_model(
+        load_model("resnet18", output_dimension=args.num_classes, pretrained=False)
+    )
+    return handler
+
+
+def measure(handler, args):
+    """Returns the mean step time in ms of the second of two epochs."""
+    optimizer = optim.SGD(handler.model.parameters(), lr=0.01, momentum=0.9)
+    criterion = nn.CrossEntropyLoss()
+    # the first epoch also compiles, if enabled
+    handler._epoch_train(0, optimizer, criterion)
+    start = time.time()
+    handler._epoch_train(1, optimizer, criterion)
+    return (time.time() - start) / args.batches * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--input_size", type=int, default=112)
+    parser.add_argument("--num_classes", type=int, default=365)
+    parser.add_argument("--port", type=int, default=29521)
+    args = parser.parse_args()
+
+    # DISTRIBUTED: a group of one process, for the ddp options
+    torch.distributed.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{args.port}", rank=0, world_size=1
+    )
+
+    print(f"torch=={torch.__version__}, {torch.get_num_threads()} threads")
+    print("{:<32} {:>14}".format("option", "ms / step"))
+    for name, options in OPTIONS:
+        if options.get("enable_compile") and not hasattr(torch, "compile"):
+            print("{:<32} {:>14}".format(name, "unavailable"))
+            continue
+        handler = build_handler(args, options)
+        print("{:<32} {:>14.1f}".format(name, measure(handler, args)))
+
+    torch.distributed.destroy_process_group()
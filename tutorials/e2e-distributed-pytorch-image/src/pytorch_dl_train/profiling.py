@@ -7,6 +7,8 @@ This script provides some helper code to help with pytorch profiling.
 import os
 import time
 import logging
+import contextlib
+import collections
 import torch
 import mlflow
 import tempfile
@@ -36,11 +38,14 @@ def markdown_trace_handler(dir_name: str, rank: int = 0):
         # generate report in markdown format
         markdown = ["# Pytorch Profiler report"]
 
-        markdown.append("## Average by cuda time")
+        if torch.cuda.is_available():
+            markdown.append("## Average by cuda time")
+            sort_by = "self_cuda_time_total"
+        else:
+            markdown.append("## Average by cpu time")
+            sort_by = "self_cpu_time_total"
         markdown.append("```")
-        markdown.append(
-            prof.key_averages().table(sort_by="self_cuda_time_total", row_limit=-1)
-        )
+        markdown.append(prof.key_averages().table(sort_by=sort_by, row_limit=-1))
         markdown.append("```")
 
         with open(file_name, "w") as out_file:
@@ -88,22 +93,115 @@ def export_stack_trace_handler(
     return _handler_fn
 
 
+class PhaseCounters:
+    """Lightweight alternative to a profiler trace: sums up the wall time of
+    named phases of the training loop (ex: train.forward), to be reported
+    as metrics once per epoch.
+
+    On gpu the device is synchronized around each phase, so that the time
+    of the kernels a phase launched is counted in it. This costs some
+    throughput, but much less than a trace."""
+
+    def __init__(self, synchronize=None):
+        """Constructor.
+
+        Args:
+            synchronize (bool): synchronize cuda around phases (default: if cuda is available)
+        """
+        if synchronize is None:
+            synchronize = torch.cuda.is_available()
+        self.synchronize = synchronize
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+
+    def _now(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @contextlib.contextmanager
+    def time(self, name):
+        """Context manager adding the time spent inside it to phase name."""
+        start = self._now()
+        try:
+            yield
+        finally:
+            self.totals[name] += self._now() - start
+            self.counts[name] += 1
+
+    def iterate(self, iterable, name):
+        """Yields from iterable, adding the time spent waiting for each item
+        (ex: data loading and copy to device) to phase name."""
+        iterator = iter(iterable)
+        while True:
+            start = self._now()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.totals[name] += self._now() - start
+            self.counts[name] += 1
+            yield item
+
+    def pop_metrics(self):
+        """Returns the total seconds and milliseconds per step of each phase
+        since the last call, as a dict of metrics, and resets the counters."""
+        metrics = {}
+        for name, total in self.totals.items():
+            key = name.replace(".", "_")
+            metrics[f"epoch_{key}_time"] = total
+            metrics[f"{key}_ms_per_step"] = total / self.counts[name] * 1000
+        self.totals.clear()
+        self.counts.clear()
+        return metrics
+
+
 class PyTorchProfilerHandler:
     """This class handles the initialization and setup of PyTorch profiler"""
 
-    def __init__(self, enabled=False, rank=None):
+    def __init__(
+        self,
+        enabled=False,
+        rank=None,
+        counters_only=False,
+        wait=1,
+        warmup=1,
+        active=3,
+        repeat=1,
+        export_markdown=True,
+        export_stacks=False,
+        export_tensorboard=True,
+        profile_memory=False,
+    ):
         """Constructor.
 
         Args:
             enabled (bool): is profiling enabled?
-            export_format (str): generate 'markdown' or 'tensorboard' profile in mlflow artifacts
             rank (int): rank of the current process/node
+            counters_only (bool): only time the training phases (see PhaseCounters), no trace
+            wait (int): training steps skipped before each profiling window
+            warmup (int): training steps profiled but discarded, before the active ones
+            active (int): training steps recorded in each profiling window
+            repeat (int): number of profiling windows, 0 to repeat until the end
+            export_markdown (bool): export a table of operators in markdown
+            export_stacks (bool): export stacks in text, records the python stack of every operator
+            export_tensorboard (bool): export a trace for the tensorboard plugin
+            profile_memory (bool): record tensor memory allocations
         """
         self.logger = logging.getLogger(__name__)
         self.enabled = enabled
         self.rank = rank
+        self.counters_only = counters_only
+        self.schedule_kwargs = dict(
+            wait=wait, warmup=warmup, active=active, repeat=repeat
+        )
+        self.export_markdown = export_markdown
+        self.export_stacks = export_stacks
+        self.export_tensorboard = export_tensorboard
+        self.profile_memory = profile_memory
         self.profiler_output_tmp_dir = None
         self.profiler = None
+        self.phase_counters = None
 
     def start_profiler(self):
         """Setup and start the pytorch profiler.
@@ -111,7 +209,12 @@ class PyTorchProfilerHandler:
         Returns:
             profiler (torch.profiler): the profiler
         """
-        if self.enabled:
+        if self.enabled and self.counters_only:
+            self.logger.info(f"Profiler not started (counters_only=True).")
+            self.phase_counters = PhaseCounters()
+            self.profiler = None
+
+        elif self.enabled:
             self.profiler_output_tmp_dir = tempfile.TemporaryDirectory()
             self.logger.info(
                 f"Starting profiler (enabled=True) with tmp dir {self.profiler_output_tmp_dir.name}."
@@ -128,48 +231,52 @@ class PyTorchProfilerHandler:
             trace_handlers = []
 
             # export in markdown
-            markdown_logs_export = os.path.join(
-                self.profiler_output_tmp_dir.name, "markdown"
-            )
-            trace_handlers.append(
-                markdown_trace_handler(markdown_logs_export, rank=self.rank)
-            )
+            if self.export_markdown:
+                markdown_logs_export = os.path.join(
+                    self.profiler_output_tmp_dir.name, "markdown"
+                )
+                trace_handlers.append(
+                    markdown_trace_handler(markdown_logs_export, rank=self.rank)
+                )
 
             # export stacks in txt
-            stacks_logs_export = os.path.join(
-                self.profiler_output_tmp_dir.name, "stacks"
-            )
-            stack_metrics = ["self_cpu_time_total"]
-            if torch.cuda.is_available():
-                stack_metrics.append("self_cuda_time_total")
-
-            trace_handlers.append(
-                export_stack_trace_handler(
-                    stacks_logs_export, rank=self.rank, metrics=stack_metrics
+            if self.export_stacks:
+                stacks_logs_export = os.path.join(
+                    self.profiler_output_tmp_dir.name, "stacks"
+                )
+                stack_metrics = ["self_cpu_time_total"]
+                if torch.cuda.is_available():
+                    stack_metrics.append("self_cuda_time_total")
+
+                trace_handlers.append(
+                    export_stack_trace_handler(
+                        stacks_logs_export, rank=self.rank, metrics=stack_metrics
+                    )
                 )
-            )
 
             # export tensorboard
-            tensorboard_logs_export = os.path.join(
-                self.profiler_output_tmp_dir.name, "tensorboard_logs"
-            )
-            trace_handlers.append(
-                torch.profiler.tensorboard_trace_handler(tensorboard_logs_export)
-            )
+            if self.export_tensorboard:
+                tensorboard_logs_export = os.path.join(
+                    self.profiler_output_tmp_dir.name, "tensorboard_logs"
+                )
+                trace_handlers.append(
+                    torch.profiler.tensorboard_trace_handler(tensorboard_logs_export)
+                )
 
             # profiler takes 1 handler, we're composing all above in a single handler
             trace_handler = composite_trace_handler(trace_handlers)
 
-            # process every single step
-            profiler_schedule = torch.profiler.schedule(wait=0, warmup=0, active=1)
+            # profile a window of training steps, see profiler.step() in train.py
+            self.logger.info(f"Profiler schedule {self.schedule_kwargs}.")
+            profiler_schedule = torch.profiler.schedule(**self.schedule_kwargs)
 
             # initialize profiler
             self.profiler = torch.profiler.profile(
                 schedule=profiler_schedule,
                 record_shapes=False,
-                profile_memory=True,
+                profile_memory=self.profile_memory,
                 activities=activities,
-                with_stack=True,  # needed to export stacks
+                with_stack=self.export_stacks,  # needed to export stacks only
                 on_trace_ready=trace_handler,
             )
             self.profiler.start()
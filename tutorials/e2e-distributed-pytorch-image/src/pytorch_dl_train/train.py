@@ -18,6 +18,8 @@ import json
 import pickle
 import logging
 import argparse
+import inspect
+import contextlib
 from tqdm import tqdm
 from distutils.util import strtobool
 
@@ -39,6 +41,95 @@ from image_io import build_image_datasets
 from profiling import PyTorchProfilerHandler
 
 
+class UnpaddedDistributedSampler(torch.utils.data.Sampler):
+    """Splits a dataset between processes like DistributedSampler with
+    shuffle=False, but without repeating samples to give every process the
+    same number of them, so that metrics summed over all processes count
+    each sample exactly once. Process sizes differ by at most one sample."""
+
+    def __init__(self, dataset, num_replicas, rank):
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
+
+
+class DevicePrefetcher:
+    """Iterates over a DataLoader and yields its batches on device.
+    With overlap=True on CUDA, the next batch is copied on a side stream
+    while the current one is being processed, so the host to device
+    transfer overlaps with compute. Use with pin_memory=True, or the copies
+    are not asynchronous.
+    """
+
+    def __init__(
+        self,
+        data_loader,
+        device,
+        non_blocking=False,
+        overlap=True,
+        memory_format=torch.contiguous_format,
+    ):
+        self.data_loader = data_loader
+        self.device = device
+        self.non_blocking = non_blocking
+        self.overlap = overlap and device.type == "cuda"
+        # applied to the images, i.e. to 4 dimensional tensors
+        self.memory_format = memory_format
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def _to_device(self, batch, non_blocking):
+        # PROFILER: record_function will report to the profiler (if enabled)
+        # here a specific wall time for a given block of code
+        with record_function("prefetch.to_device"):
+            return [
+                tensor.to(
+                    self.device,
+                    non_blocking=non_blocking,
+                    memory_format=self.memory_format,
+                )
+                if tensor.dim() == 4
+                else tensor.to(self.device, non_blocking=non_blocking)
+                for tensor in batch
+            ]
+
+    def __iter__(self):
+        if not self.overlap:
+            for batch in self.data_loader:
+                yield self._to_device(batch, self.non_blocking)
+            return
+
+        copy_stream = torch.cuda.Stream(self.device)
+        compute_stream = torch.cuda.current_stream(self.device)
+
+        def ready(batch, copied):
+            # the compute stream waits for this batch's copy only, and the
+            # memory is not reused before the compute stream is done with it
+            compute_stream.wait_event(copied)
+            for tensor in batch:
+                tensor.record_stream(compute_stream)
+            return batch
+
+        pending = None
+        for batch in self.data_loader:
+            with torch.cuda.stream(copy_stream):
+                batch = self._to_device(batch, True)
+                copied = torch.cuda.Event()
+                copied.record(copy_stream)
+            if pending is not None:
+                yield ready(*pending)
+            pending = (batch, copied)
+        if pending is not None:
+            yield ready(*pending)
+
+
 class PyTorchDistributedModelTrainingSequence:
     """Generic class to run the sequence for training a PyTorch model
     using distributed training."""
@@ -57,6 +148,13 @@ class PyTorchDistributedModelTrainingSequence:
         self.labels = []
         self.model_signature = None
 
+        # TRAINING PERFORMANCE (see setup_model)
+        self.compiled_model = None
+        self.memory_format = torch.contiguous_format
+        self.autocast_dtype = None
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=False)
+        self.gradient_accumulation_steps = 1
+
         # DISTRIBUTED CONFIG
         self.world_size = 1
         self.world_rank = 0
@@ -75,6 +173,7 @@ class PyTorchDistributedModelTrainingSequence:
         # PROFILER
         self.profiler = None
         self.profiler_output_tmp_dir = None
+        self.phase_counters = None
 
     #####################
     ### SETUP METHODS ###
@@ -102,12 +201,28 @@ class PyTorchDistributedModelTrainingSequence:
         self.dataloading_config.non_blocking = bool(
             self.dataloading_config.non_blocking
         )
+        self.dataloading_config.prefetch_to_device = bool(
+            self.dataloading_config.prefetch_to_device
+        )
+        self.dataloading_config.shard_validation = bool(
+            self.dataloading_config.shard_validation
+        )
+        for flag in [
+            "enable_amp",
+            "channels_last",
+            "enable_compile",
+            "ddp_gradient_as_bucket_view",
+            "ddp_static_graph",
+        ]:
+            setattr(
+                self.training_config, flag, bool(getattr(self.training_config, flag))
+            )
 
         # DISTRIBUTED: detect multinode config
         # depending on the Azure ML distribution.type, different environment variables will be provided
         # to configure DistributedDataParallel
         self.distributed_backend = args.distributed_backend
-        if self.distributed_backend == "nccl":
+        if self.distributed_backend in ("nccl", "gloo"):
             self.world_size = int(os.environ.get("WORLD_SIZE", "1"))
             self.world_rank = int(os.environ.get("RANK", "0"))
             self.local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
@@ -174,13 +289,29 @@ class PyTorchDistributedModelTrainingSequence:
                     "prefetch_factor": self.dataloading_config.prefetch_factor,
                     "pin_memory": self.dataloading_config.pin_memory,
                     "non_blocking": self.dataloading_config.non_blocking,
+                    "prefetch_to_device": self.dataloading_config.prefetch_to_device,
+                    "shard_validation": self.dataloading_config.shard_validation,
                     # training params
                     "model_arch": self.training_config.model_arch,
                     "model_arch_pretrained": self.training_config.model_arch_pretrained,
                     "learning_rate": self.training_config.learning_rate,
                     "num_epochs": self.training_config.num_epochs,
+                    "gradient_accumulation_steps": self.training_config.gradient_accumulation_steps,
+                    # training performance params
+                    "enable_amp": self.training_config.enable_amp,
+                    "channels_last": self.training_config.channels_last,
+                    "enable_compile": self.training_config.enable_compile,
+                    "ddp_gradient_as_bucket_view": self.training_config.ddp_gradient_as_bucket_view,
+                    "ddp_static_graph": self.training_config.ddp_static_graph,
                     # profiling params
                     "enable_profiling": self.training_config.enable_profiling,
+                    "profiling_counters_only": self.training_config.profiling_counters_only,
+                    "profiling_schedule": "wait={},warmup={},active={},repeat={}".format(
+                        self.training_config.profiling_wait,
+                        self.training_config.profiling_warmup,
+                        self.training_config.profiling_active,
+                        self.training_config.profiling_repeat,
+                    ),
                 }
             )
 
@@ -220,13 +351,22 @@ class PyTorchDistributedModelTrainingSequence:
             **optional_data_loading_kwargs,
         )
 
-        # DISTRIBUTED: we don't need a sampler for validation set
-        # it is used as-is in every node/process
+        # DISTRIBUTED: with shard_validation, each node/process evaluates its own
+        # part of the validation set and the metrics are summed in _epoch_eval()
+        # otherwise the validation set is used as-is in every node/process
+        if self.dataloading_config.shard_validation:
+            validation_data_sampler = UnpaddedDistributedSampler(
+                validation_dataset, num_replicas=self.world_size, rank=self.world_rank
+            )
+        else:
+            validation_data_sampler = None
+
         self.validation_data_loader = DataLoader(
             validation_dataset,
             batch_size=self.dataloading_config.batch_size,
             num_workers=self.dataloading_config.num_workers,  # self.cpu_count,
             pin_memory=self.dataloading_config.pin_memory,
+            sampler=validation_data_sampler,
         )
 
         if self.self_is_main_node:
@@ -238,10 +378,61 @@ class PyTorchDistributedModelTrainingSequence:
         self.logger.info(f"Setting up model to use device {self.device}")
         self.model = model.to(self.device)
 
+        # channels_last (NHWC) lets convolutions use faster kernels
+        # (tensor cores on gpu, oneDNN on cpu), images are converted when copied to device
+        if self.training_config.channels_last:
+            self.logger.info(f"Setting up model to use channels_last.")
+            self.memory_format = torch.channels_last
+            self.model = self.model.to(memory_format=self.memory_format)
+
+        # AMP: forward in float16 on gpu (with loss scaling) or bfloat16 on cpu
+        if self.training_config.enable_amp:
+            self.autocast_dtype = (
+                torch.float16 if self.device.type == "cuda" else torch.bfloat16
+            )
+            self.logger.info(f"Setting up autocast to {self.autocast_dtype}.")
+        self.grad_scaler = torch.cuda.amp.GradScaler(
+            enabled=self.autocast_dtype == torch.float16
+        )
+
+        self.gradient_accumulation_steps = max(
+            1, self.training_config.gradient_accumulation_steps
+        )
+
         # DISTRIBUTED: the model needs to be wrapped in a DistributedDataParallel class
         if self.multinode_available:
             self.logger.info(f"Setting up model to use DistributedDataParallel.")
-            self.model = torch.nn.parallel.DistributedDataParallel(self.model)
+            ddp_kwargs = {
+                # gradients are views into the allreduce buckets, saves a copy and memory
+                "gradient_as_bucket_view": self.training_config.ddp_gradient_as_bucket_view
+            }
+            ddp_parameters = inspect.signature(
+                torch.nn.parallel.DistributedDataParallel
+            ).parameters
+            if (
+                self.training_config.ddp_static_graph
+                and "static_graph" in ddp_parameters
+            ):
+                ddp_kwargs["static_graph"] = True
+            self.model = torch.nn.parallel.DistributedDataParallel(
+                self.model, **ddp_kwargs
+            )
+            if (
+                self.training_config.ddp_static_graph
+                and "static_graph" not in ddp_kwargs
+            ):
+                # NOTE: torch<1.11 only has the private method
+                self.model._set_static_graph()
+
+        # torch.compile is only used for training, see _epoch_train()
+        if self.training_config.enable_compile:
+            if hasattr(torch, "compile"):
+                self.logger.info(f"Compiling model with torch.compile.")
+                self.compiled_model = torch.compile(self.model)
+            else:
+                self.logger.warning(
+                    f"torch.compile is not available in torch=={torch.__version__}, ignoring enable_compile."
+                )
 
         # fun: log the number of parameters
         params_count = 0
@@ -262,76 +453,161 @@ class PyTorchDistributedModelTrainingSequence:
     ### TRAINING METHODS ###
     ########################
 
+    @contextlib.contextmanager
+    def _phase(self, name):
+        """Marks a phase of the training loop for the profiler, and times it
+        if phase counters are enabled."""
+        # PROFILER: record_function will report to the profiler (if enabled)
+        # here a specific wall time for a given block of code
+        with record_function(name):
+            if self.phase_counters is None:
+                yield
+            else:
+                with self.phase_counters.time(name):
+                    yield
+
+    def _device_batches(self, data_loader):
+        """Wraps data_loader to yield its batches already on self.device."""
+        return DevicePrefetcher(
+            data_loader,
+            self.device,
+            non_blocking=self.dataloading_config.non_blocking,
+            overlap=self.dataloading_config.prefetch_to_device,
+            memory_format=self.memory_format,
+        )
+
+    def _reduce_metrics(self, running_loss, num_correct, num_samples, all_ranks):
+        """Reads back the metrics accumulated on device during an epoch,
+        summed over all ranks if all_ranks. This is the only sync with the
+        device for metrics in an epoch."""
+        metrics = torch.stack(
+            [
+                running_loss,
+                num_correct.to(running_loss.dtype),
+                torch.tensor(num_samples, dtype=running_loss.dtype).to(self.device),
+            ]
+        )
+        if all_ranks and self.multinode_available:
+            # DISTRIBUTED: sum the metrics of all processes
+            torch.distributed.all_reduce(metrics)
+        running_loss, num_correct, num_samples = metrics.tolist()
+        return running_loss, int(num_correct), int(num_samples)
+
     def _epoch_eval(self, epoch, criterion):
         """Called during train() for running the eval phase of one epoch."""
+        self.model.eval()
+
+        # DISTRIBUTED: processes may get a different number of batches, evaluate
+        # without DistributedDataParallel, which syncs buffers in every forward
+        if isinstance(self.model, torch.nn.parallel.DistributedDataParallel):
+            model = self.model.module
+        else:
+            model = self.model
+
         with torch.no_grad():
-            num_correct = 0
+            # metrics are accumulated on device, see _reduce_metrics()
+            running_loss = torch.zeros((), dtype=torch.float64, device=self.device)
+            num_correct = torch.zeros((), dtype=torch.int64, device=self.device)
             num_total_images = 0
-            running_loss = 0.0
-
-            for images, targets in tqdm(self.validation_data_loader):
-                with record_function("eval.to_device"):
-                    images = images.to(
-                        self.device, non_blocking=self.dataloading_config.non_blocking
-                    )
-                    one_hot_targets = targets.to(
-                        self.device, non_blocking=self.dataloading_config.non_blocking
-                    )
 
-                with record_function("eval.forward"):
-                    outputs = self.model(images)
+            for images, targets in tqdm(
+                self._device_batches(self.validation_data_loader)
+            ):
+                with self._phase("eval.forward"), self._autocast():
+                    outputs = model(images)
 
-                    loss = criterion(outputs, one_hot_targets)
-                    running_loss += loss.item() * images.size(0)
+                    loss = criterion(outputs, targets)
+                    running_loss += loss * images.size(0)
 
-                    correct = torch.argmax(outputs, dim=-1) == (targets.to(self.device))
-                    num_correct += torch.sum(correct).item()
+                    correct = torch.argmax(outputs, dim=-1) == targets
+                    num_correct += torch.sum(correct)
                     num_total_images += len(images)
 
-        return running_loss, num_correct, num_total_images
+        # DISTRIBUTED: with shard_validation, each process evaluated its own part
+        return self._reduce_metrics(
+            running_loss,
+            num_correct,
+            num_total_images,
+            all_ranks=self.dataloading_config.shard_validation,
+        )
+
+    def _autocast(self):
+        """Context manager running the forward pass with AMP, if enabled."""
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.autocast_dtype)
 
     def _epoch_train(self, epoch, optimizer, criterion):
         """Called during train() for running the train phase of one epoch."""
         self.model.train()
         self.training_data_sampler.set_epoch(epoch)
+        if self.compiled_model is not None:
+            model = self.compiled_model
+        else:
+            model = self.model
+        accumulation_steps = self.gradient_accumulation_steps
 
-        num_correct = 0
+        # metrics are accumulated on device, see _reduce_metrics()
+        running_loss = torch.zeros((), dtype=torch.float64, device=self.device)
+        num_correct = torch.zeros((), dtype=torch.int64, device=self.device)
         num_total_images = 0
-        running_loss = 0.0
-
-        for images, targets in tqdm(self.training_data_loader):
-            # PROFILER: record_function will report to the profiler (if enabled)
-            # here a specific wall time for a given block of code
-            with record_function("train.to_device"):
-                images = images.to(
-                    self.device, non_blocking=self.dataloading_config.non_blocking
-                )
-                one_hot_targets = torch.nn.functional.one_hot(
-                    targets.to(
-                        self.device, non_blocking=self.dataloading_config.non_blocking
-                    ),
-                    num_classes=len(self.labels),
-                ).float()
 
-            with record_function("train.forward"):
-                # zero the parameter gradients
-                optimizer.zero_grad()
+        # zero the parameter gradients
+        optimizer.zero_grad()
+
+        batches = self._device_batches(self.training_data_loader)
+        timed_batches = batches
+        if self.phase_counters is not None:
+            # time spent waiting for the data loader and the copy to device
+            timed_batches = self.phase_counters.iterate(batches, "train.to_device")
+        for index, (images, targets) in enumerate(
+            tqdm(timed_batches, total=len(batches))
+        ):
+            # the optimizer steps every accumulation_steps batches, and on the last one
+            optimizer_step = (index + 1) % accumulation_steps == 0 or index + 1 == len(
+                batches
+            )
 
-                outputs = self.model(images)
-                loss = criterion(outputs, one_hot_targets)
-                correct = torch.argmax(outputs, dim=-1) == (targets.to(self.device))
+            # DISTRIBUTED: gradients only need to be all-reduced before an optimizer step
+            if not optimizer_step and isinstance(
+                self.model, torch.nn.parallel.DistributedDataParallel
+            ):
+                sync_context = self.model.no_sync()
+            else:
+                sync_context = contextlib.nullcontext()
+
+            with sync_context:
+                with self._phase("train.forward"), self._autocast():
+                    outputs = model(images)
+                    # NOTE: CrossEntropyLoss takes the class indices directly,
+                    # same loss as with one-hot targets without building them
+                    loss = criterion(outputs, targets)
+                    correct = torch.argmax(outputs, dim=-1) == targets
+
+                    running_loss += loss.detach() * images.size(0)
+                    num_correct += torch.sum(correct)
+                    num_total_images += len(images)
 
-                running_loss += loss.item() * images.size(0)
-                num_correct += torch.sum(correct).item()
-                num_total_images += len(images)
+                with self._phase("train.backward"):
+                    # AMP: the scaler is a no-op unless float16 is used
+                    self.grad_scaler.scale(loss / accumulation_steps).backward()
 
-            # PROFILER: record_function will report to the profiler (if enabled)
-            # here a specific wall time for a given block of code
-            with record_function("train.backward"):
-                loss.backward()
-                optimizer.step()
+            if optimizer_step:
+                with self._phase("train.optimizer_step"):
+                    self.grad_scaler.step(optimizer)
+                    self.grad_scaler.update()
+                    optimizer.zero_grad()
 
-        return running_loss, num_correct, num_total_images
+            # PROFILER: use profiler.step() to mark a step in training
+            # the pytorch profiler will use internally to trigger
+            # saving the traces in different files
+            if self.profiler:
+                self.profiler.step()
+
+        # DISTRIBUTED: each process trained on its own part of the data
+        return self._reduce_metrics(
+            running_loss, num_correct, num_total_images, all_ranks=True
+        )
 
     def train(self, epochs=None):
         """Trains the model.
@@ -371,27 +647,33 @@ class PyTorchDistributedModelTrainingSequence:
             )
             epoch_train_loss = running_loss / num_samples
             epoch_train_acc = num_correct / num_samples
+            # NOTE: samples of all processes, i.e. the throughput of the job
+            epoch_train_samples_per_sec = num_samples / (time.time() - epoch_start)
 
             # report metric values in stdout
             self.logger.info(
                 f"MLFLOW: epoch_train_loss={epoch_train_loss} epoch_train_acc={epoch_train_acc} epoch={epoch}"
             )
+            self.logger.info(
+                f"MLFLOW: epoch_train_samples_per_sec={epoch_train_samples_per_sec} epoch={epoch}"
+            )
 
             # MLFLOW / DISTRIBUTED: report metrics only from main node
             if self.self_is_main_node:
                 mlflow.log_metric("epoch_train_loss", epoch_train_loss, step=epoch)
                 mlflow.log_metric("epoch_train_acc", epoch_train_acc, step=epoch)
+                mlflow.log_metric(
+                    "epoch_train_samples_per_sec",
+                    epoch_train_samples_per_sec,
+                    step=epoch,
+                )
 
             # EVAL: run evaluation on validation set and return metrics
+            eval_start = time.time()
             running_loss, num_correct, num_samples = self._epoch_eval(epoch, criterion)
             epoch_valid_loss = running_loss / num_samples
             epoch_valid_acc = num_correct / num_samples
-
-            # PROFILER: use profiler.step() to mark a step in training
-            # the pytorch profiler will use internally to trigger
-            # saving the traces in different files
-            if self.profiler:
-                self.profiler.step()
+            epoch_valid_samples_per_sec = num_samples / (time.time() - eval_start)
 
             # stop timer
             epoch_train_time = time.time() - epoch_start
@@ -399,6 +681,9 @@ class PyTorchDistributedModelTrainingSequence:
             self.logger.info(
                 f"MLFLOW: epoch_valid_loss={epoch_valid_loss} epoch_valid_acc={epoch_valid_acc} epoch={epoch}"
             )
+            self.logger.info(
+                f"MLFLOW: epoch_valid_samples_per_sec={epoch_valid_samples_per_sec} epoch={epoch}"
+            )
             self.logger.info(
                 f"MLFLOW: epoch_train_time={epoch_train_time} epoch={epoch}"
             )
@@ -407,8 +692,20 @@ class PyTorchDistributedModelTrainingSequence:
             if self.self_is_main_node:
                 mlflow.log_metric("epoch_valid_loss", epoch_valid_loss, step=epoch)
                 mlflow.log_metric("epoch_valid_acc", epoch_valid_acc, step=epoch)
+                mlflow.log_metric(
+                    "epoch_valid_samples_per_sec",
+                    epoch_valid_samples_per_sec,
+                    step=epoch,
+                )
                 mlflow.log_metric("epoch_train_time", epoch_train_time, step=epoch)
 
+            # PROFILER: report the time of each phase of the training loop
+            if self.phase_counters is not None:
+                phase_metrics = self.phase_counters.pop_metrics()
+                self.logger.info(f"MLFLOW: {phase_metrics} epoch={epoch}")
+                if self.self_is_main_node:
+                    mlflow.log_metrics(phase_metrics, step=epoch)
+
     #################
     ### MODEL I/O ###
     #################
@@ -513,6 +810,20 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         default=False,
         help="Use non-blocking transfer to device (default: False)",
     )
+    group.add_argument(
+        "--prefetch_to_device",
+        type=strtobool,
+        required=False,
+        default=True,
+        help="Copy the next batch to the gpu on a separate cuda stream while the current one is processed (default: True)",
+    )
+    group.add_argument(
+        "--shard_validation",
+        type=strtobool,
+        required=False,
+        default=True,
+        help="Split the validation set between processes instead of evaluating all of it in each (default: True)",
+    )
 
     group = parser.add_argument_group(f"Model/Training Parameters")
     group.add_argument(
@@ -534,7 +845,7 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         "--distributed_backend",
         type=str,
         required=False,
-        choices=["nccl", "mpi"],
+        choices=["nccl", "gloo", "mpi"],
         default="nccl",
         help="Which distributed backend to use.",
     )
@@ -569,6 +880,50 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         default=0.01,
         help="Momentum of optimizer",
     )
+    group.add_argument(
+        "--gradient_accumulation_steps",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of batches to accumulate gradients over before each optimizer step (default: 1)",
+    )
+
+    group = parser.add_argument_group(f"Training Performance Parameters")
+    group.add_argument(
+        "--enable_amp",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Use automatic mixed precision, float16 with loss scaling on gpu, bfloat16 on cpu (default: False)",
+    )
+    group.add_argument(
+        "--channels_last",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Use channels_last memory format for model and images (default: False)",
+    )
+    group.add_argument(
+        "--enable_compile",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Compile the model with torch.compile, requires torch>=2.0 (default: False)",
+    )
+    group.add_argument(
+        "--ddp_gradient_as_bucket_view",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="DistributedDataParallel gradient_as_bucket_view (default: False)",
+    )
+    group.add_argument(
+        "--ddp_static_graph",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="DistributedDataParallel static_graph, if the model uses the same parameters in every step (default: False)",
+    )
 
     group = parser.add_argument_group(f"Monitoring/Profiling Parameters")
     group.add_argument(
@@ -578,6 +933,69 @@ def build_arguments_parser(parser: argparse.ArgumentParser = None):
         default=False,
         help="Enable pytorch profiler.",
     )
+    group.add_argument(
+        "--profiling_counters_only",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Instead of a profiler trace, only report the time of each phase of the training loop as mlflow metrics (default: False)",
+    )
+    group.add_argument(
+        "--profiling_wait",
+        type=int,
+        required=False,
+        default=1,
+        help="Training steps skipped before each profiling window (default: 1)",
+    )
+    group.add_argument(
+        "--profiling_warmup",
+        type=int,
+        required=False,
+        default=1,
+        help="Training steps profiled but discarded at the start of each profiling window (default: 1)",
+    )
+    group.add_argument(
+        "--profiling_active",
+        type=int,
+        required=False,
+        default=3,
+        help="Training steps recorded in each profiling window (default: 3)",
+    )
+    group.add_argument(
+        "--profiling_repeat",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of profiling windows, 0 to profile until the end of training (default: 1)",
+    )
+    group.add_argument(
+        "--profiling_export_markdown",
+        type=strtobool,
+        required=False,
+        default=True,
+        help="Export a table of operators in markdown (default: True)",
+    )
+    group.add_argument(
+        "--profiling_export_stacks",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Export stacks as text, records the python stack of each operator (default: False)",
+    )
+    group.add_argument(
+        "--profiling_export_tensorboard",
+        type=strtobool,
+        required=False,
+        default=True,
+        help="Export a trace for the tensorboard profiler plugin (default: True)",
+    )
+    group.add_argument(
+        "--profiling_memory",
+        type=strtobool,
+        required=False,
+        default=False,
+        help="Record memory allocations in the profiler (default: False)",
+    )
 
     return parser
 
@@ -613,10 +1031,21 @@ def run(args):
     # PROFILER: here we use a helper class to enable profiling
     # see profiling.py for the implementation details
     training_profiler = PyTorchProfilerHandler(
-        enabled=bool(args.enable_profiling), rank=training_handler.world_rank
+        enabled=bool(args.enable_profiling),
+        rank=training_handler.world_rank,
+        counters_only=bool(args.profiling_counters_only),
+        wait=args.profiling_wait,
+        warmup=args.profiling_warmup,
+        active=args.profiling_active,
+        repeat=args.profiling_repeat,
+        export_markdown=bool(args.profiling_export_markdown),
+        export_stacks=bool(args.profiling_export_stacks),
+        export_tensorboard=bool(args.profiling_export_tensorboard),
+        profile_memory=bool(args.profiling_memory),
     )
     # PROFILER: set profiler in trainer to call profiler.step() during training
     training_handler.profiler = training_profiler.start_profiler()
+    training_handler.phase_counters = training_profiler.phase_counters
 
     # creates data loaders from datasets for distributed training
     training_handler.setup_datasets(train_dataset, valid_dataset, labels)
@@ -0,0 +1,104 @@
+"""bench_onnxruntimetriton_batching.py
+
+Load generator for onnxruntimetriton.InferenceSession against the local
+stub server. Each client thread calls run() in a closed loop; throughput
+and latency percentiles are reported per concurrency level, with and
+without client-side dynamic batching.
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from onnxruntimetriton import InferenceSession
+from stub_triton_server import MODEL_NAME, start_stub_server
+
+
+def load(
+    url,
+    concurrency,
+    duration,
+    max_batch_size,
+    max_queue_delay,
+    shape,
+    max_inflight_batches=2,
+):
+    shared = None
+    if max_batch_size > 1:
+        shared = InferenceSession(
+            MODEL_NAME,
+            url=url,
+            max_batch_size=max_batch_size,
+            max_queue_delay_microseconds=max_queue_delay,
+            max_inflight_batches=max_inflight_batches,
+        )
+    latencies = [[] for _ in range(concurrency)]
+    stop = time.perf_counter() + duration
+
+    def client(index):
+        # Without batching each thread needs its own (gevent based) client
+        session = shared or InferenceSession(MODEL_NAME, url=url)
+        data = np.random.rand(*shape).astype(np.float32)
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            session.run(["OUTPUT0"], {"INPUT0": data})
+            latencies[index].append(time.perf_counter() - start)
+        if shared is None:
+            session.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if shared is not None:
+        shared.close()
+
+    all_latencies = np.concatenate([np.asarray(l) for l in latencies]) * 1e3
+    return (
+        len(all_latencies) / duration,
+        np.percentile(all_latencies, 50),
+        np.percentile(all_latencies, 99),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dynamic batching.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--max_batch_size", type=int, default=32)
+    parser.add_argument("--max_queue_delay_microseconds", type=int, default=500)
+    parser.add_argument("--max_inflight_batches", type=int, default=2)
+    parser.add_argument(
+        "--delay", type=float, default=0.005, help="simulated compute per batch of 1"
+    )
+    parser.add_argument("--shape", type=int, nargs="+", default=[3, 64, 64])
+    args = parser.parse_args()
+
+    server = start_stub_server(shape=[-1] + args.shape, delay=args.delay)
+    print(f"{'mode':10s} {'clients':>8s} {'req/s':>10s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for concurrency in args.concurrency:
+        for mode, max_batch_size, max_inflight_batches in (
+            ("unbatched", 0, 0),
+            ("batched x1", args.max_batch_size, 1),
+            (
+                f"batched x{args.max_inflight_batches}",
+                args.max_batch_size,
+                args.max_inflight_batches,
+            ),
+        ):
+            throughput, p50, p99 = load(
+                server.url,
+                concurrency,
+                args.duration,
+                max_batch_size,
+                args.max_queue_delay_microseconds,
+                args.shape,
+                max_inflight_batches,
+            )
+            print(
+                f"{mode:10s} {concurrency:8d} {throughput:10.1f} {p50:8.2f} {p99:8.2f}"
+            )
+    server.shutdown()
@@ -0,0 +1,68 @@
+"""bench_preprocess.py
+
+Compares images/sec of the per-image densenet preprocess function with
+preprocess_batch, which decodes into one preallocated NCHW buffer using a
+thread pool, on synthetic JPEG images.
+"""
+
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from densenet_utils import preprocess, preprocess_batch
+
+
+def make_jpegs(count, size):
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def per_image(images, scaling):
+    return np.stack(
+        [preprocess(Image.open(io.BytesIO(img)), scaling) for img in images]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing.")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--size", type=int, nargs=2, default=[640, 480])
+    parser.add_argument("--scaling", type=str, default="INCEPTION")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = make_jpegs(args.images, args.size)
+    reference = per_image(images, args.scaling)
+
+    def report(label, fn, cores):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            fn()
+        rate = args.images * args.repeat / (time.perf_counter() - start)
+        print(f"{label:32s} {rate:8.1f} images/s {rate / cores:8.1f} images/s/core")
+
+    report(
+        "preprocess, one image at a time", lambda: per_image(images, args.scaling), 1
+    )
+    out = np.empty_like(reference)
+    for threads in sorted(set(args.threads)):
+        batch = preprocess_batch(images, args.scaling, out=out, num_threads=threads)
+        assert np.allclose(batch, reference, atol=1e-5)
+        report(
+            f"preprocess_batch, {threads} threads",
+            lambda: preprocess_batch(
+                images, args.scaling, out=out, num_threads=threads
+            ),
+            threads,
+        )
@@ -0,0 +1,49 @@
+"""bench_triton_infer.py
+
+Measures requests/sec of utils.triton_infer against the local stub
+server, with and without the model metadata cache and connection pool.
+"""
+
+import argparse
+import time
+
+import gevent.pool
+import numpy as np
+
+import utils
+from stub_triton_server import MODEL_NAME, start_stub_server
+
+
+def run(url, requests, concurrency, connection_count, metadata_ttl):
+    utils.triton_init(url, connection_count=connection_count, metadata_ttl=metadata_ttl)
+    data = np.random.rand(1, 4).astype(np.float32)
+    pool = gevent.pool.Pool(concurrency)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        pool.spawn(utils.triton_infer, {"INPUT0": data}, MODEL_NAME, binary_data=True)
+    pool.join(raise_error=True)
+    elapsed = time.perf_counter() - start
+
+    utils.triton_client.close()
+    return requests / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark triton_infer.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--delay", type=float, default=0.001, help="simulated server compute (s)"
+    )
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay)
+    before = run(server.url, args.requests, args.concurrency, 1, 0)
+    after = run(server.url, args.requests, args.concurrency, args.concurrency, 300.0)
+    print(f"uncached, 1 connection:  {before:8.1f} req/s")
+    print(
+        f"cached, {args.concurrency} connections: {after:8.1f} req/s "
+        f"({after / before:.2f}x)"
+    )
+    server.shutdown()
@@ -0,0 +1,145 @@
+"""bench_tritonhttpclient_aio.py
+
+Checks tritonhttpclient_aio.InferenceServerClient against the aiohttp
+stub of the KServe v2 protocol, then compares it with calling the gevent
+based client from a coroutine, which blocks the event loop for the
+duration of every request. Both are run against the threaded stub server
+and report throughput and the worst event loop stall seen by a 1 ms
+heartbeat coroutine.
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from aiohttp import web
+
+import tritonhttpclient
+import tritonhttpclient_aio
+from stub_triton_server import MODEL_NAME, make_aiohttp_stub_app, start_stub_server
+
+
+async def check_api(client):
+    assert await client.is_server_live()
+    assert await client.is_server_ready()
+    assert await client.is_model_ready(MODEL_NAME)
+    metadata = await client.get_model_metadata(MODEL_NAME)
+    assert metadata["inputs"][0]["name"] == "INPUT0"
+    config = await client.get_model_config(MODEL_NAME)
+    assert config["name"] == MODEL_NAME
+    await client.load_model(MODEL_NAME)
+    await client.unload_model(MODEL_NAME)
+
+    # the larger input is sent as a list of buffers instead of one body
+    for shape in ((2, 4), (2, 3, 64, 64)):
+        data = np.random.rand(*shape).astype(np.float32)
+        for binary_data in (True, False):
+            infer_input = tritonhttpclient_aio.InferInput("INPUT0", data.shape, "FP32")
+            infer_input.set_data_from_numpy(data, binary_data=binary_data)
+            output = tritonhttpclient_aio.InferRequestedOutput(
+                "OUTPUT0", binary_data=binary_data
+            )
+            result = await client.infer(MODEL_NAME, [infer_input], outputs=[output])
+            assert np.allclose(result.as_numpy("OUTPUT0"), data)
+
+    try:
+        await client.get_model_metadata("missing")
+    except tritonhttpclient_aio.InferenceServerException:
+        pass
+    else:
+        raise AssertionError("expected an InferenceServerException")
+
+
+def make_inputs(shape):
+    data = np.random.rand(*shape).astype(np.float32)
+    infer_input = tritonhttpclient.InferInput("INPUT0", data.shape, "FP32")
+    infer_input.set_data_from_numpy(data)
+    return [infer_input]
+
+
+async def heartbeat(stalls, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+
+async def measured(fn, *args):
+    """Runs fn(*args) alongside the heartbeat and returns its result and
+    the worst event loop stall in ms."""
+    stalls, stop = [], asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(stalls, stop))
+    result = await fn(*args)
+    stop.set()
+    await beat
+    return result, max(stalls) * 1e3
+
+
+async def run_aio(url, requests, concurrency, shape):
+    inputs = make_inputs(shape)
+    async with tritonhttpclient_aio.InferenceServerClient(
+        url, connection_count=concurrency
+    ) as client:
+
+        async def one():
+            await client.infer(MODEL_NAME, inputs)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return requests / (time.perf_counter() - start)
+
+
+async def run_gevent(url, requests, concurrency, shape):
+    inputs = make_inputs(shape)
+    client = tritonhttpclient.InferenceServerClient(url, connection_count=concurrency)
+
+    async def one():
+        # The gevent client cannot yield to the event loop
+        client.infer(MODEL_NAME, inputs)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    client.close()
+    return requests / elapsed
+
+
+async def main(args):
+    app = make_aiohttp_stub_app(shape=[-1] + args.shape[1:], delay=args.delay)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = "127.0.0.1:{}".format(site._server.sockets[0].getsockname()[1])
+
+    async with tritonhttpclient_aio.InferenceServerClient(url) as client:
+        await check_api(client)
+    print("API check against aiohttp stub: ok")
+
+    await runner.cleanup()
+
+    # The gevent client issues blocking calls, so the server must not share
+    # the benchmark's event loop; serve it from a separate thread instead.
+    server = start_stub_server(shape=[-1] + args.shape[1:], delay=args.delay)
+    for concurrency in args.concurrency:
+        for label, fn in (("asyncio", run_aio), ("gevent", run_gevent)):
+            throughput, stall = await measured(
+                fn, server.url, args.requests, concurrency, args.shape
+            )
+            print(
+                f"{label:8s} concurrency {concurrency:3d}: {throughput:8.1f} req/s, "
+                f"worst event loop stall {stall:7.2f} ms"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the asyncio client.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--shape", type=int, nargs="+", default=[1, 3, 64, 64])
+    parser.add_argument(
+        "--delay", type=float, default=0.005, help="simulated server compute (s)"
+    )
+    asyncio.run(main(parser.parse_args()))
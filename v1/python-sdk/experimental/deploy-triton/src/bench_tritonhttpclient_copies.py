@@ -0,0 +1,140 @@
+"""bench_tritonhttpclient_copies.py
+
+Measures how many bytes are allocated (i.e. copied) per request when
+building the inference request body and decoding the response, comparing
+the original concatenate-and-pack approach with the scatter/gather body
+and zero-copy as_numpy in tritonhttpclient. Finally it round-trips a
+tensor through the stub server to check the results match.
+"""
+
+import argparse
+import struct
+import time
+import tracemalloc
+
+import numpy as np
+import rapidjson as json
+
+import tritonhttpclient
+from stub_triton_server import MODEL_NAME, start_stub_server
+
+
+class _FakeResponse:
+    """Mimics the parts of HTTPSocketPoolResponse used by InferResult."""
+
+    def __init__(self, body, header_length):
+        self._body = body
+        self._offset = 0
+        self._header_length = header_length
+
+    def get(self, name):
+        if name == "Inference-Header-Content-Length":
+            return self._header_length
+        return None
+
+    def read(self, length=None):
+        end = len(self._body) if length is None else self._offset + length
+        data = self._body[self._offset : end]
+        self._offset = end
+        return data
+
+
+def legacy_request_body(inputs):
+    """The request assembly used before the scatter/gather body."""
+    request_body = json.dumps({"inputs": [i._get_tensor() for i in inputs]})
+    binary_data = None
+    for input_tensor in inputs:
+        raw_data = bytes(input_tensor._get_binary_data())
+        if binary_data is not None:
+            binary_data += raw_data
+        else:
+            binary_data = raw_data
+    return struct.pack(
+        "{}s{}s".format(len(request_body), len(binary_data)),
+        request_body.encode(),
+        binary_data,
+    )
+
+
+def legacy_as_numpy(result, name):
+    """The output decoding used before as_numpy returned views."""
+    output = result.get_output(name)
+    start = result._output_name_to_buffer_map[name]
+    size = output["parameters"]["binary_data_size"]
+    buffer = bytes(result._buffer)
+    np_array = np.frombuffer(buffer[start : start + size], dtype=np.float32)
+    return np.resize(np_array, output["shape"])
+
+
+def measure(fn, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark request copies.")
+    parser.add_argument("--shape", type=int, nargs="+", default=[8, 3, 640, 640])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    data = np.random.rand(*args.shape).astype(np.float32)
+    mb = data.nbytes / 2**20
+    print(f"input tensor: {args.shape} float32, {mb:.1f} MiB")
+
+    inputs = [tritonhttpclient.InferInput("INPUT0", data.shape, "FP32")]
+    inputs[0].set_data_from_numpy(data)
+
+    header = json.dumps(
+        {
+            "outputs": [
+                {
+                    "name": "OUTPUT0",
+                    "datatype": "FP32",
+                    "shape": list(data.shape),
+                    "parameters": {"binary_data_size": data.nbytes},
+                }
+            ]
+        }
+    ).encode()
+    response_body = header + data.tobytes()
+
+    def new_body():
+        body, _ = tritonhttpclient._get_inference_request(
+            inputs, "", None, 0, False, False, 0, None
+        )
+        for chunk in body:
+            pass
+
+    def decode(as_numpy):
+        def fn():
+            response = _FakeResponse(response_body, len(header))
+            result = tritonhttpclient.InferResult(response, False)
+            as_numpy(result, "OUTPUT0")
+
+        return fn
+
+    for label, fn in (
+        ("request, concatenate + struct.pack", lambda: legacy_request_body(inputs)),
+        ("request, scatter/gather", new_body),
+        ("response, np.resize", decode(legacy_as_numpy)),
+        ("response, view", decode(lambda r, n: r.as_numpy(n))),
+    ):
+        peak, elapsed = measure(fn, args.repeat)
+        print(
+            f"{label:36s} {peak / 2**20:8.1f} MiB copied/request "
+            f"{elapsed * 1e3:8.2f} ms/request"
+        )
+
+    server = start_stub_server(shape=[-1] + args.shape[1:])
+    with tritonhttpclient.InferenceServerClient(server.url) as client:
+        result = client.infer(MODEL_NAME, inputs)
+        assert np.array_equal(result.as_numpy("OUTPUT0"), data)
+    print("round trip through stub server: ok")
+    server.shutdown()
@@ -14,6 +14,17 @@ from .utils import get_model_info, parse_model_http, triton_init, triton_infer
 from tritonclientutils import triton_to_np_dtype
 
 
+_punkt_downloaded = False
+
+
+def _ensure_punkt():
+    """Downloads the punkt tokenizer models once per process."""
+    global _punkt_downloaded
+    if not _punkt_downloaded:
+        nltk.download("punkt")
+        _punkt_downloaded = True
+
+
 def preprocess(text, dtype):
     """Tokenizes text for use in the bidirectional attention flow model
 
@@ -33,15 +44,44 @@ def preprocess(text, dtype):
 
     From: https://github.com/onnx/models/tree/master/text/machine_comprehension/bidirectional_attention_flow  # noqa
     """
-    nltk.download("punkt")
-    tokens = word_tokenize(text)
+    return preprocess_batch([text], dtype)[0]
+
+
+def preprocess_batch(texts, dtype):
+    """Tokenizes several texts for use in the bidirectional attention flow
+    model. The words and chars of all texts are built as two arrays in one
+    go and each text gets views into them.
+
+    Parameters
+    ---------
+    texts : list
+        The texts to be tokenized
+
+    dtype : numpy datatype
+        Datatype of the resulting arrays
+
+    Returns
+    ---------
+    list
+        One (words, chars) tuple per text, shaped (seq, 1) and
+        (seq, 1, 1, 16) as returned by preprocess.
+    """
+    _ensure_punkt()
+    tokens_per_text = [word_tokenize(text) for text in texts]
+    tokens = [token for text_tokens in tokens_per_text for token in text_tokens]
+
     # split into lower-case word tokens, in numpy array with shape of (seq, 1)
     words = np.array([w.lower() for w in tokens], dtype=dtype).reshape(-1, 1)
-    # split words into chars, in numpy array with shape of (seq, 1, 1, 16)
-    chars = [[c for c in t][:16] for t in tokens]
-    chars = [cs + [""] * (16 - len(cs)) for cs in chars]
-    chars = np.array(chars, dtype=dtype).reshape(-1, 1, 1, 16)
-    return words, chars
+    # split words into chars, in numpy array with shape of (seq, 1, 1, 16); the
+    # fixed width U16 array truncates each token to 16 chars and pads with ""
+    chars = np.array(tokens, dtype="U16").view("U1").reshape(-1, 16)
+    chars = chars.astype(dtype).reshape(-1, 1, 1, 16)
+
+    offsets = np.cumsum([0] + [len(text_tokens) for text_tokens in tokens_per_text])
+    return [
+        (words[start:end], chars[start:end])
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
 
 
 def postprocess(context_words, answer):
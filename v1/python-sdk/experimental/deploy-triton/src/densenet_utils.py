@@ -0,0 +1,130 @@
+"""densenet_utils.py
+
+Image preprocessing for the DenseNet ONNX model from the ONNX model zoo,
+for a single image or for a batch decoded straight into one NCHW buffer.
+"""
+
+import io
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from PIL import Image
+
+SCALING_MEANS = {1: (128,), 3: (123, 117, 104)}
+
+
+def preprocess(img, scaling, dtype=np.float32):
+    """Pre-process an image to meet the size, type and format
+    requirements specified by the parameters.
+    """
+    c = 3
+    h = 224
+    w = 224
+    format = "FORMAT_NCHW"
+
+    if c == 1:
+        sample_img = img.convert("L")
+    else:
+        sample_img = img.convert("RGB")
+
+    resized_img = sample_img.resize((w, h), Image.BILINEAR)
+    resized = np.array(resized_img)
+    if resized.ndim == 2:
+        resized = resized[:, :, np.newaxis]
+
+    npdtype = np.dtype(dtype)
+    typed = resized.astype(npdtype)
+
+    if scaling == "INCEPTION":
+        scaled = (typed / 128) - 1
+    elif scaling == "VGG":
+        scaled = typed - np.asarray(SCALING_MEANS[c], dtype=npdtype)
+    else:
+        scaled = typed
+
+    # Swap to CHW if necessary
+    if format == "FORMAT_NCHW":
+        ordered = np.transpose(scaled, (2, 0, 1))
+    else:
+        ordered = scaled
+
+    # Channels are in RGB order. Currently model configuration data
+    # doesn't provide any information as to other channel orderings
+    # (like BGR) so we just assume RGB.
+    return ordered
+
+
+def preprocess_batch(
+    images, scaling, dtype=np.float32, out=None, num_threads=1, c=3, h=224, w=224
+):
+    """Pre-process a batch of images into a single NCHW array.
+
+    Each image is decoded, converted and resized, then written straight
+    into its slot of the output array; scaling is applied to the whole
+    batch in place afterwards, so no per-image float temporaries are made.
+
+    Parameters
+    ----------
+    images : list
+        PIL images or encoded image bytes.
+
+    scaling : str
+        "INCEPTION", "VGG" or None, as for preprocess.
+
+    dtype : numpy datatype
+        Datatype of the result, defaults to float32. Use uint8 together
+        with scaling=None to get the raw resized pixels.
+
+    out : np.ndarray
+        Optional preallocated (N, c, h, w) array to write into, e.g. to
+        reuse one buffer across requests. Defaults to a new array.
+
+    num_threads : int
+        Number of threads decoding and resizing images. PIL releases the
+        GIL while doing so, so this scales with the number of cores.
+        Defaults to 1.
+
+    Returns
+    -------
+    np.ndarray
+        The (N, c, h, w) batch.
+    """
+    npdtype = np.dtype(dtype)
+    if scaling is not None and npdtype.kind != "f":
+        raise ValueError("scaling {} requires a float dtype".format(scaling))
+
+    shape = (len(images), c, h, w)
+    if out is None:
+        out = np.empty(shape, dtype=npdtype)
+    elif out.shape != shape or out.dtype != npdtype:
+        raise ValueError(
+            "out must have shape {} and dtype {}, got {} and {}".format(
+                shape, npdtype, out.shape, out.dtype
+            )
+        )
+
+    def decode(i):
+        img = images[i]
+        if isinstance(img, (bytes, bytearray, memoryview)):
+            img = Image.open(io.BytesIO(img))
+        img = img.convert("L" if c == 1 else "RGB")
+        resized = np.asarray(img.resize((w, h), Image.BILINEAR))
+        if resized.ndim == 2:
+            resized = resized[:, :, np.newaxis]
+        # HWC -> CHW and the cast to dtype happen in this single copy
+        out[i] = resized.transpose(2, 0, 1)
+
+    if num_threads > 1 and len(images) > 1:
+        with ThreadPool(min(num_threads, len(images))) as pool:
+            pool.map(decode, range(len(images)))
+    else:
+        for i in range(len(images)):
+            decode(i)
+
+    if scaling == "INCEPTION":
+        out /= 128
+        out -= 1
+    elif scaling == "VGG":
+        out -= np.asarray(SCALING_MEANS[c], dtype=npdtype).reshape(1, c, 1, 1)
+    return out
@@ -6,9 +6,17 @@ session object.
 
 """
 
+import collections
+import threading
+import time
+
+from concurrent.futures import Future
+
 import tritonclient.http as tritonhttpclient
 import numpy as np
 
+from tritonclient.utils import np_to_triton_dtype, raise_error
+
 
 class NodeArg:
     def __init__(self, name, shape):
@@ -16,9 +24,185 @@ class NodeArg:
         self.shape = shape
 
 
+_BatchRequest = collections.namedtuple(
+    "_BatchRequest", ["key", "output_names", "input_feed", "future"]
+)
+
+
+class _DynamicBatcher:
+    """Coalesces concurrent InferenceSession.run() calls into batched
+    Triton requests.
+
+    max_inflight_batches background threads each own a Triton client. One
+    of them at a time collects a batch: it waits for the first pending
+    request, then keeps collecting requests with the same inputs, input
+    shapes and outputs until either max_batch_size requests are queued or
+    max_queue_delay_microseconds have passed since the first one arrived.
+    The inputs are stacked along a new batch dimension and sent as one
+    request, while the next thread collects the next batch, and each
+    caller receives its slice of the outputs.
+    """
+
+    def __init__(
+        self,
+        session,
+        url,
+        max_batch_size,
+        max_queue_delay_microseconds,
+        max_inflight_batches=2,
+    ):
+        self.session = session
+        self.url = url
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay_microseconds / 1e6
+        self.pending = collections.deque()
+        self.enqueue_times = collections.deque()
+        self.condition = threading.Condition()
+        # held by the thread collecting the next batch
+        self.collecting = threading.Lock()
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self._loop, daemon=True)
+            for _ in range(max(1, max_inflight_batches))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _check(self, input_feed):
+        # Raised to the caller only: an input that could not be sent must
+        # not fail the other requests of its batch.
+        for key, val in input_feed.items():
+            if key not in self.session.dtype_mapping:
+                raise_error("unknown input '{}'".format(key))
+            if not isinstance(val, np.ndarray):
+                raise_error("input '{}' must be a numpy array".format(key))
+            dtype = np_to_triton_dtype(val.dtype)
+            if dtype != self.session.dtype_mapping[key]:
+                raise_error(
+                    "got datatype {} for input '{}', expected {}".format(
+                        dtype, key, self.session.dtype_mapping[key]
+                    )
+                )
+
+    def submit(self, output_names, input_feed):
+        self._check(input_feed)
+        future = Future()
+        # requests with other input shapes are batched separately
+        key = (
+            tuple(output_names),
+            tuple(sorted((name, val.shape) for name, val in input_feed.items())),
+        )
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("InferenceSession has been closed")
+            self.pending.append(_BatchRequest(key, output_names, input_feed, future))
+            self.enqueue_times.append(time.monotonic())
+            self.condition.notify()
+        return future.result()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _next_batch(self):
+        with self.collecting, self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if not self.pending:
+                return None
+
+            deadline = self.enqueue_times[0] + self.max_queue_delay
+            while len(self.pending) < self.max_batch_size and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            # Only requests asking for the same tensors can share a batch,
+            # the others stay queued in arrival order for the next one.
+            key = self.pending[0].key
+            batch, rest, rest_times = [], collections.deque(), collections.deque()
+            while self.pending:
+                request = self.pending.popleft()
+                enqueue_time = self.enqueue_times.popleft()
+                if request.key == key and len(batch) < self.max_batch_size:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+                    rest_times.append(enqueue_time)
+            self.pending, self.enqueue_times = rest, rest_times
+            return batch
+
+    def _loop(self):
+        # the gevent based client cannot be shared between threads
+        client = tritonhttpclient.InferenceServerClient(self.url)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            try:
+                results = self._infer(client, batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+        client.close()
+
+    def _infer(self, client, batch):
+        session = self.session
+        output_names = batch[0].output_names
+
+        inputs = []
+        for key in batch[0].input_feed:
+            val = np.stack([request.input_feed[key] for request in batch])
+            input = tritonhttpclient.InferInput(
+                key, val.shape, session.dtype_mapping[key]
+            )
+            input.set_data_from_numpy(val)
+            inputs.append(input)
+
+        outputs = [
+            tritonhttpclient.InferRequestedOutput(output_name)
+            for output_name in output_names
+        ]
+
+        session.request_count += 1
+        res = client.infer(
+            session.model_name,
+            inputs,
+            request_id=str(session.request_count),
+            outputs=outputs,
+        )
+        batched = [res.as_numpy(output_name) for output_name in output_names]
+        return [[output[i : i + 1] for output in batched] for i in range(len(batch))]
+
+
 class InferenceSession:
-    def __init__(self, path_or_bytes, sess_options=None, providers=[]):
-        self.client = tritonhttpclient.InferenceServerClient("localhost:8000")
+    """Drop-in replacement for onnxruntime.InferenceSession backed by Triton.
+
+    When max_batch_size is greater than 1, concurrent calls to run() from
+    different threads are coalesced into batched requests of up to
+    max_batch_size items, waiting at most max_queue_delay_microseconds
+    for a batch to fill, with up to max_inflight_batches batches sent at
+    once. The Triton model must then accept a batch dimension of that size.
+    """
+
+    def __init__(
+        self,
+        path_or_bytes,
+        sess_options=None,
+        providers=[],
+        url="localhost:8000",
+        max_batch_size=0,
+        max_queue_delay_microseconds=100,
+        max_inflight_batches=2,
+    ):
+        self.client = tritonhttpclient.InferenceServerClient(url)
         model_metadata = self.client.get_model_metadata(model_name=path_or_bytes)
 
         self.request_count = 0
@@ -37,13 +221,32 @@ class InferenceSession:
 
         self.triton_enabled = True
 
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = _DynamicBatcher(
+                self,
+                url,
+                max_batch_size,
+                max_queue_delay_microseconds,
+                max_inflight_batches,
+            )
+
     def get_inputs(self):
         return self.inputs
 
     def get_outputs(self):
         return self.outputs
 
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+            self.batcher = None
+        self.client.close()
+
     def run(self, output_names, input_feed, run_options=None):
+        if self.batcher is not None:
+            return self.batcher.submit(output_names, input_feed)
+
         inputs = []
         for key, val in input_feed.items():
             val = np.expand_dims(val, axis=0)
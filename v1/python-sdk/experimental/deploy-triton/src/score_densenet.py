@@ -1,57 +1,17 @@
 import io
+import asyncio
 import numpy as np
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from azureml.core import Model
 from azureml.contrib.services.aml_request import rawhttp
 from azureml.contrib.services.aml_response import AMLResponse
 from PIL import Image
+from densenet_utils import preprocess
 from onnxruntimetriton import InferenceSession
-
-
-def preprocess(img, scaling):  # , dtype):
-    """Pre-process an image to meet the size, type and format
-    requirements specified by the parameters.
-    """
-    c = 3
-    h = 224
-    w = 224
-    format = "FORMAT_NCHW"
-
-    if c == 1:
-        sample_img = img.convert("L")
-    else:
-        sample_img = img.convert("RGB")
-
-    resized_img = sample_img.resize((w, h), Image.BILINEAR)
-    resized = np.array(resized_img)
-    if resized.ndim == 2:
-        resized = resized[:, :, np.newaxis]
-
-    # npdtype = triton_to_np_dtype(dtype)
-    typed = resized.astype(np.float32)
-    # typed = resized
-
-    if scaling == "INCEPTION":
-        scaled = (typed / 128) - 1
-    elif scaling == "VGG":
-        if c == 1:
-            scaled = typed - np.asarray((128,), dtype=npdtype)
-        else:
-            scaled = typed - np.asarray((123, 117, 104), dtype=npdtype)
-    else:
-        scaled = typed
-
-    # Swap to CHW if necessary
-    if format == "FORMAT_NCHW":
-        ordered = np.transpose(scaled, (2, 0, 1))
-    else:
-        ordered = scaled
-
-    # Channels are in RGB order. Currently model configuration data
-    # doesn't provide any information as to other channel orderings
-    # (like BGR) so we just assume RGB.
-    return ordered
+import tritonhttpclient_aio
 
 
 def postprocess(output_array):
@@ -63,9 +23,44 @@ def postprocess(output_array):
     return f"{max_label} : {final_label}"
 
 
+async def infer(output_names, input_feed):
+    """InferenceSession.run() on the asyncio client, which does not block
+    the event loop while waiting for Triton."""
+    inputs = []
+    for key, val in input_feed.items():
+        val = np.expand_dims(val, axis=0)
+        input = tritonhttpclient_aio.InferInput(
+            key, val.shape, session.dtype_mapping[key]
+        )
+        input.set_data_from_numpy(val)
+        inputs.append(input)
+
+    outputs = [
+        tritonhttpclient_aio.InferRequestedOutput(output_name)
+        for output_name in output_names
+    ]
+
+    res = await client.infer(session.model_name, inputs, outputs=outputs)
+    return [res.as_numpy(output_name) for output_name in output_names]
+
+
 def init():
-    global session, label_dict
-    session = InferenceSession(path_or_bytes="densenet_onnx")
+    global session, client, executor, label_dict
+    # Set TRITON_MAX_BATCH_SIZE to coalesce concurrent requests into batches
+    max_batch_size = int(os.environ.get("TRITON_MAX_BATCH_SIZE", 0))
+    max_inflight_batches = int(os.environ.get("TRITON_MAX_INFLIGHT_BATCHES", 2))
+    session = InferenceSession(
+        path_or_bytes="densenet_onnx",
+        max_batch_size=max_batch_size,
+        max_queue_delay_microseconds=int(
+            os.environ.get("TRITON_MAX_QUEUE_DELAY_MICROSECONDS", 100)
+        ),
+        max_inflight_batches=max_inflight_batches,
+    )
+    # session.run() blocks until its batch returns, so batched requests wait
+    # in these threads and enough of them are needed to fill every batch.
+    executor = ThreadPoolExecutor(max(1, max_batch_size * max_inflight_batches))
+    client = tritonhttpclient_aio.InferenceServerClient("localhost:8000")
 
     model_dir = os.path.join(os.environ["AZUREML_MODEL_DIR"], "models")
     folder_path = os.path.join(model_dir, "triton", "densenet_onnx")
@@ -98,7 +93,12 @@ async def run(request):
         img = Image.open(io.BytesIO(reqBody))
         image_data = preprocess(img, scaling="INCEPTION")
 
-        res = session.run(outputs, {input_name: image_data})
+        if session.batcher is not None:
+            res = await asyncio.get_running_loop().run_in_executor(
+                executor, session.run, outputs, {input_name: image_data}
+            )
+        else:
+            res = await infer(outputs, {input_name: image_data})
 
         result = postprocess(output_array=res)
 
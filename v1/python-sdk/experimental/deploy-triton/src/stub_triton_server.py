@@ -0,0 +1,231 @@
+"""stub_triton_server.py
+
+A minimal, in-process stand-in for the Triton KServe v2 HTTP endpoints,
+used by the benchmark scripts in this directory. It hosts a single
+"identity" model that echoes INPUT0 back as OUTPUT0 after an optional
+artificial compute delay. start_stub_server runs it on a thread with
+http.server; make_aiohttp_stub_app builds the same endpoints as an
+aiohttp application.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import types
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_NAME = "identity"
+
+
+def _model_metadata(shape):
+    return {
+        "name": MODEL_NAME,
+        "versions": ["1"],
+        "platform": "stub",
+        "inputs": [{"name": "INPUT0", "datatype": "FP32", "shape": shape}],
+        "outputs": [{"name": "OUTPUT0", "datatype": "FP32", "shape": shape}],
+    }
+
+
+def _model_config(shape, max_batch_size):
+    return {
+        "name": MODEL_NAME,
+        "max_batch_size": max_batch_size,
+        "input": [{"name": "INPUT0", "data_type": "TYPE_FP32", "dims": shape[1:]}],
+        "output": [{"name": "OUTPUT0", "data_type": "TYPE_FP32", "dims": shape[1:]}],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body, status=200, headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.metadata_requests += 1
+        base = "/v2/models/" + MODEL_NAME
+        path = self.path.split("?")[0]
+        if path in ("/v2/health/live", "/v2/health/ready", base + "/ready"):
+            self._reply(b"")
+        elif path == base:
+            self._reply(_model_metadata(server.shape))
+        elif path == base + "/config":
+            self._reply(_model_config(server.shape, server.max_batch_size))
+        else:
+            self._reply({"error": "unknown path " + path}, status=404)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.split("?")[0]
+        if path.startswith("/v2/repository/"):
+            self._reply(b"")
+            return
+        if not path.endswith("/infer"):
+            self._reply({"error": "unknown path " + path}, status=404)
+            return
+
+        server.infer_requests += 1
+        header_length = self.headers.get("Inference-Header-Content-Length")
+        response_body, response_header_length = _infer(server, body, header_length)
+        headers = {}
+        if response_header_length is not None:
+            headers["Inference-Header-Content-Length"] = response_header_length
+        self._reply(response_body, headers=headers)
+
+
+def _infer(state, body, header_length):
+    """Echoes INPUT0 of a KServe v2 infer request back as OUTPUT0.
+
+    Returns
+    -------
+    (bytes, int)
+        The response body and the length of its JSON header, or None if
+        the response is plain JSON.
+    """
+    if header_length is None:
+        request = json.loads(body)
+        binary = b""
+    else:
+        header_length = int(header_length)
+        request = json.loads(body[:header_length])
+        binary = body[header_length:]
+
+    tensor = request["inputs"][0]
+    if state.delay:
+        # Like a single GPU, the simulated compute runs one batch at a time
+        with state.compute_lock:
+            time.sleep(state.delay * max(1, tensor["shape"][0]) ** 0.5)
+    state.batch_sizes.append(tensor["shape"][0])
+
+    output = {
+        "name": "OUTPUT0",
+        "datatype": tensor["datatype"],
+        "shape": tensor["shape"],
+    }
+    size = tensor.get("parameters", {}).get("binary_data_size")
+    if size is None:
+        output["data"] = tensor["data"]
+        return (
+            json.dumps({"model_name": MODEL_NAME, "outputs": [output]}).encode(),
+            None,
+        )
+    output["parameters"] = {"binary_data_size": size}
+    header = json.dumps({"model_name": MODEL_NAME, "outputs": [output]}).encode()
+    return header + binary[:size], len(header)
+
+
+def start_stub_server(shape=(-1, 4), max_batch_size=64, delay=0.0, port=0):
+    """Starts the stub server on a daemon thread.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape reported for INPUT0/OUTPUT0, including the batch dimension.
+    max_batch_size : int
+        Value reported as max_batch_size in the model config.
+    delay : float
+        Seconds of simulated compute for a batch of one; larger batches
+        cost delay * sqrt(batch_size). Batches are computed one at a time.
+    port : int
+        Port to listen on, defaults to 0 which picks a free port.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server. Its url attribute holds "host:port" and its
+        metadata_requests, infer_requests and batch_sizes attributes
+        count the traffic it has seen.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.shape = list(shape)
+    server.max_batch_size = max_batch_size
+    server.delay = delay
+    server.compute_lock = threading.Lock()
+    server.metadata_requests = 0
+    server.infer_requests = 0
+    server.batch_sizes = []
+    server.url = "127.0.0.1:{}".format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_aiohttp_stub_app(shape=(-1, 4), max_batch_size=64, delay=0.0):
+    """Builds an aiohttp application serving the same endpoints as the
+    threaded stub server, for exercising asyncio clients. The simulated
+    compute awaits asyncio.sleep so the event loop stays responsive.
+
+    Parameters are as for start_stub_server. The app's "state" entry
+    holds the traffic counters.
+    """
+    from aiohttp import web
+
+    state = types.SimpleNamespace(
+        shape=list(shape),
+        max_batch_size=max_batch_size,
+        delay=0.0,  # slept below without blocking the loop
+        metadata_requests=0,
+        infer_requests=0,
+        batch_sizes=[],
+    )
+    base = "/v2/models/" + MODEL_NAME
+
+    async def empty(request):
+        state.metadata_requests += 1
+        return web.Response(body=b"")
+
+    async def metadata(request):
+        state.metadata_requests += 1
+        return web.json_response(_model_metadata(state.shape))
+
+    async def config(request):
+        state.metadata_requests += 1
+        return web.json_response(_model_config(state.shape, state.max_batch_size))
+
+    async def infer(request):
+        state.infer_requests += 1
+        body = await request.read()
+        response_body, header_length = _infer(
+            state, body, request.headers.get("Inference-Header-Content-Length")
+        )
+        if delay:
+            async with request.app["compute_lock"]:
+                await asyncio.sleep(delay * max(1, state.batch_sizes[-1]) ** 0.5)
+        headers = {}
+        if header_length is not None:
+            headers["Inference-Header-Content-Length"] = str(header_length)
+        return web.Response(body=response_body, headers=headers)
+
+    async def create_lock(app):
+        app["compute_lock"] = asyncio.Lock()
+
+    app = web.Application()
+    app["state"] = state
+    app.on_startup.append(create_lock)
+    app.router.add_get("/v2/health/live", empty)
+    app.router.add_get("/v2/health/ready", empty)
+    app.router.add_get(base + "/ready", empty)
+    app.router.add_get(base, metadata)
+    app.router.add_get(base + "/config", config)
+    app.router.add_post(base + "/infer", infer)
+    app.router.add_post("/v2/repository/index", empty)
+    app.router.add_post("/v2/repository/models/{name}/load", empty)
+    app.router.add_post("/v2/repository/models/{name}/unload", empty)
+    return app
@@ -32,7 +32,6 @@ import rapidjson as json
 import numpy as np
 import gevent
 import gevent.pool
-import struct
 
 from tritonclientutils import *
 
@@ -72,7 +71,58 @@ def _get_query_string(query_params):
     return ""
 
 
-def _get_inference_request(
+# Request bodies smaller than this are joined into a single bytes object
+_SCATTER_GATHER_MIN_SIZE = 64 * 1024
+
+
+class _ScatterGatherBody:
+    """A request body made of a list of buffers which are written to the
+    socket one after another instead of being concatenated first.
+
+    The object exposes both the iterable and the file-like protocols
+    accepted by geventhttpclient, and its length is the total number of
+    bytes so that a Content-Length header is sent.
+
+    Parameters
+    ----------
+    buffers : list
+        The bytes-like objects (bytes, memoryview, ...) making up the body.
+    """
+
+    def __init__(self, buffers):
+        self._buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+        self._size = sum(len(buffer) for buffer in self._buffers)
+        self._index = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self._buffers)
+
+    def read(self, size=-1):
+        """Returns the rest of the current buffer as a memoryview into it.
+        'size' is ignored so that socket.sendfile() writes each buffer with
+        as few send calls as possible. Once the body is exhausted an empty
+        result is returned and reading starts over, so that a request that
+        is retried on a fresh connection sends the whole body again.
+        """
+        if self._index < len(self._buffers):
+            chunk = self._buffers[self._index]
+            self._index += 1
+            return chunk
+        self._index = 0
+        return b""
+
+    def tobytes(self):
+        """Returns the body joined into a single bytes object."""
+        return b"".join(self._buffers)
+
+    def __repr__(self):
+        return "<{} buffers, {} bytes>".format(len(self._buffers), self._size)
+
+
+def _get_inference_request_buffers(
     inputs,
     request_id,
     outputs,
@@ -104,26 +154,50 @@ def _get_inference_request(
     if parameters:
         infer_request["parameters"] = parameters
 
-    request_body = json.dumps(infer_request)
-    json_size = len(request_body)
-    binary_data = None
+    request_json = json.dumps(infer_request).encode()
+    buffers = [request_json]
     for input_tensor in inputs:
         raw_data = input_tensor._get_binary_data()
         if raw_data is not None:
-            if binary_data is not None:
-                binary_data += raw_data
-            else:
-                binary_data = raw_data
+            buffers.append(raw_data)
+
+    if len(buffers) > 1:
+        return buffers, len(request_json)
+    return buffers, None
 
-    if binary_data is not None:
-        request_body = struct.pack(
-            "{}s{}s".format(len(request_body), len(binary_data)),
-            request_body.encode(),
-            binary_data,
-        )
-        return request_body, json_size
 
-    return request_body, None
+def _get_inference_request(
+    inputs,
+    request_id,
+    outputs,
+    sequence_id,
+    sequence_start,
+    sequence_end,
+    priority,
+    timeout,
+):
+    """Returns the request body together with the JSON header size if
+    binary data follows it. Bodies larger than _SCATTER_GATHER_MIN_SIZE are
+    returned as a _ScatterGatherBody which references the JSON header and
+    each input's data without copying them; smaller ones are joined so that
+    they go out with the request headers in a single send.
+    """
+    buffers, json_size = _get_inference_request_buffers(
+        inputs=inputs,
+        request_id=request_id,
+        outputs=outputs,
+        sequence_id=sequence_id,
+        sequence_start=sequence_start,
+        sequence_end=sequence_end,
+        priority=priority,
+        timeout=timeout,
+    )
+    if json_size is None:
+        return buffers[0], None
+    body = _ScatterGatherBody(buffers)
+    if len(body) < _SCATTER_GATHER_MIN_SIZE:
+        return body.tobytes(), json_size
+    return body, json_size
 
 
 class InferenceServerClient:
@@ -240,7 +314,7 @@ class InferenceServerClient:
         ----------
         request_uri: str
             The request URI to be used in POST request.
-        request_body: str
+        request_body: str, bytes or _ScatterGatherBody
             The body of the request
         headers: dict
             Additional HTTP headers to include in the request.
@@ -1316,7 +1390,9 @@ class InferInput:
             Indicates whether to set data for the input in binary format
             or explicit tensor within JSON. The default value is True,
             which means the data will be delivered as binary data in the
-            HTTP body after the JSON object.
+            HTTP body after the JSON object. Binary data of C-contiguous
+            arrays is referenced, not copied, so the array must not be
+            modified until the request has been sent.
 
         Raises
         ------
@@ -1362,7 +1438,10 @@ class InferInput:
             if self._datatype == "BYTES":
                 self._raw_data = serialize_byte_tensor(input_tensor).tobytes()
             else:
-                self._raw_data = input_tensor.tobytes()
+                # Keep a view of the array rather than a copy; the data is
+                # written to the socket straight from the numpy buffer.
+                contiguous = np.ascontiguousarray(input_tensor)
+                self._raw_data = memoryview(contiguous).cast("B")
             self._parameters["binary_data_size"] = len(self._raw_data)
 
     def set_shared_memory(self, region_name, byte_size, offset=0):
@@ -1393,7 +1472,7 @@ class InferInput:
 
         Returns
         -------
-        bytes
+        bytes or memoryview
             The raw data for the input tensor
         """
         return self._raw_data
@@ -1541,8 +1620,9 @@ class InferResult:
 
             # Maps the output name to the index in buffer for quick retrieval
             self._output_name_to_buffer_map = {}
-            # Read the remaining data off the response body.
-            self._buffer = response.read()
+            # Read the remaining data off the response body. Outputs are
+            # decoded as views into this buffer.
+            self._buffer = memoryview(response.read())
             buffer_index = 0
             for output in self._result["outputs"]:
                 parameters = output.get("parameters")
@@ -1565,7 +1645,9 @@ class InferResult:
         -------
         numpy array
             The numpy array containing the response data for the tensor or
-            None if the data for specified tensor name is not found.
+            None if the data for specified tensor name is not found. Binary
+            outputs are returned as read-only views into the response
+            buffer; use .copy() to obtain a writable array.
         """
         if self._result.get("outputs") is not None:
             for output in self._result["outputs"]:
@@ -1586,7 +1668,7 @@ class InferResult:
                                     # need to decode the raw bytes to convert into
                                     # array elements.
                                     np_array = deserialize_bytes_tensor(
-                                        self._buffer[start_index:end_index]
+                                        self._buffer[start_index:end_index].tobytes()
                                     )
                                 else:
                                     np_array = np.frombuffer(
@@ -1599,7 +1681,7 @@ class InferResult:
                         np_array = np.array(
                             output["data"], dtype=triton_to_np_dtype(datatype)
                         )
-                    np_array = np.resize(np_array, output["shape"])
+                    np_array = np_array.reshape(output["shape"])
                     return np_array
         return None
 
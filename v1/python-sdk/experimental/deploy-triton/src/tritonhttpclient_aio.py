@@ -0,0 +1,362 @@
+"""
+tritonhttpclient_aio
+
+asyncio counterpart of tritonhttpclient.InferenceServerClient, built on
+aiohttp, for use from coroutines such as the @rawhttp `async def run`
+scoring handlers. The methods have the same names and arguments as the
+gevent based client but must be awaited. InferInput, InferRequestedOutput
+and InferResult are shared with tritonhttpclient.
+
+"""
+
+import asyncio
+
+from urllib.parse import quote
+
+import aiohttp
+import rapidjson as json
+
+from tritonclientutils import InferenceServerException, raise_error
+from tritonhttpclient import (
+    InferInput,
+    InferRequestedOutput,
+    InferResult,
+    _ScatterGatherBody,
+    _get_inference_request,
+    _get_query_string,
+)
+
+
+async def _iter_buffers(body):
+    """Yields the buffers of a _ScatterGatherBody, which aiohttp writes to
+    the connection one after another."""
+    for buffer in body:
+        yield buffer
+
+
+class _BufferedResponse:
+    """Adapts a fully read aiohttp response to the interface InferResult
+    expects from a geventhttpclient response."""
+
+    def __init__(self, headers, body):
+        self._headers = headers
+        self._body = body
+        self._offset = 0
+
+    def get(self, name, default=None):
+        return self._headers.get(name, default)
+
+    def read(self, length=None):
+        end = len(self._body) if length is None else self._offset + length
+        data = self._body[self._offset : end]
+        self._offset = end
+        return data
+
+
+class InferenceServerClient:
+    """An asyncio InferenceServerClient object is used to perform any kind
+    of communication with the InferenceServer using http protocol.
+
+    Parameters
+    ----------
+    url : str
+        The inference server URL, e.g. 'localhost:8000'.
+    connection_count : int
+        The maximum number of keep-alive connections kept open to the
+        server. Default value is 4.
+    max_concurrency : int
+        The maximum number of requests in flight at once. Callers beyond
+        this limit wait for a slot, which applies back-pressure instead of
+        queueing unbounded work on the server. Default value is None,
+        which means connection_count.
+    connection_timeout : float
+        The timeout value for establishing a connection. Default value
+        is 60.0 sec.
+    network_timeout : float
+        The timeout value for a whole request. Default value is 60.0 sec.
+    keepalive_timeout : float
+        Seconds an idle pooled connection is kept open. Default value is
+        30.0 sec.
+    verbose : bool
+        If True generate verbose output. Default value is False.
+
+    """
+
+    def __init__(
+        self,
+        url,
+        connection_count=4,
+        max_concurrency=None,
+        connection_timeout=60.0,
+        network_timeout=60.0,
+        keepalive_timeout=30.0,
+        verbose=False,
+    ):
+        if not url.startswith("http://") and not url.startswith("https://"):
+            url = "http://" + url
+        self._base_url = url.rstrip("/")
+        self._connection_count = connection_count
+        self._max_concurrency = max_concurrency or connection_count
+        self._timeout = aiohttp.ClientTimeout(
+            total=network_timeout, connect=connection_timeout
+        )
+        self._keepalive_timeout = keepalive_timeout
+        self._verbose = verbose
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the client and its pooled connections. Any future calls
+        to server will open a new pool.
+
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # aiohttp sessions and semaphores are bound to the running loop, so
+        # they are created on first use rather than in __init__.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connection_count,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self._timeout
+            )
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._session
+
+    def _get_url(self, request_uri, query_params):
+        url = self._base_url + "/" + request_uri
+        if query_params is not None:
+            url = url + "?" + _get_query_string(query_params)
+        return url
+
+    async def _request(self, method, request_uri, request_body, headers, query_params):
+        """Issues the request and reads the whole response.
+
+        Returns
+        -------
+        (int, dict, bytes)
+            The status code, headers and body of the response.
+        """
+        session = self._get_session()
+        url = self._get_url(request_uri, query_params)
+
+        if self._verbose:
+            print("{} {}, headers {}".format(method, url, headers))
+
+        async with self._semaphore:
+            async with session.request(
+                method, url, data=request_body, headers=headers
+            ) as response:
+                body = await response.read()
+                status = response.status
+                response_headers = response.headers
+
+        if self._verbose:
+            print(status, body[:1024])
+
+        if status != 200:
+            try:
+                message = json.loads(body)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = body.decode(errors="replace")
+            raise InferenceServerException(msg=message)
+        return status, response_headers, body
+
+    async def _status(self, request_uri, headers, query_params):
+        session = self._get_session()
+        url = self._get_url(request_uri, query_params)
+        async with self._semaphore:
+            async with session.get(url, headers=headers) as response:
+                await response.read()
+                return response.status == 200
+
+    async def _get_json(self, request_uri, headers, query_params):
+        _, _, body = await self._request(
+            "GET", request_uri, None, headers, query_params
+        )
+        return json.loads(body)
+
+    async def _post_json(self, request_uri, request_body, headers, query_params):
+        _, _, body = await self._request(
+            "POST", request_uri, request_body, headers, query_params
+        )
+        return json.loads(body) if body else None
+
+    @staticmethod
+    def _model_uri(model_name, model_version, suffix=""):
+        if type(model_version) != str:
+            raise_error("model version must be a string")
+        if model_version != "":
+            uri = "v2/models/{}/versions/{}".format(quote(model_name), model_version)
+        else:
+            uri = "v2/models/{}".format(quote(model_name))
+        return uri + suffix
+
+    async def is_server_live(self, headers=None, query_params=None):
+        """Contact the inference server and get liveness.
+
+        See tritonhttpclient.InferenceServerClient.is_server_live.
+        """
+        return await self._status("v2/health/live", headers, query_params)
+
+    async def is_server_ready(self, headers=None, query_params=None):
+        """Contact the inference server and get readiness.
+
+        See tritonhttpclient.InferenceServerClient.is_server_ready.
+        """
+        return await self._status("v2/health/ready", headers, query_params)
+
+    async def is_model_ready(
+        self, model_name, model_version="", headers=None, query_params=None
+    ):
+        """Contact the inference server and get the readiness of specified model.
+
+        See tritonhttpclient.InferenceServerClient.is_model_ready.
+        """
+        return await self._status(
+            self._model_uri(model_name, model_version, "/ready"), headers, query_params
+        )
+
+    async def get_server_metadata(self, headers=None, query_params=None):
+        """Contact the inference server and get its metadata.
+
+        See tritonhttpclient.InferenceServerClient.get_server_metadata.
+        """
+        return await self._get_json("v2", headers, query_params)
+
+    async def get_model_metadata(
+        self, model_name, model_version="", headers=None, query_params=None
+    ):
+        """Contact the inference server and get the metadata for specified model.
+
+        See tritonhttpclient.InferenceServerClient.get_model_metadata.
+        """
+        return await self._get_json(
+            self._model_uri(model_name, model_version), headers, query_params
+        )
+
+    async def get_model_config(
+        self, model_name, model_version="", headers=None, query_params=None
+    ):
+        """Contact the inference server and get the configuration for specified model.
+
+        See tritonhttpclient.InferenceServerClient.get_model_config.
+        """
+        return await self._get_json(
+            self._model_uri(model_name, model_version, "/config"),
+            headers,
+            query_params,
+        )
+
+    async def get_model_repository_index(self, headers=None, query_params=None):
+        """Get the index of model repository contents
+
+        See tritonhttpclient.InferenceServerClient.get_model_repository_index.
+        """
+        return await self._post_json("v2/repository/index", b"", headers, query_params)
+
+    async def load_model(self, model_name, headers=None, query_params=None):
+        """Request the inference server to load or reload specified model.
+
+        See tritonhttpclient.InferenceServerClient.load_model.
+        """
+        request_uri = "v2/repository/models/{}/load".format(quote(model_name))
+        await self._post_json(request_uri, b"", headers, query_params)
+        if self._verbose:
+            print("Loaded model '{}'".format(model_name))
+
+    async def unload_model(self, model_name, headers=None, query_params=None):
+        """Request the inference server to unload specified model.
+
+        See tritonhttpclient.InferenceServerClient.unload_model.
+        """
+        request_uri = "v2/repository/models/{}/unload".format(quote(model_name))
+        await self._post_json(request_uri, b"", headers, query_params)
+        if self._verbose:
+            print("Unloaded model '{}'".format(model_name))
+
+    async def get_inference_statistics(
+        self, model_name="", model_version="", headers=None, query_params=None
+    ):
+        """Get the inference statistics for the specified model name and
+        version.
+
+        See tritonhttpclient.InferenceServerClient.get_inference_statistics.
+        """
+        if model_name != "":
+            request_uri = self._model_uri(model_name, model_version, "/stats")
+        else:
+            request_uri = "v2/models/stats"
+        return await self._get_json(request_uri, headers, query_params)
+
+    async def infer(
+        self,
+        model_name,
+        inputs,
+        model_version="",
+        outputs=None,
+        request_id="",
+        sequence_id=0,
+        sequence_start=False,
+        sequence_end=False,
+        priority=0,
+        timeout=None,
+        headers=None,
+        query_params=None,
+    ):
+        """Run inference using the supplied 'inputs' requesting the outputs
+        specified by 'outputs'. The coroutine yields to the event loop while
+        waiting for a connection slot and for the server's response.
+
+        See tritonhttpclient.InferenceServerClient.infer for the parameters.
+
+        Returns
+        -------
+        InferResult
+            The object holding the result of the inference.
+
+        Raises
+        ------
+        InferenceServerException
+            If server fails to perform inference.
+        """
+        request_body, json_size = _get_inference_request(
+            inputs=inputs,
+            request_id=request_id,
+            outputs=outputs,
+            sequence_id=sequence_id,
+            sequence_start=sequence_start,
+            sequence_end=sequence_end,
+            priority=priority,
+            timeout=timeout,
+        )
+
+        if json_size is not None:
+            headers = dict(headers) if headers is not None else {}
+            headers["Inference-Header-Content-Length"] = str(json_size)
+        if isinstance(request_body, _ScatterGatherBody):
+            # the input tensors are written from their numpy buffers rather
+            # than joined into one bytes object; with the length known the
+            # body is not sent chunked
+            headers["Content-Length"] = str(len(request_body))
+            request_body = _iter_buffers(request_body)
+
+        _, response_headers, body = await self._request(
+            "POST",
+            self._model_uri(model_name, model_version, "/infer"),
+            request_body,
+            headers,
+            query_params,
+        )
+        return InferResult(_BufferedResponse(response_headers, body), self._verbose)
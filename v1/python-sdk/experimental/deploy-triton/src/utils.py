@@ -1,7 +1,13 @@
+import time
+
 import tritonhttpclient
 
+# Maps (model_name, model_version) to (expiry, parsed model metadata)
+_model_cache = {}
+_model_cache_ttl = 300.0
+
 
-def triton_init(url="localhost:8000"):
+def triton_init(url="localhost:8000", connection_count=4, metadata_ttl=300.0):
     """Initializes the triton client to point at the specified URL
 
     Parameter
@@ -9,12 +15,66 @@ def triton_init(url="localhost:8000"):
     url : str
         The URL on which to address the Triton server, defaults to
         localhost:8000
+
+    connection_count : int
+        The number of keep-alive connections the client pools, defaults
+        to 4 so concurrent requests do not queue behind a single socket.
+
+    metadata_ttl : float
+        Seconds for which model metadata fetched by parse_model_http is
+        reused, defaults to 300. Use 0 to disable the cache.
     """
-    global triton_client
-    triton_client = tritonhttpclient.InferenceServerClient(url)
+    global triton_client, _model_cache_ttl
+    triton_client = tritonhttpclient.InferenceServerClient(
+        url, connection_count=connection_count
+    )
+    _model_cache_ttl = metadata_ttl
+    _model_cache.clear()
     return triton_client
 
 
+def invalidate_model_cache(model_name=None):
+    """Drops cached metadata for a model, or for every model if
+    model_name is None.
+
+    Arguments
+    --------
+    model_name : str
+        Optional, name of the model whose cached metadata to drop.
+    """
+    if model_name is None:
+        _model_cache.clear()
+        return
+    for key in [key for key in _model_cache if key[0] == model_name]:
+        _model_cache.pop(key, None)
+
+
+def load_model(model_name):
+    """Requests the Triton server to load or reload a model and drops
+    any cached metadata for it.
+
+    Arguments
+    --------
+    model_name : str
+        Name of the model to load
+    """
+    triton_client.load_model(model_name)
+    invalidate_model_cache(model_name)
+
+
+def unload_model(model_name):
+    """Requests the Triton server to unload a model and drops any
+    cached metadata for it.
+
+    Arguments
+    --------
+    model_name : str
+        Name of the model to unload
+    """
+    triton_client.unload_model(model_name)
+    invalidate_model_cache(model_name)
+
+
 def get_model_info():
     """Gets metadata for all models hosted behind the Triton endpoint.
     Useful for confirming that your models were loaded into memory.
@@ -35,7 +95,7 @@ def get_model_info():
         )
 
 
-def parse_model_http(model_name, model_version=""):
+def parse_model_http(model_name, model_version="", use_cache=True):
     """Check the configuration of a model to make sure it meets the
     requirements for an image classification network (as expected by
     this client)
@@ -48,8 +108,18 @@ def parse_model_http(model_name, model_version=""):
     model_version : str
         Optional, the version of the model, defaults to empty string.
 
+    use_cache : bool
+        Whether to reuse metadata fetched within the last metadata_ttl
+        seconds instead of querying the server again. Defaults to True.
+
     From https://github.com/triton-inference-server/server/blob/master/src/clients/python/examples/image_client.py  # noqa
     """
+    key = (model_name, model_version)
+    if use_cache and _model_cache_ttl > 0:
+        cached = _model_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
     model_metadata = triton_client.get_model_metadata(
         model_name=model_name, model_version=model_version
     )
@@ -57,16 +127,24 @@ def parse_model_http(model_name, model_version=""):
         model_name=model_name, model_version=model_version
     )
 
-    return (
+    parsed = (
         model_metadata["inputs"],
         model_config["input"],
         model_metadata["outputs"],
         model_config["output"],
     )
+    if _model_cache_ttl > 0:
+        _model_cache[key] = (time.monotonic() + _model_cache_ttl, parsed)
+    return parsed
 
 
 def triton_infer(
-    input_mapping, model_name, binary_data=False, binary_output=False, class_count=0
+    input_mapping,
+    model_name,
+    binary_data=False,
+    binary_output=False,
+    class_count=0,
+    model_version="",
 ):
     """Helper function for setting Triton inputs and executing a request
 
@@ -87,12 +165,15 @@ def triton_infer(
         If the model is a classification model, the number of output classes.
         Defaults to 0, indicating this is not a classification model.
 
+    model_version : str
+        Optional, the version of the model, defaults to empty string.
+
     Returns
     ----------
     res : InferResult
         Triton inference result containing output from running prediction
     """
-    input_meta, _, output_meta, _ = parse_model_http(model_name)
+    input_meta, _, output_meta, _ = parse_model_http(model_name, model_version)
 
     inputs = []
     outputs = []
@@ -116,6 +197,12 @@ def triton_infer(
         outputs.append(output)
 
     # Run inference
-    res = triton_client.infer(model_name, inputs, request_id="0", outputs=outputs)
+    res = triton_client.infer(
+        model_name,
+        inputs,
+        model_version=model_version,
+        request_id="0",
+        outputs=outputs,
+    )
 
     return res